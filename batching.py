@@ -0,0 +1,344 @@
+# batching.py
+"""Iteration-level batching of generation requests on one causal LM.
+
+A `DecodeBatch` holds the running sequences of one model (one base model +
+adapter) and their shared KV cache. Each iteration decodes one token for
+every sequence with a single forward pass. New requests join between
+iterations: they are prefilled on their own, and their cache is left-padded
+to the batch's length and concatenated on the batch dimension (and vice
+versa). Finished or cancelled sequences are dropped from the cache right
+away, so short requests do not wait for long ones and a freed row is
+reusable on the next iteration.
+
+Requests with a chat session id reuse the KV cache of that session's previous
+turn for the longest common token prefix (`PrefixCache`).
+
+Streaming requests are detokenized incrementally as tokens arrive: only a
+short window of recent tokens is decoded per token, and text is held back
+while it ends in an incomplete UTF-8 sequence.
+
+Everything here runs on the inference thread; requests are created and
+completed on the event loop (see `inference.InferenceServer`).
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IncrementalDetokenizer:
+    """Turns a growing list of token ids into text deltas."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        # tokens[prefix_offset:read_offset] were decoded last time and give the context
+        # (e.g. a leading space) for decoding the tokens after them
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, ids: List[int]) -> str:
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def push(self, tokens: List[int]) -> str:
+        prefix = self._decode(tokens[self.prefix_offset:self.read_offset])
+        text = self._decode(tokens[self.prefix_offset:])
+        if len(text) <= len(prefix) or text.endswith("\ufffd"):
+            return ""
+        self.prefix_offset, self.read_offset = self.read_offset, len(tokens)
+        return text[len(prefix):]
+
+    def flush(self, tokens: List[int]) -> str:
+        """Whatever is still held back once the sequence is complete."""
+        prefix = self._decode(tokens[self.prefix_offset:self.read_offset])
+        text = self._decode(tokens[self.prefix_offset:])
+        self.prefix_offset = self.read_offset = len(tokens)
+        return text[len(prefix):]
+
+
+class GenerationRequest:
+    """One prompt to complete; `future` resolves to the decoded text.
+
+    A streaming request also collects text deltas in `pending` (on the inference
+    thread), which the scheduler moves to `stream` after every iteration.
+    """
+
+    def __init__(self, model_name: str, adapter_id: Optional[str], adapter_path: Optional[str],
+                 prompt: str, max_new_tokens: int, stream: bool = False, session_id: Optional[str] = None):
+        self.key = (model_name, adapter_id)
+        self.session_key = (model_name, adapter_id, session_id) if session_id is not None else None
+        self.adapter_path = adapter_path
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.prompt_ids: List[int] = []
+        self.tokens: List[int] = []
+        self.text: Optional[str] = None
+        self.finished = False
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.stream: Optional[asyncio.Queue] = asyncio.Queue() if stream else None
+        self.detokenizer: Optional[IncrementalDetokenizer] = None
+        self.pending: List[str] = []
+        self.cached_tokens = 0
+        self.prefill_seconds = 0.0
+        self.prefill_seconds_saved = 0.0
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": len(self.prompt_ids), "completion_tokens": len(self.tokens),
+            "cached_tokens": self.cached_tokens, "prefill_seconds": round(self.prefill_seconds, 4),
+            "prefill_seconds_saved": round(self.prefill_seconds_saved, 4),
+        }
+
+    def take_pending(self) -> List[str]:
+        pending, self.pending = self.pending, []
+        return pending
+
+
+def cache_layers(cache) -> List[Tuple[Any, Any]]:
+    """(key, value) tensors per layer, shaped [batch, heads, seq, head_dim], of a KV cache."""
+    if isinstance(cache, (tuple, list)):
+        return [(layer[0], layer[1]) for layer in cache]
+    if hasattr(cache, "layers"):  # transformers >= 4.56
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def build_cache(kind: type, layers: List[Tuple[Any, Any]]):
+    """A KV cache of class `kind` (a legacy tuple or a transformers Cache) holding `layers`."""
+    if issubclass(kind, (tuple, list)):
+        return tuple(layers)
+    cache = kind()
+    for index, (key, value) in enumerate(layers):
+        cache.update(key, value, index)
+    return cache
+
+
+def _left_pad(tensor, length: int, dim: int):
+    import torch
+
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+class _Prefix:
+    def __init__(self, token_ids: List[int], kind: type, layers: List[Tuple[Any, Any]]):
+        self.token_ids = token_ids
+        self.kind = kind
+        self.layers = layers
+        self.size = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+
+
+class PrefixCache:
+    """KV caches of recent chat sessions, evicted least recently used over `memory_budget` bytes.
+
+    A session's next turn usually re-sends the whole conversation so far, so the
+    key/values of its previous prompt and reply are kept and only the tokens
+    after the longest common prefix need a prefill.
+    """
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self._entries: "OrderedDict[tuple, _Prefix]" = OrderedDict()
+        self.used = 0
+        self.counters = {"hits": 0, "misses": 0, "tokens_reused": 0, "prefill_seconds_saved": 0.0}
+
+    def lookup(self, key: tuple, prompt_ids: List[int]) -> Tuple[Optional[_Prefix], int]:
+        """The session's cached prefix and how many leading tokens of `prompt_ids` it covers."""
+        entry = self._entries.get(key)
+        reused = 0
+        if entry is not None:
+            # At least one prompt token has to go through the model to get next-token logits
+            limit = min(len(entry.token_ids), len(prompt_ids) - 1)
+            while reused < limit and entry.token_ids[reused] == prompt_ids[reused]:
+                reused += 1
+        if not reused:
+            self.counters["misses"] += 1
+            return None, 0
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        self.counters["tokens_reused"] += reused
+        return entry, reused
+
+    def put(self, key: tuple, token_ids: List[int], kind: type, layers: List[Tuple[Any, Any]]):
+        self.drop(key)
+        entry = _Prefix(token_ids, kind, layers)
+        if entry.size > self.memory_budget:
+            return
+        self._entries[key] = entry
+        self.used += entry.size
+        while self.used > self.memory_budget:
+            _, evicted = self._entries.popitem(last=False)
+            self.used -= evicted.size
+
+    def drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.used -= entry.size
+
+    def drop_adapter(self, adapter_id: str):
+        for key in [key for key in self._entries if key[1] == adapter_id]:
+            self.drop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._entries), "memory_budget": self.memory_budget, "memory_used": self.used,
+                **self.counters, "prefill_seconds_saved": round(self.counters["prefill_seconds_saved"], 4)}
+
+
+class DecodeBatch:
+    """Running sequences of one model sharing a KV cache."""
+
+    def __init__(self, tokenizer, prefix_cache: Optional[PrefixCache] = None):
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.requests: List[GenerationRequest] = []
+        self.cache = None
+        self.attention_mask = None  # [batch, cached positions]; 0 marks left padding
+        self.next_tokens = None  # [batch]; sampled but not yet fed through the model
+        eos = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else (eos or 0)
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def _append(self, requests: List[GenerationRequest], tokens) -> List[GenerationRequest]:
+        """Append one sampled token to each request; returns the requests that are now done."""
+        done = []
+        for request, token in zip(requests, tokens.tolist()):
+            request.tokens.append(token)
+            if request.stream is not None:
+                if request.detokenizer is None:
+                    request.detokenizer = IncrementalDetokenizer(self.tokenizer)
+                delta = request.detokenizer.push(request.tokens)
+                if delta:
+                    request.pending.append(delta)
+            if (token == self.tokenizer.eos_token_id or len(request.tokens) >= request.max_new_tokens
+                    or request.cancelled):
+                request.finished = True
+                done.append(request)
+        return done
+
+    def _prefill(self, model, requests: List[GenerationRequest], prefix: Optional[_Prefix] = None, reused: int = 0):
+        """Run the prompts of `requests` (after the `reused` tokens of a single request's `prefix`) through the model."""
+        import torch
+
+        started = time.perf_counter()
+        prompts = [request.prompt_ids[reused:] for request in requests]
+        length = max(len(prompt) for prompt in prompts)
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), reused + length), dtype=torch.long)
+        for row, prompt in enumerate(prompts):
+            input_ids[row, length - len(prompt):] = torch.tensor(prompt)
+            attention_mask[row, reused + length - len(prompt):] = 1
+        if prefix is not None:
+            attention_mask[:, :reused] = 1
+        input_ids, attention_mask = input_ids.to(model.device), attention_mask.to(model.device)
+        past = None
+        if prefix is not None:
+            past = build_cache(prefix.kind, [(k[:, :, :reused], v[:, :, :reused]) for k, v in prefix.layers])
+        with torch.inference_mode():
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask,
+                            position_ids=(attention_mask.cumsum(-1) - 1).clamp(min=0)[:, reused:],
+                            past_key_values=past, use_cache=True)
+        tokens = outputs.logits[:, -1, :].argmax(-1)
+        elapsed = time.perf_counter() - started
+        for request, prompt in zip(requests, prompts):
+            request.cached_tokens = reused
+            request.prefill_seconds = elapsed
+            if reused:
+                # Estimated at this prefill's cost per token
+                request.prefill_seconds_saved = elapsed * reused / len(prompt)
+                self.prefix_cache.counters["prefill_seconds_saved"] += request.prefill_seconds_saved
+        return outputs.past_key_values, attention_mask, tokens
+
+    def _merge(self, requests: List[GenerationRequest], cache, attention_mask, tokens):
+        import torch
+
+        if self.cache is None:
+            self.cache, self.attention_mask, self.next_tokens = cache, attention_mask, tokens
+            self.requests = list(requests)
+            return
+        width = max(self.attention_mask.shape[1], attention_mask.shape[1])
+        self.cache = build_cache(type(self.cache), [
+            (torch.cat([_left_pad(k, width, 2), _left_pad(k_new, width, 2)]),
+             torch.cat([_left_pad(v, width, 2), _left_pad(v_new, width, 2)]))
+            for (k, v), (k_new, v_new) in zip(cache_layers(self.cache), cache_layers(cache))
+        ])
+        self.attention_mask = torch.cat([_left_pad(self.attention_mask, width, 1), _left_pad(attention_mask, width, 1)])
+        self.next_tokens = torch.cat([self.next_tokens, tokens])
+        self.requests.extend(requests)
+
+    def admit(self, model, requests: List[GenerationRequest]) -> List[GenerationRequest]:
+        """Prefill `requests` and merge them into the batch; returns those already done."""
+        fresh, done = [], []
+        for request in requests:
+            request.prompt_ids = list(self.tokenizer(request.prompt)["input_ids"])
+            prefix, reused = None, 0
+            if self.prefix_cache is not None and request.session_key is not None:
+                prefix, reused = self.prefix_cache.lookup(request.session_key, request.prompt_ids)
+            if prefix is None:
+                fresh.append(request)
+            else:
+                # Each cached prefix has its own length, so these are prefilled one by one
+                cache, attention_mask, tokens = self._prefill(model, [request], prefix, reused)
+                self._merge([request], cache, attention_mask, tokens)
+                done += self._append([request], tokens)
+        if fresh:
+            cache, attention_mask, tokens = self._prefill(model, fresh)
+            self._merge(fresh, cache, attention_mask, tokens)
+            done += self._append(fresh, tokens)
+        return done
+
+    def step(self, model) -> List[GenerationRequest]:
+        """Decode one token for every running sequence; returns the requests that are now done."""
+        import torch
+
+        attention_mask = torch.cat([self.attention_mask, self.attention_mask.new_ones((len(self.requests), 1))], dim=1)
+        with torch.inference_mode():
+            outputs = model(input_ids=self.next_tokens[:, None], attention_mask=attention_mask,
+                            position_ids=attention_mask.sum(-1, keepdim=True) - 1,
+                            past_key_values=self.cache, use_cache=True)
+        self.cache, self.attention_mask = outputs.past_key_values, attention_mask
+        self.next_tokens = outputs.logits[:, -1, :].argmax(-1)
+        return self._append(self.requests, self.next_tokens)
+
+    def retire(self):
+        """Drop finished and cancelled sequences from the batch and its cache."""
+        import torch
+
+        keep = [row for row, request in enumerate(self.requests) if not (request.finished or request.cancelled)]
+        if len(keep) == len(self.requests):
+            return
+        layers = cache_layers(self.cache)
+        for row, request in enumerate(self.requests):
+            if not (request.finished or request.cancelled):
+                continue
+            request.text = self.tokenizer.decode(request.prompt_ids + request.tokens)
+            if request.detokenizer is not None:
+                tail = request.detokenizer.flush(request.tokens)
+                if tail:
+                    request.pending.append(tail)
+            if self.prefix_cache is not None and request.session_key is not None:
+                # The cache holds the prompt and every generated token but the last, which was never fed back
+                start = self.attention_mask.shape[1] - int(self.attention_mask[row].sum())
+                self.prefix_cache.put(request.session_key, request.prompt_ids + request.tokens[:-1], type(self.cache),
+                                      [(k[row:row + 1, :, start:].clone(), v[row:row + 1, :, start:].clone())
+                                       for k, v in layers])
+        if not keep:
+            self.requests, self.cache, self.attention_mask, self.next_tokens = [], None, None, None
+            return
+        index = torch.tensor(keep, device=self.attention_mask.device)
+        attention_mask = self.attention_mask.index_select(0, index)
+        # Columns that are padding for every remaining row can go too
+        start = int((attention_mask.sum(0) > 0).nonzero()[0])
+        self.attention_mask = attention_mask[:, start:]
+        self.cache = build_cache(type(self.cache), [
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:]) for k, v in layers
+        ])
+        self.next_tokens = self.next_tokens.index_select(0, index)
+        self.requests = [self.requests[row] for row in keep]
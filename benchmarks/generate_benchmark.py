@@ -0,0 +1,125 @@
+# benchmarks/generate_benchmark.py
+"""Compare /generate throughput and tail latency: one request at a time vs continuous batching.
+
+    python benchmarks/generate_benchmark.py [--requests 64] [--rates 2 8 32] [--max-batch-size 8]
+
+A small randomly initialised GPT-2 on the CPU stands in for the real model,
+with a byte-level tokenizer, so nothing is downloaded. Requests arrive as a
+Poisson process at each rate (requests/sec), with prompt lengths and
+max_new_tokens drawn at random (same seed for both modes). "sequential" is
+the previous /generate path: one `model.generate` call per request on the
+inference thread. "batched" goes through InferenceServer.generate.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from inference import InferenceServer  # noqa: E402
+
+
+class ByteTokenizer:
+    """UTF-8 bytes as token ids; no end-of-sequence token, so every request runs to max_new_tokens."""
+
+    eos_token_id = None
+    pad_token_id = 0
+
+    def __call__(self, text: str):
+        return {"input_ids": list(text.encode("utf-8"))}
+
+    def decode(self, ids) -> str:
+        return bytes(i for i in ids if i < 256).decode("utf-8", errors="replace")
+
+
+def tiny_model(layers: int, width: int):
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=256, n_positions=1024, n_embd=width, n_layer=layers, n_head=4)
+    return GPT2LMHeadModel(config).eval()
+
+
+def workload(count: int, rate: float, seed: int):
+    rng = random.Random(seed)
+    arrival = 0.0
+    for _ in range(count):
+        arrival += rng.expovariate(rate)
+        prompt = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(16, 200)))
+        yield arrival, prompt, rng.randint(16, 128)
+
+
+async def replay(requests, generate):
+    """Submit each request at its arrival time; returns (wall seconds, per-request latencies)."""
+    started = time.perf_counter()
+    latencies = []
+
+    async def one(arrival, prompt, max_new_tokens):
+        await asyncio.sleep(max(0.0, arrival - (time.perf_counter() - started)))
+        submitted = time.perf_counter()
+        await generate(prompt, max_new_tokens)
+        latencies.append(time.perf_counter() - submitted)
+
+    await asyncio.gather(*(one(*request) for request in requests))
+    return time.perf_counter() - started, latencies
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def bench(args):
+    import torch
+
+    torch.set_num_threads(args.threads)
+    model, tokenizer = tiny_model(args.layers, args.width), ByteTokenizer()
+
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def generate_one(prompt, max_new_tokens):
+        inputs = torch.tensor([tokenizer(prompt)["input_ids"]])
+        with torch.inference_mode():
+            model.generate(inputs, attention_mask=torch.ones_like(inputs), max_new_tokens=max_new_tokens,
+                           min_new_tokens=max_new_tokens, do_sample=False, pad_token_id=0, use_cache=True)
+
+    async def sequential(prompt, max_new_tokens):
+        await asyncio.get_running_loop().run_in_executor(executor, generate_one, prompt, max_new_tokens)
+
+    server = InferenceServer(2**40, max_batch_size=args.max_batch_size, load_base=lambda name, length: (model, tokenizer))
+
+    async def batched(prompt, max_new_tokens):
+        await server.generate("tiny-gpt2", None, None, prompt, max_new_tokens)
+
+    print(f"{'rate (req/s)':>12} {'mode':<10} {'tokens/sec':>11} {'p50 (s)':>9} {'p99 (s)':>9}")
+    for rate in args.rates:
+        requests = list(workload(args.requests, rate, args.seed))
+        tokens = sum(max_new_tokens for _, _, max_new_tokens in requests)
+        for name, generate in (("sequential", sequential), ("batched", batched)):
+            wall, latencies = await replay(requests, generate)
+            print(f"{rate:>12g} {name:<10} {tokens / wall:>11.1f} "
+                  f"{percentile(latencies, 0.5):>9.2f} {percentile(latencies, 0.99):>9.2f}")
+    server.shutdown()
+    executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--rates", type=float, nargs="+", default=[2, 8, 32])
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
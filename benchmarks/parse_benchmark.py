@@ -0,0 +1,88 @@
+# benchmarks/parse_benchmark.py
+"""Measure document extraction throughput.
+
+    python benchmarks/parse_benchmark.py path/to/book.pdf [--workers 1 2 4 8]
+    python benchmarks/parse_benchmark.py path/to/notes.md
+
+For PDFs this reports pages/sec for the old single-threaded loop and for
+iter_pdf_pages at each worker count. For Markdown it compares the old
+render-to-HTML-and-strip approach with the token-stream conversion.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from document_parsing import iter_markdown_blocks, iter_pdf_pages, pdf_page_count  # noqa: E402
+
+
+def bench_pdf(path: str, worker_counts, repeats: int):
+    import pypdf
+
+    pages = pdf_page_count(path)
+    print(f"{path}: {pages} pages")
+
+    def serial():
+        text = ""
+        for page in pypdf.PdfReader(path).pages:
+            text = text + page.extract_text() + "\n"
+        return text
+
+    def best_of(fn):
+        best = float("inf")
+        for _ in range(repeats):
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    baseline = best_of(serial)
+    print(f"  {'baseline (serial concat)':<26} {pages / baseline:10.1f} pages/sec")
+    for workers in worker_counts:
+        elapsed = best_of(lambda: sum(len(page) for page in iter_pdf_pages(path, workers)))
+        print(f"  {f'iter_pdf_pages x{workers}':<26} {pages / elapsed:10.1f} pages/sec  ({baseline / elapsed:.2f}x)")
+
+
+def bench_markdown(path: str, repeats: int):
+    from markdown_it import MarkdownIt
+
+    text = Path(path).read_text(encoding="utf-8")
+    size_mb = len(text.encode()) / 1e6
+
+    def html_strip():
+        return re.sub('<[^<]+?>', '', MarkdownIt().render(text))
+
+    def token_stream():
+        return "".join(iter_markdown_blocks(text))
+
+    for name, fn in (("render + strip tags", html_strip), ("token stream", token_stream)):
+        best = float("inf")
+        for _ in range(repeats):
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        print(f"  {name:<26} {size_mb / best:10.2f} MB/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.path.lower().endswith(".pdf"):
+        bench_pdf(args.path, args.workers, args.repeats)
+    elif args.path.lower().endswith(".md"):
+        bench_markdown(args.path, args.repeats)
+    else:
+        sys.exit("Expected a .pdf or .md file")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# blob_store.py
+"""Content-addressed storage for uploaded datasets.
+
+File contents are stored once under `blobs/<sha256><ext>`, and logical
+upload names are references to a blob kept in a small JSON index. Uploading
+the same bytes again under any name only adds a reference, and re-using a
+name never touches the blob an earlier (possibly still queued) job pinned.
+The extension is part of the blob name because it decides how the document
+is parsed.
+"""
+
+import asyncio
+import bisect
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dataset_cache import hash_file
+
+
+class BlobStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.root / "index.json"
+        self._save_lock = asyncio.Lock()
+        try:
+            with open(self._index_path, "r") as f:
+                self._refs: Dict[str, Dict[str, Any]] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._refs = {}
+
+    @staticmethod
+    def blob_name(sha256: str, filename: str) -> str:
+        return sha256 + Path(filename).suffix.lower()
+
+    def blob_path(self, blob: str) -> Path:
+        return self.blob_dir / blob
+
+    def has_blob(self, sha256: str, filename: str) -> bool:
+        return self.blob_path(self.blob_name(sha256, filename)).exists()
+
+    def resolve(self, name: str) -> Optional[Dict[str, Any]]:
+        """The reference for a logical name: blob, sha256, size and upload time."""
+        return self._refs.get(name)
+
+    def list(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """References in name order, optionally only those after the name `after` and at most `limit`."""
+        names = sorted(self._refs)
+        start = bisect.bisect_right(names, after) if after is not None else 0
+        end = start + limit if limit is not None else len(names)
+        return [{"name": name, **self._refs[name]} for name in names[start:end]]
+
+    def _write_index(self, refs: Dict[str, Dict[str, Any]]):
+        tmp_path = self._index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(refs, f)
+        os.replace(tmp_path, self._index_path)
+
+    async def _save(self):
+        async with self._save_lock:
+            await asyncio.to_thread(self._write_index, dict(self._refs))
+
+    async def link(self, name: str, sha256: str, filename: str) -> Dict[str, Any]:
+        """Point `name` at an existing blob; the recorded size is the blob's own."""
+        blob = self.blob_name(sha256, filename)
+        size = (await asyncio.to_thread(self.blob_path(blob).stat)).st_size
+        self._refs[name] = {"blob": blob, "sha256": sha256, "size": size, "uploaded_at": time.time()}
+        await self._save()
+        return self._refs[name]
+
+    async def put_file(self, src: Path, name: str, sha256: str) -> Dict[str, Any]:
+        """Take ownership of `src` (already hashed) and store it under `name`.
+
+        If the content is already stored, `src` is simply dropped.
+        """
+        blob_path = self.blob_path(self.blob_name(sha256, name))
+        existed = blob_path.exists()
+        if existed:
+            await asyncio.to_thread(Path(src).unlink, True)
+        else:
+            await asyncio.to_thread(os.replace, src, blob_path)
+        ref = await self.link(name, sha256, name)
+        return {**ref, "deduplicated": existed}
+
+    def _import_file(self, path: Path) -> Dict[str, Any]:
+        sha256 = hash_file(str(path))
+        blob_path = self.blob_path(self.blob_name(sha256, path.name))
+        if not blob_path.exists():
+            try:
+                os.link(path, blob_path)
+            except OSError:
+                shutil.copy2(path, blob_path)
+        return {"blob": blob_path.name, "sha256": sha256, "size": path.stat().st_size,
+                "uploaded_at": path.stat().st_mtime}
+
+    async def adopt(self, directory: Path) -> int:
+        """Reference plain files in `directory` that predate the store (or were copied in by hand)."""
+        adopted = 0
+        for path in Path(directory).iterdir():
+            if path.is_file() and path.name not in self._refs:
+                self._refs[path.name] = await asyncio.to_thread(self._import_file, path)
+                adopted += 1
+        if adopted:
+            await self._save()
+        return adopted
@@ -0,0 +1,180 @@
+# chunking.py
+"""Streaming sentence chunker for training documents.
+
+The document is read in fixed-size blocks and split into sentences as it
+goes, so memory use is bounded by the buffer size plus the longest sentence
+rather than by the size of the file. The chunks produced are identical to
+splitting the whole text with SENTENCE_BOUNDARY and grouping the sentences
+up to `chunk_size` words.
+
+Chunks can also be sized in tokens of the model's tokenizer, so that they
+fill `max_seq_length` instead of a word-count guess of it.
+"""
+
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from document_parsing import TextCache, iter_document_text
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+DEFAULT_BUFFER_SIZE = 1 << 20  # characters per read
+
+
+def iter_text_blocks(file_path: str, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                     text_cache: Optional[TextCache] = None, content_hash: Optional[str] = None) -> Iterator[str]:
+    """Yield the document's text in pieces: buffers for plain text, pages for PDFs, blocks for Markdown."""
+    return iter_document_text(file_path, buffer_size, cache=text_cache, content_hash=content_hash)
+
+
+def iter_sentences(blocks: Iterable[str]) -> Iterator[str]:
+    """Split a stream of text blocks into stripped, non-empty sentences.
+
+    The text after the last boundary in a block may continue in the next one,
+    so it is carried over rather than emitted.
+    """
+    carry = ""
+    for block in blocks:
+        buffer = carry + block
+        start = 0
+        # `carry` never contains a boundary, so only matches touching the new block matter
+        for match in SENTENCE_BOUNDARY.finditer(buffer, len(carry)):
+            sentence = buffer[start:match.start()].strip()
+            if sentence:
+                yield sentence
+            start = match.end()
+        carry = buffer[start:]
+    sentence = carry.strip()
+    if sentence:
+        yield sentence
+
+
+def _group(measured: Iterable[Tuple[str, int]], limit: int) -> Iterator[str]:
+    """Join (sentence, length) pairs into chunks whose lengths sum to at most `limit`.
+
+    A sentence that is longer than `limit` on its own becomes a chunk by itself.
+    """
+    current_chunk: List[str] = []
+    current_length = 0
+
+    for sentence, sentence_length in measured:
+        if current_length + sentence_length > limit and current_chunk:
+            yield " ".join(current_chunk)
+            current_chunk = [sentence]
+            current_length = sentence_length
+        else:
+            current_chunk.append(sentence)
+            current_length += sentence_length
+
+    if current_chunk:
+        yield " ".join(current_chunk)
+
+
+def iter_chunks(sentences: Iterable[str], chunk_size: int = 256) -> Iterator[str]:
+    """Group sentences into chunks of at most `chunk_size` whitespace-separated words."""
+    return _group(((sentence, len(sentence.split())) for sentence in sentences), chunk_size)
+
+
+def iter_token_chunks(sentences: Iterable[str], tokenizer, max_tokens: int, batch_size: int = 512) -> Iterator[str]:
+    """Group sentences into chunks that fit in `max_tokens` tokens of `tokenizer`.
+
+    Sentences are measured in batches with one fast-tokenizer call per batch,
+    counting one extra token for each space that joins them. Each chunk is
+    measured once more as joined text before it is emitted, and sentences that
+    would push it over the budget move on to the next chunk. Room is left for
+    the special tokens the tokenizer adds to each sequence.
+    """
+    budget = max(1, max_tokens - tokenizer.num_special_tokens_to_add())
+
+    def count(text: str) -> int:
+        return len(tokenizer(text, add_special_tokens=False, return_attention_mask=False)["input_ids"])
+
+    def measured() -> Iterator[Tuple[str, int]]:
+        batch: List[str] = []
+        for sentence in sentences:
+            batch.append(sentence)
+            if len(batch) == batch_size:
+                yield from _measure(tokenizer, batch)
+                batch = []
+        if batch:
+            yield from _measure(tokenizer, batch)
+
+    return _group_tokens(measured(), budget, count)
+
+
+def _estimate(chunk: List[Tuple[str, int]]) -> int:
+    return sum(length for _, length in chunk) + max(len(chunk) - 1, 0)
+
+
+def _emit(chunk: List[Tuple[str, int]], budget: int, count) -> Iterator[str]:
+    """Yield the longest prefix of `chunk` whose joined text fits `budget`; return the rest."""
+    kept, rest = list(chunk), []
+    # A single sentence over the budget still becomes a chunk by itself
+    while len(kept) > 1 and count(" ".join(sentence for sentence, _ in kept)) > budget:
+        rest.insert(0, kept.pop())
+    yield " ".join(sentence for sentence, _ in kept)
+    return rest
+
+
+def _group_tokens(measured: Iterable[Tuple[str, int]], budget: int, count) -> Iterator[str]:
+    chunk: List[Tuple[str, int]] = []
+    for sentence, length in measured:
+        while chunk and _estimate(chunk) + 1 + length > budget:
+            chunk = yield from _emit(chunk, budget, count)
+        chunk.append((sentence, length))
+    while chunk:
+        chunk = yield from _emit(chunk, budget, count)
+
+
+def _measure(tokenizer, batch: List[str]) -> Iterator[Tuple[str, int]]:
+    encoded = tokenizer(batch, add_special_tokens=False, return_attention_mask=False)
+    return zip(batch, (len(ids) for ids in encoded["input_ids"]))
+
+
+def iter_document_chunks(file_path: str, chunk_size: int = 256, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                         tokenizer=None, text_cache: Optional[TextCache] = None,
+                         content_hash: Optional[str] = None) -> Iterator[str]:
+    """Stream the chunks of a document file.
+
+    Without a tokenizer `chunk_size` is a word count; with one it is a token count.
+    """
+    sentences = iter_sentences(iter_text_blocks(file_path, buffer_size, text_cache, content_hash))
+    if tokenizer is not None:
+        return iter_token_chunks(sentences, tokenizer, chunk_size)
+    return iter_chunks(sentences, chunk_size)
+
+
+def _generate_rows(file_path: str, chunk_size: int, buffer_size: int, tokenizer: Any,
+                   text_cache: Optional[TextCache], content_hash: Optional[str],
+                   source_stat: Any) -> Iterator[Dict[str, str]]:
+    # `source_stat` is unused here; it is part of gen_kwargs so that the datasets
+    # cache fingerprint changes whenever the file does.
+    for chunk in iter_document_chunks(file_path, chunk_size, buffer_size, tokenizer, text_cache, content_hash):
+        yield {"text": chunk}
+
+
+def build_chunk_dataset(file_path: str, chunk_size: int = 256, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                        tokenizer=None, text_cache: Optional[TextCache] = None, content_hash: Optional[str] = None,
+                        cache_dir: Optional[str] = None):
+    """Build a one-column ("text") dataset of chunks, written to Arrow as they are produced.
+
+    The Arrow files go to `cache_dir`, or to the default datasets cache if it is None.
+    """
+    from datasets import Dataset, Features, Value
+
+    stat = os.stat(file_path)
+    return Dataset.from_generator(
+        _generate_rows,
+        features=Features({"text": Value("string")}),
+        gen_kwargs={
+            "file_path": str(file_path),
+            "chunk_size": chunk_size,
+            "buffer_size": buffer_size,
+            "tokenizer": tokenizer,
+            "text_cache": text_cache,
+            "content_hash": content_hash,
+            "source_stat": (stat.st_size, stat.st_mtime_ns),
+        },
+        cache_dir=cache_dir,
+    )
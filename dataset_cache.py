@@ -0,0 +1,161 @@
+# dataset_cache.py
+"""Content-addressed cache of preprocessed training datasets.
+
+Entries are keyed on the upload's content hash plus everything that affects
+preprocessing (chunker settings, packing, tokenizer name). Each entry is a
+`Dataset.save_to_disk` directory, so a hit is a memory-mapped
+`load_from_disk` instead of re-parsing and re-tokenizing the document.
+Least-recently-used entries are evicted once the cache grows past
+`max_bytes`.
+
+Several trainer processes may share one cache, so the JSON index is only
+read and written under an exclusive file lock.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to no inter-process locking
+    fcntl = None
+
+# Bump when chunking/packing output changes so stale entries are never reused
+CACHE_VERSION = 2
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class DatasetCache:
+    """On-disk LRU cache of preprocessed datasets."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.root / "index.json"
+        self._lock_path = self.root / "index.lock"
+
+    @staticmethod
+    def key(content_hash: str, settings: Dict[str, Any]) -> str:
+        """Cache key for a document's contents preprocessed with `settings`."""
+        payload = json.dumps({"version": CACHE_VERSION, "content": content_hash, "settings": settings}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @contextlib.contextmanager
+    def _index(self, write: bool = True) -> Iterator[Dict[str, Any]]:
+        with open(self._lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._index_path, "r") as f:
+                        index = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    index = {"entries": {}, "hits": 0, "misses": 0, "evictions": 0}
+                yield index
+                if write:
+                    tmp_path = self._index_path.with_suffix(".tmp")
+                    with open(tmp_path, "w") as f:
+                        json.dump(index, f)
+                    os.replace(tmp_path, self._index_path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, key: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """Load a cached dataset (memory-mapped) and its metadata, or None on a miss."""
+        from datasets import load_from_disk
+
+        with self._index() as index:
+            entry = index["entries"].get(key)
+            path = self.root / key
+            if entry is None or not path.exists():
+                index["entries"].pop(key, None)
+                index["misses"] += 1
+                return None
+            entry["last_used"] = time.time()
+            index["hits"] += 1
+            # Still under the lock, so a concurrent clear() or eviction cannot delete it mid-load
+            return load_from_disk(str(path)), entry.get("meta", {})
+
+    def put(self, key: str, dataset, meta: Optional[Dict[str, Any]] = None):
+        """Store a dataset and return the memory-mapped copy read back from the cache."""
+        from datasets import load_from_disk
+
+        path = self.root / key
+        tmp_path = self.root / f"tmp-{uuid.uuid4().hex}"
+        dataset.save_to_disk(str(tmp_path))
+        size = _dir_size(tmp_path)
+
+        with self._index() as index:
+            if path.exists():
+                # Another process stored the same entry first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            else:
+                os.replace(tmp_path, path)
+            now = time.time()
+            index["entries"][key] = {"bytes": size, "created": now, "last_used": now, "meta": meta or {}}
+            self._evict(index, keep=key)
+            return load_from_disk(str(path))
+
+    @contextlib.contextmanager
+    def scratch_dir(self) -> Iterator[Path]:
+        """A temporary directory inside the cache root, deleted on exit, for building an entry's dataset."""
+        path = self.root / f"tmp-{uuid.uuid4().hex}"
+        path.mkdir()
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _evict(self, index: Dict[str, Any], keep: str):
+        entries = index["entries"]
+        total = sum(entry["bytes"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.root / key, ignore_errors=True)
+            total -= entries.pop(key)["bytes"]
+            index["evictions"] += 1
+
+    def clear(self):
+        with self._index() as index:
+            for key in list(index["entries"]):
+                shutil.rmtree(self.root / key, ignore_errors=True)
+            index["entries"] = {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._index(write=False) as index:
+            lookups = index["hits"] + index["misses"]
+            return {
+                "entries": len(index["entries"]),
+                "bytes": sum(entry["bytes"] for entry in index["entries"].values()),
+                "max_bytes": self.max_bytes,
+                "hits": index["hits"],
+                "misses": index["misses"],
+                "hit_rate": round(index["hits"] / lookups, 4) if lookups else None,
+                "evictions": index["evictions"],
+            }
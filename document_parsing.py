@@ -0,0 +1,193 @@
+# document_parsing.py
+"""Text extraction for training documents (.pdf, .md, plain text).
+
+PDF pages are extracted in a process pool, a batch of pages per task, and
+yielded in page order as soon as each batch is done. The pool's processes are
+spawned rather than forked, since the caller may already have CUDA and torch
+threads running (a trainer or resident worker that loaded its model). Markdown is converted by
+walking markdown-it's token stream instead of rendering HTML and stripping
+the tags again. Extracted text can be cached on disk by content hash so the
+same upload is only parsed once.
+"""
+
+import multiprocessing
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dataset_cache import hash_file
+
+# Below this many pages the process pool costs more than it saves
+PARALLEL_MIN_PAGES = 16
+PAGES_PER_TASK = 8
+
+_HTML_TAG = re.compile('<[^<]+?>')
+
+# Readers of pool worker processes, so each worker parses the PDF structure once;
+# the workers (and these readers) go away with the pool
+_readers: Dict[str, object] = {}
+
+
+def _extract_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """Pool task: extract pages start..stop-1 with this worker's reader for the file."""
+    import pypdf
+
+    reader = _readers.get(file_path)
+    if reader is None:
+        reader = _readers[file_path] = pypdf.PdfReader(file_path)
+    return [(reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+def pdf_page_count(file_path: str) -> int:
+    import pypdf
+
+    return len(pypdf.PdfReader(file_path).pages)
+
+
+def iter_pdf_pages(file_path: str, workers: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of each page in order, extracting batches of pages in parallel."""
+    file_path = str(file_path)
+    num_pages = pdf_page_count(file_path)
+    workers = workers or os.cpu_count() or 1
+    ranges = [(start, min(start + PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, PAGES_PER_TASK)]
+
+    if workers == 1 or num_pages < PARALLEL_MIN_PAGES:
+        import pypdf
+
+        # A reader for this call only; the calling process may be a long-lived worker
+        reader = pypdf.PdfReader(file_path)
+        for i in range(num_pages):
+            yield reader.pages[i].extract_text() or ""
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Keep a bounded window of batches in flight so memory stays flat for huge PDFs
+        window = workers * 2
+        futures = [pool.submit(_extract_pages, file_path, start, stop) for start, stop in ranges[:window]]
+        next_range = len(futures)
+        for index in range(len(ranges)):
+            pages = futures[index].result()
+            futures[index] = None
+            if next_range < len(ranges):
+                futures.append(pool.submit(_extract_pages, file_path, *ranges[next_range]))
+                next_range += 1
+            yield from pages
+
+
+def _inline_text(token) -> str:
+    parts = []
+    for child in token.children or []:
+        if child.type in ("text", "code_inline"):
+            parts.append(child.content)
+        elif child.type in ("softbreak", "hardbreak"):
+            parts.append("\n")
+        elif child.type == "image":
+            parts.append(_inline_text(child))
+    return "".join(parts)
+
+
+def iter_markdown_blocks(text: str) -> Iterator[str]:
+    """Yield the plain text of each Markdown block (paragraph, heading, list item, code block)."""
+    from markdown_it import MarkdownIt
+
+    for token in MarkdownIt().parse(text):
+        if token.type == "inline":
+            yield _inline_text(token) + "\n"
+        elif token.type in ("fence", "code_block"):
+            yield token.content
+        elif token.type == "html_block":
+            yield _HTML_TAG.sub('', token.content)
+
+
+def iter_text_file(file_path: str, buffer_size: int) -> Iterator[str]:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        while True:
+            block = f.read(buffer_size)
+            if not block:
+                break
+            yield block
+
+
+def iter_extracted_text(file_path: str, buffer_size: int, workers: Optional[int] = None) -> Iterator[str]:
+    """Yield a document's text in pieces: pages for PDFs, blocks for Markdown, buffers for text."""
+    ext = Path(file_path).suffix.lower()
+    if ext == ".pdf":
+        for page in iter_pdf_pages(file_path, workers):
+            yield page + "\n"
+    elif ext == ".md":
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        yield from iter_markdown_blocks(text)
+    else:
+        yield from iter_text_file(file_path, buffer_size)
+
+
+class TextCache:
+    """Extracted document text stored as `<content hash>.txt`, oldest files pruned past `max_bytes`."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, content_hash: str) -> Path:
+        return self.root / f"{content_hash}.txt"
+
+    def iter_text(self, file_path: str, content_hash: str, buffer_size: int,
+                  workers: Optional[int] = None) -> Iterator[str]:
+        """Stream cached text, or extract it while writing it to the cache."""
+        cached = self.path(content_hash)
+        if cached.exists():
+            os.utime(cached)
+            yield from iter_text_file(str(cached), buffer_size)
+            return
+
+        tmp_path = self.root / f"tmp-{uuid.uuid4().hex}.txt"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as out:
+                for piece in iter_extracted_text(file_path, buffer_size, workers):
+                    out.write(piece)
+                    yield piece
+            os.replace(tmp_path, cached)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        self._prune()
+
+    def _prune(self):
+        files: List[Tuple[float, int, Path]] = []
+        for path in self._files():
+            stat = path.stat()
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _files(self) -> List[Path]:
+        return [path for path in self.root.glob("*.txt") if not path.name.startswith("tmp-")]
+
+    def clear(self):
+        for path in self._files():
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = [path.stat().st_size for path in self._files()]
+        return {"entries": len(sizes), "bytes": sum(sizes), "max_bytes": self.max_bytes}
+
+
+def iter_document_text(file_path: str, buffer_size: int, cache: Optional[TextCache] = None,
+                       content_hash: Optional[str] = None, workers: Optional[int] = None) -> Iterator[str]:
+    """Yield a document's text, going through `cache` for formats that need parsing."""
+    needs_parsing = Path(file_path).suffix.lower() in (".pdf", ".md")
+    if cache is None or not needs_parsing:
+        return iter_extracted_text(file_path, buffer_size, workers)
+    if content_hash is None:
+        content_hash = hash_file(file_path)
+    return cache.iter_text(file_path, content_hash, buffer_size, workers)
@@ -0,0 +1,349 @@
+# inference.py
+"""Generation from fine-tuned jobs with shared base models and hot-swapped adapters.
+
+A fine-tuned job is a small LoRA adapter on top of one of the base models, so
+only one copy of each base model is kept in memory and each job's adapter is
+loaded into it by name (PEFT multi-adapter) and activated per request.
+
+Base models and adapters share one memory budget. Over budget, the least
+recently used entry is evicted; a base model is touched by every request on
+it, so it usually outlives its adapters, and goes together with them when it
+is itself the least recently used.
+All model work runs on a single dedicated thread, which serialises adapter
+switches with generation and keeps the API's event loop responsive.
+
+Concurrent requests are decoded together (see `batching`): requests for the
+same base model and adapter form one batch, and new ones join it between
+decode steps. One batch runs at a time, since a base model has one active
+adapter. A batch only admits requests that arrived before the oldest request
+for a different model, which then gets its turn once the batch drains.
+
+Requests can name a chat session; the KV cache of the session's previous turn
+is then kept in a `PrefixCache` (its own memory budget) and reused for the
+part of the next prompt that repeats the conversation so far.
+
+Callers can also opt into a `ResponseCache`: decoding is greedy, so a repeated
+prompt against the same adapter weights is answered from the cache.
+"""
+
+import asyncio
+import gc
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from batching import DecodeBatch, GenerationRequest, PrefixCache
+from response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_WEIGHT_FILES = ("adapter_model.safetensors", "adapter_model.bin")
+
+
+def load_unsloth_model(model_name: str, max_seq_length: int):
+    """Load a 4-bit base model with Unsloth and switch it to inference mode."""
+    from unsloth import FastLanguageModel
+
+    from trainer import load_base_model
+
+    model, tokenizer = load_base_model(model_name, max_seq_length)
+    FastLanguageModel.for_inference(model)
+    return model, tokenizer
+
+
+def adapter_weights(adapter_path: str) -> Optional[Path]:
+    """The weights file of a saved adapter directory."""
+    for name in ADAPTER_WEIGHT_FILES:
+        path = Path(adapter_path) / name
+        if path.exists():
+            return path
+    return None
+
+
+def adapter_bytes(adapter_path: str) -> int:
+    """Approximate memory of an adapter: the size of its saved weights."""
+    path = adapter_weights(adapter_path)
+    return path.stat().st_size if path is not None else 0
+
+
+def model_bytes(model) -> int:
+    if hasattr(model, "get_memory_footprint"):
+        return int(model.get_memory_footprint())
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+class _BaseModel:
+    def __init__(self, model, tokenizer, size: int):
+        self.model = model  # the plain base model, or the PeftModel wrapping it once an adapter is loaded
+        self.tokenizer = tokenizer
+        self.size = size
+        self.adapters: Dict[str, int] = {}  # adapter id -> bytes
+        self.active: Optional[str] = None
+
+
+class InferenceServer:
+    """Resident base models with per-job LoRA adapters, evicted LRU under `memory_budget` bytes."""
+
+    def __init__(self, memory_budget: int, max_seq_length: int = 2048, max_batch_size: int = 8,
+                 prefix_cache_budget: int = 0, response_cache_bytes: int = 0,
+                 load_base: Callable[[str, int], Tuple[Any, Any]] = load_unsloth_model):
+        self.memory_budget = memory_budget
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = PrefixCache(prefix_cache_budget) if prefix_cache_budget > 0 else None
+        self.response_cache = ResponseCache(response_cache_bytes) if response_cache_bytes > 0 else None
+        self.max_seq_length = max_seq_length
+        self._load_base = load_base
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self._bases: Dict[str, _BaseModel] = {}
+        # ("base", model_name) or ("adapter", model_name, adapter_id) -> bytes, oldest use first
+        self._lru: "OrderedDict[tuple, int]" = OrderedDict()
+        self.stats_counters = {"base_loads": 0, "adapter_loads": 0, "adapter_hits": 0, "evictions": 0,
+                               "requests": 0, "decode_steps": 0, "batched_tokens": 0}
+        self._waiting: Deque[GenerationRequest] = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._batch_task: Optional[asyncio.Task] = None
+
+    # --- Runs on the inference thread ---
+
+    def _used(self) -> int:
+        return sum(self._lru.values())
+
+    def _evict(self, keep: set):
+        for key in list(self._lru):
+            if self._used() <= self.memory_budget:
+                return
+            if key in keep or key not in self._lru:
+                continue
+            if key[0] == "adapter":
+                self._drop_adapter(key[1], key[2])
+            else:
+                self._drop_base(key[1])
+            self.stats_counters["evictions"] += 1
+        if self._used() > self.memory_budget:
+            logger.warning(f"Inference models use {self._used()} bytes, over the {self.memory_budget} byte budget")
+
+    def _drop_adapter(self, model_name: str, adapter_id: str):
+        base = self._bases[model_name]
+        self._lru.pop(("adapter", model_name, adapter_id), None)
+        base.adapters.pop(adapter_id, None)
+        if base.adapters:
+            if base.active == adapter_id:
+                base.model.set_adapter(next(iter(base.adapters)))
+                base.active = next(iter(base.adapters))
+            base.model.delete_adapter(adapter_id)
+        else:
+            # Last adapter: strip the LoRA layers and go back to the plain base model
+            base.model = base.model.unload()
+            base.active = None
+        logger.info(f"Unloaded adapter {adapter_id} from {model_name}")
+
+    def _drop_base(self, model_name: str):
+        base = self._bases.pop(model_name)
+        for adapter_id in list(base.adapters):
+            self._lru.pop(("adapter", model_name, adapter_id), None)
+        self._lru.pop(("base", model_name), None)
+        del base
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        logger.info(f"Unloaded base model {model_name}")
+
+    def _activate(self, model_name: str, adapter_id: Optional[str], adapter_path: Optional[str]):
+        """Make `adapter_id` the active adapter on `model_name`'s base model, loading either if needed."""
+        base = self._bases.get(model_name)
+        if base is None:
+            model, tokenizer = self._load_base(model_name, self.max_seq_length)
+            base = self._bases[model_name] = _BaseModel(model, tokenizer, model_bytes(model))
+            self._lru[("base", model_name)] = base.size
+            self.stats_counters["base_loads"] += 1
+        self._lru.move_to_end(("base", model_name))
+        keep = {("base", model_name)}
+
+        if adapter_id is not None:
+            key = ("adapter", model_name, adapter_id)
+            if adapter_id not in base.adapters:
+                if base.adapters:
+                    base.model.load_adapter(adapter_path, adapter_name=adapter_id)
+                else:
+                    from peft import PeftModel
+                    base.model = PeftModel.from_pretrained(base.model, adapter_path, adapter_name=adapter_id)
+                base.adapters[adapter_id] = adapter_bytes(adapter_path)
+                self._lru[key] = base.adapters[adapter_id]
+                self.stats_counters["adapter_loads"] += 1
+            else:
+                self.stats_counters["adapter_hits"] += 1
+            self._lru.move_to_end(key)
+            keep.add(key)
+            if base.active != adapter_id:
+                base.model.set_adapter(adapter_id)
+                base.active = adapter_id
+
+        self._evict(keep)
+        return base.model, base.tokenizer
+
+    def _iterate(self, batch: Optional[DecodeBatch], key: Tuple[str, Optional[str]], adapter_path: Optional[str],
+                 joining: List[GenerationRequest]) -> DecodeBatch:
+        """One batching iteration: admit `joining`, decode a token for every running sequence, retire the done."""
+        # Re-activating is a dict lookup unless the adapter was unloaded in between
+        model, tokenizer = self._activate(key[0], key[1], adapter_path)
+        if batch is None:
+            batch = DecodeBatch(tokenizer, self.prefix_cache)
+        if joining:
+            batch.admit(model, joining)
+            # Requests done after their first token must not be decoded further
+            batch.retire()
+        if len(batch):
+            self.stats_counters["decode_steps"] += 1
+            self.stats_counters["batched_tokens"] += len(batch)
+            batch.step(model)
+            batch.retire()
+        return batch
+
+    def _unload(self, adapter_id: str):
+        for model_name, base in list(self._bases.items()):
+            if adapter_id in base.adapters:
+                self._drop_adapter(model_name, adapter_id)
+        if self.prefix_cache is not None:
+            self.prefix_cache.drop_adapter(adapter_id)
+
+    # --- Event loop side ---
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` on the inference thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def generate(self, model_name: str, adapter_id: Optional[str], adapter_path: Optional[str],
+                       prompt: str, max_new_tokens: int, session_id: Optional[str] = None,
+                       use_cache: bool = False) -> Dict[str, Any]:
+        """Generate with `adapter_id` (loaded from `adapter_path`) on `model_name`, or the bare base model.
+
+        Returns the decoded prompt and completion as "text", plus token counts and
+        prefill timings. Turns of one conversation should share a `session_id`.
+        With `use_cache`, an identical earlier request's result is returned
+        ("cached": True) when the response cache is enabled.
+        """
+        cache_key = None
+        if use_cache and self.response_cache is not None:
+            fingerprint = await self.response_cache.fingerprint(
+                adapter_id, adapter_weights(adapter_path) if adapter_path else None)
+            if fingerprint is not None:
+                cache_key = ResponseCache.key(model_name, fingerprint, prompt,
+                                              {"max_new_tokens": max_new_tokens, "decoding": "greedy"})
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    return {**cached, "cached": True}
+        request = self._submit(GenerationRequest(model_name, adapter_id, adapter_path, prompt, max_new_tokens,
+                                                 session_id=session_id))
+        try:
+            result = await request.future
+            if cache_key is not None:
+                self.response_cache.put(cache_key, adapter_id, result)
+            return {**result, "cached": False}
+        except asyncio.CancelledError:
+            # Frees its row on the next iteration, or drops it before it ever starts
+            request.cancelled = True
+            raise
+
+    async def stream(self, model_name: str, adapter_id: Optional[str], adapter_path: Optional[str],
+                     prompt: str, max_new_tokens: int, session_id: Optional[str] = None) -> AsyncIterator[Any]:
+        """Like `generate`, but yields the completion (without the prompt) as text deltas while it is decoded,
+        and finally the result dict of `generate`.
+
+        Closing the iterator early, e.g. when the client disconnects, stops generation.
+        """
+        request = self._submit(GenerationRequest(model_name, adapter_id, adapter_path, prompt, max_new_tokens,
+                                                 stream=True, session_id=session_id))
+        # A None after the last delta; also sent if generation fails
+        request.future.add_done_callback(lambda future: request.stream.put_nowait(None))
+        try:
+            while True:
+                delta = await request.stream.get()
+                if delta is None:
+                    break
+                yield delta
+            yield await request.future
+        finally:
+            request.cancelled = True
+
+    def _submit(self, request: GenerationRequest) -> GenerationRequest:
+        self._waiting.append(request)
+        self.stats_counters["requests"] += 1
+        if self._batch_task is None:
+            self._wake = asyncio.Event()
+            self._batch_task = asyncio.create_task(self._run_batches())
+        self._wake.set()
+        return request
+
+    def _take_waiting(self, key: Tuple[str, Optional[str]], limit: int) -> List[GenerationRequest]:
+        """Waiting requests for `key` that arrived before any request for another model, up to `limit`."""
+        taken = []
+        while self._waiting and len(taken) < limit:
+            request = self._waiting[0]
+            if request.cancelled:
+                self._waiting.popleft()
+            elif request.key == key:
+                taken.append(self._waiting.popleft())
+            else:
+                break
+        return taken
+
+    async def _run_batches(self):
+        while True:
+            while self._waiting and self._waiting[0].cancelled:
+                self._waiting.popleft()
+            if not self._waiting:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            key, adapter_path = self._waiting[0].key, self._waiting[0].adapter_path
+            batch: Optional[DecodeBatch] = None
+            while True:
+                joining = self._take_waiting(key, self.max_batch_size - (len(batch) if batch else 0))
+                running = list(batch.requests) if batch else []
+                try:
+                    batch = await self.run(self._iterate, batch, key, adapter_path, joining)
+                except Exception as e:
+                    logger.error(f"Generation failed for {key[0]} / {key[1]}: {str(e)}")
+                    for request in running + joining:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    break
+                for request in running + joining:
+                    if request.stream is not None:
+                        for delta in request.take_pending():
+                            request.stream.put_nowait(delta)
+                    if request.text is not None and not request.future.done():
+                        request.future.set_result({"text": request.text, **request.usage()})
+                if not len(batch):
+                    break
+
+    async def unload(self, adapter_id: str):
+        """Forget an adapter and its cached responses, e.g. because its job was deleted or retrained."""
+        if self.response_cache is not None:
+            self.response_cache.invalidate(adapter_id)
+        await self.run(self._unload, adapter_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory_budget": self.memory_budget,
+            "memory_used": self._used(),
+            "base_models": {
+                name: {"bytes": base.size, "adapters": list(base.adapters), "active": base.active}
+                for name, base in list(self._bases.items())
+            },
+            "waiting": len(self._waiting),
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None,
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+            **self.stats_counters,
+        }
+
+    def shutdown(self):
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+# job_events.py
+"""Push job progress and log lines to many subscribers (Server-Sent Events).
+
+There is one broadcaster per job with at least one subscriber; publishing to
+a job nobody watches is a dict lookup. The producer (the trainer's stdout
+reader) never waits on a subscriber:
+
+* Job state (status, progress, ...) is a single "latest value" slot per
+  subscriber, so a slow client skips intermediate progress updates instead
+  of queueing them.
+* Log lines go into a bounded per-subscriber queue. If a subscriber falls
+  `max_queued` lines behind, its queue is dropped and it is flagged as
+  lagged; the stream then catches up from the job's log file using the line
+  numbers every log event carries.
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+def format_sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data, default=str)}\n\n"
+
+
+class Subscriber:
+    def __init__(self, max_queued: int):
+        self.max_queued = max_queued
+        self.lines: List[Tuple[int, str]] = []
+        self.state: Optional[Dict[str, Any]] = None
+        self.lagged = False
+        self.wake = asyncio.Event()
+
+    def push_line(self, number: int, text: str):
+        if self.lagged:
+            return
+        if len(self.lines) >= self.max_queued:
+            self.lines = []
+            self.lagged = True
+        else:
+            self.lines.append((number, text))
+        self.wake.set()
+
+    def push_state(self, state: Dict[str, Any]):
+        self.state = state
+        self.wake.set()
+
+    async def next_batch(self, timeout: float) -> Optional[Tuple[Optional[Dict[str, Any]], List[Tuple[int, str]], bool]]:
+        """Wait for news; returns (state, lines, lagged), or None after `timeout` seconds without any."""
+        try:
+            await asyncio.wait_for(self.wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.wake.clear()
+        batch = (self.state, self.lines, self.lagged)
+        self.state, self.lines, self.lagged = None, [], False
+        return batch
+
+
+class EventHub:
+    """Per-job fan-out of state changes and log lines."""
+
+    def __init__(self, max_queued: int = 1000):
+        self.max_queued = max_queued
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+
+    def subscriber_count(self, job_id: Optional[str] = None) -> int:
+        if job_id is not None:
+            return len(self._subscribers.get(job_id, ()))
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def subscribe(self, job_id: str) -> Subscriber:
+        subscriber = Subscriber(self.max_queued)
+        self._subscribers.setdefault(job_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, job_id: str, subscriber: Subscriber):
+        subs = self._subscribers.get(job_id)
+        if subs is not None:
+            subs.discard(subscriber)
+            if not subs:
+                del self._subscribers[job_id]
+
+    def publish_line(self, job_id: str, number: int, text: str):
+        for subscriber in self._subscribers.get(job_id, ()):
+            subscriber.push_line(number, text)
+
+    def publish_state(self, job_id: str, state: Dict[str, Any]):
+        for subscriber in self._subscribers.get(job_id, ()):
+            subscriber.push_state(state)
+
+    async def stream(self, job_id: str, log, get_state: Callable[[], Optional[Dict[str, Any]]],
+                     since: Optional[int], is_disconnected: Callable[[], Awaitable[bool]],
+                     keepalive: float = 15.0, terminal_statuses=("completed", "failed", "cancelled"),
+                     page_size: int = 1000) -> AsyncIterator[str]:
+        """SSE messages for one subscriber: `state`, `log` and a final `end` event.
+
+        `log` is the job's JobLog and `get_state()` its current state (None once the
+        job is gone). Log lines from `since` on are replayed first; without `since`
+        only new lines are sent.
+        """
+        subscriber = self.subscribe(job_id)
+        try:
+            yield format_sse("state", get_state() or {"job_id": job_id})
+            next_line = len(log) if since is None else max(since, 0)
+            # Lines logged before we subscribed come from the log itself, as do
+            # lines dropped while this subscriber was lagging behind
+            catch_up = True
+            while True:
+                state = get_state()
+                if state is None:
+                    yield format_sse("end", {"job_id": job_id, "status": "deleted"})
+                    return
+                finished = state["status"] in terminal_statuses
+                # A finished job's last lines may still be queued; read them from the log too
+                while catch_up or finished:
+                    lines = log.read(next_line, page_size)
+                    for text in lines:
+                        yield format_sse("log", {"line": next_line, "text": text}, next_line)
+                        next_line += 1
+                    if len(lines) < page_size:
+                        break
+                catch_up = False
+                if finished:
+                    yield format_sse("end", state)
+                    return
+
+                batch = await subscriber.next_batch(keepalive)
+                if batch is None:
+                    if await is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                pushed_state, lines, catch_up = batch
+                for number, text in lines:
+                    if number >= next_line:
+                        yield format_sse("log", {"line": number, "text": text}, number)
+                        next_line = number + 1
+                if pushed_state is not None:
+                    yield format_sse("state", pushed_state)
+        finally:
+            self.unsubscribe(job_id, subscriber)
@@ -0,0 +1,137 @@
+# job_logs.py
+"""Per-job log storage with bounded memory.
+
+Every line is appended to `<job_id>.log`. Only the most recent `ring_size`
+lines are also kept in memory, so a long job's memory use stays flat and
+tailing the log never touches the disk. Reading older lines seeks through a
+sparse index that records the byte offset of every `INDEX_STRIDE`-th line.
+Lines are addressed by their 0-based number, so clients can poll with a
+`since` cursor and receive only lines they have not seen.
+"""
+
+from array import array
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+INDEX_STRIDE = 256
+
+
+class JobLog:
+    """Append-only log of one job: a ring buffer of recent lines in front of a file."""
+
+    def __init__(self, path: Path, ring_size: int = 1000, listener: Optional[Callable[[int, str], None]] = None):
+        self.path = Path(path)
+        self.listener = listener
+        self._recent: deque = deque(maxlen=ring_size)
+        self._offsets = array("Q")  # byte offset of line i * INDEX_STRIDE
+        self._count = 0
+        self._size = 0
+        self._file = None
+        self._loaded = False
+
+    def _load(self):
+        # Rebuild the index (and the ring) from a log written by an earlier run, on first use
+        self._loaded = True
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if self._count % INDEX_STRIDE == 0:
+                    self._offsets.append(self._size)
+                self._size += len(raw)
+                self._count += 1
+                self._recent.append(raw.decode("utf-8", "replace").rstrip("\n"))
+
+    def __len__(self) -> int:
+        if not self._loaded:
+            self._load()
+        return self._count
+
+    def append(self, line: str):
+        if not self._loaded:
+            self._load()
+        line = line.replace("\n", " ")
+        data = (line + "\n").encode("utf-8")
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        if self._count % INDEX_STRIDE == 0:
+            self._offsets.append(self._size)
+        self._file.write(data)
+        self._size += len(data)
+        self._count += 1
+        self._recent.append(line)
+        if self.listener is not None:
+            self.listener(self._count - 1, line)
+
+    def _read_from_disk(self, start: int, stop: int) -> List[str]:
+        if self._file is not None:
+            self._file.flush()
+        lines = []
+        with open(self.path, "rb") as f:
+            f.seek(self._offsets[start // INDEX_STRIDE])
+            number = start - start % INDEX_STRIDE
+            for raw in f:
+                if number >= stop:
+                    break
+                if number >= start:
+                    lines.append(raw.decode("utf-8", "replace").rstrip("\n"))
+                number += 1
+        return lines
+
+    def read(self, since: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Lines `since` .. `since + limit` (exclusive), oldest first."""
+        if not self._loaded:
+            self._load()
+        start = max(since, 0)
+        stop = self._count if limit is None else min(self._count, start + limit)
+        if start >= stop:
+            return []
+        first_recent = self._count - len(self._recent)
+        if start >= first_recent:
+            return list(islice(self._recent, start - first_recent, stop - first_recent))
+        return self._read_from_disk(start, stop)
+
+    def tail(self, n: int) -> List[str]:
+        return self.read(max(len(self) - n, 0))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LogStore:
+    """The JobLog of every job, stored as files under `root`.
+
+    `on_append(job_id, line_number, text)` is called for every new line.
+    """
+
+    def __init__(self, root: Path, ring_size: int = 1000,
+                 on_append: Optional[Callable[[str, int, str], None]] = None):
+        self.root = Path(root)
+        self.ring_size = ring_size
+        self.on_append = on_append
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._logs: Dict[str, JobLog] = {}
+
+    def open(self, job_id: str) -> JobLog:
+        log = self._logs.get(job_id)
+        if log is None:
+            listener = None
+            if self.on_append is not None:
+                listener = lambda number, text: self.on_append(job_id, number, text)  # noqa: E731
+            log = self._logs[job_id] = JobLog(self.root / f"{job_id}.log", self.ring_size, listener)
+        return log
+
+    def delete(self, job_id: str):
+        log = self._logs.pop(job_id, None)
+        if log is not None:
+            log.close()
+        (self.root / f"{job_id}.log").unlink(missing_ok=True)
+
+    def close(self):
+        for log in self._logs.values():
+            log.close()
+        self._logs = {}
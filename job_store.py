@@ -0,0 +1,286 @@
+# job_store.py
+"""Durable training job state in SQLite.
+
+The API keeps working on plain job dicts in memory (`JobStore.jobs`), so the
+hot path is unchanged. Changed jobs are only marked dirty and written back in
+one transaction per `flush_interval`, which turns hundreds of progress updates
+per second into about one WAL commit per second. Logs are not part of the
+stored row; `log_factory(job_id)` supplies each loaded job's log object.
+
+On startup `reconcile()` loads the previous run's jobs. A job that was still
+running belonged to a process that outlived the old API (for example across a
+`--reload`); that process is asked to stop (a trainer saves a checkpoint on
+SIGTERM) and the job is handed back to the caller, with the pending ones, to
+be queued again and resume from its latest checkpoint. `stop_orphans()` then
+waits for all the signalled processes together and kills those that do not
+exit in time; queue the jobs once it returns.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Job fields that are datetimes in memory and ISO strings in the stored JSON
+DATETIME_FIELDS = ("start_time", "end_time")
+# Job fields that only make sense inside the running API process
+TRANSIENT_FIELDS = ("logs",)
+# How long an orphaned trainer gets to write its checkpoint and exit before it is killed
+ORPHAN_STOP_TIMEOUT = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    start_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_start ON jobs (status, start_time);
+CREATE INDEX IF NOT EXISTS jobs_start ON jobs (start_time);
+"""
+
+
+def process_identity(pid: int) -> Optional[str]:
+    """The kernel's start time of `pid`, so a recycled pid is not mistaken for our process."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # Field 22; the command name in field 2 may itself contain spaces
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def process_group(pgid: int) -> List[int]:
+    """Pids of the live processes in process group `pgid` (a trainer and any children it started)."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[0] != "Z" and int(fields[2]) == pgid:
+            pids.append(int(entry))
+    return pids
+
+
+def signal_process(process: Dict[str, Any], signum: int, group: bool = False) -> bool:
+    """Send `signum` to a recorded job process (see `process_identity`), or to its whole process group.
+
+    Returns False if the process is gone or its pid now belongs to another process.
+    """
+    pid = process.get("pid")
+    if not pid:
+        return False
+    if process.get("started") is not None and process_identity(pid) != process["started"]:
+        return False
+    try:
+        if group and process.get("pgid"):
+            os.killpg(process["pgid"], signum)
+        else:
+            os.kill(pid, signum)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # An exited process nobody has reaped yet is still signalable
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+
+def _encode(job_data: Dict[str, Any]) -> str:
+    row = {key: value for key, value in job_data.items() if key not in TRANSIENT_FIELDS}
+    for key in DATETIME_FIELDS:
+        if isinstance(row.get(key), datetime):
+            row[key] = row[key].isoformat()
+    return json.dumps(row, default=str)
+
+
+def _decode(data: str) -> Dict[str, Any]:
+    job_data = json.loads(data)
+    for key in DATETIME_FIELDS:
+        if job_data.get(key):
+            job_data[key] = datetime.fromisoformat(job_data[key])
+    return job_data
+
+
+class JobStore:
+    """In-memory job dicts backed by a SQLite database in WAL mode."""
+
+    def __init__(self, path: Path, flush_interval: float = 1.0, log_factory: Callable[[str], Any] = lambda job_id: []):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.log_factory = log_factory
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._db_lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # (job id, process) of orphans signalled by reconcile() that may still be exiting
+        self._orphans: List[Tuple[str, Dict[str, Any]]] = []
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, never corruption
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def add(self, job_id: str, job_data: Dict[str, Any]):
+        self.jobs[job_id] = job_data
+        self.update(job_id)
+
+    def update(self, job_id: str):
+        """Mark a job as changed; it is written on the next flush."""
+        if job_id in self.jobs:
+            self._dirty.add(job_id)
+
+    def delete(self, job_id: str):
+        self.jobs.pop(job_id, None)
+        self._dirty.discard(job_id)
+        self._deleted.add(job_id)
+
+    def _write(self, rows: List[tuple], deleted: List[str]):
+        with self._db_lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO jobs (job_id, status, start_time, data) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in deleted])
+
+    def _take_changes(self):
+        rows = []
+        for job_id in self._dirty:
+            job_data = self.jobs[job_id]
+            start_time = job_data.get("start_time")
+            rows.append((
+                job_id, job_data["status"],
+                start_time.isoformat() if isinstance(start_time, datetime) else start_time,
+                _encode(job_data),
+            ))
+        deleted = list(self._deleted)
+        self._dirty.clear()
+        self._deleted.clear()
+        return rows, deleted
+
+    async def flush(self):
+        """Write every changed job now, in one transaction."""
+        async with self._flush_lock:
+            rows, deleted = self._take_changes()
+            if rows or deleted:
+                await asyncio.to_thread(self._write, rows, deleted)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to persist job state: {str(e)}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def find(self, status: Optional[str] = None, started_after: Optional[datetime] = None,
+             limit: Optional[int] = None) -> List[str]:
+        """Job ids matching `status` / `started_after`, newest first, using the stored indexes.
+
+        Call `flush()` first for results that include the latest changes.
+        """
+        clauses, args = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            args.append(status)
+        if started_after is not None:
+            clauses.append("start_time > ?")
+            args.append(started_after.isoformat())
+        query = "SELECT job_id FROM jobs"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY start_time DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self._db_lock:
+            return [row[0] for row in self._conn.execute(query, args)]
+
+    def _signal_orphan(self, job_id: str, job_data: Dict[str, Any]):
+        process = job_data.get("process") or {}
+        pid = process.get("pid")
+        if not pid or not _is_alive(pid):
+            return
+        try:
+            if signal_process(process, signal.SIGTERM, group=True):
+                self._orphans.append((job_id, process))
+        except OSError as e:
+            logger.error(f"Could not stop orphaned process {pid} of job {job_id}: {str(e)}")
+
+    async def stop_orphans(self, timeout: float = ORPHAN_STOP_TIMEOUT):
+        """Wait for the orphans reconcile() signalled to exit, all at once; kill those still running after `timeout`.
+
+        Their jobs resume from the checkpoint the orphan writes on its way out,
+        so queue them only after this returns.
+        """
+        orphans, self._orphans = self._orphans, []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while any(_is_alive(process["pid"]) for _, process in orphans) and loop.time() < deadline:
+            await asyncio.sleep(0.2)
+        for job_id, process in orphans:
+            if _is_alive(process["pid"]):
+                try:
+                    signal_process(process, signal.SIGKILL, group=True)
+                except OSError:
+                    pass
+                logger.warning(f"Killed orphaned process {process['pid']} of job {job_id}")
+            else:
+                logger.warning(f"Stopped orphaned process {process['pid']} of job {job_id}")
+
+    def reconcile(self) -> List[str]:
+        """Load jobs from the previous run, signal their orphaned processes, and return the job ids to queue again."""
+        with self._db_lock:
+            rows = self._conn.execute("SELECT job_id, data FROM jobs ORDER BY start_time").fetchall()
+        pending = []
+        for job_id, data in rows:
+            job_data = _decode(data)
+            job_data["logs"] = self.log_factory(job_id)
+            self.jobs[job_id] = job_data
+            if job_data["status"] == "running":
+                self._signal_orphan(job_id, job_data)
+                job_data["status"] = "pending"
+                job_data["message"] = "Interrupted: the API restarted while this job was running; resuming it"
+                job_data["logs"].append(job_data["message"])
+                self.update(job_id)
+                pending.append(job_id)
+            elif job_data["status"] == "pending":
+                pending.append(job_id)
+            job_data.pop("process", None)
+        return pending
@@ -1,21 +1,39 @@
 # main.py
 
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import os
-import re
 import json
 import uuid
 import asyncio
 import subprocess
 import sys  # <--- imp
+import shlex
+import re
 from datetime import datetime
 import logging
 from pathlib import Path
 import shutil
+import signal
+import time
+
+from scheduler import JobScheduler, QueueFullError
+from trainer import CHUNK_MODES, PREEMPT_SIGNAL, PREEMPTED_EXIT_CODE, latest_checkpoint
+from dataset_cache import DatasetCache
+from document_parsing import TextCache
+from worker_pool import WorkerPool
+from uploads import UploadError, UploadManager, UploadOffsetError, safe_filename
+from blob_store import BlobStore
+from job_store import JobStore, process_group, process_identity, signal_process
+from job_logs import LogStore
+from job_events import EventHub
+from training_metrics import METRICS_FD_ENV, read_metrics
+from telemetry import Telemetry, prometheus_text
+from model_export import export_model
+from model_registry import ModelRegistry
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -27,25 +45,81 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Global storage for training jobs
-training_jobs: Dict[str, Dict[str, Any]] = {}
-
 # Configuration
 UPLOAD_DIR = Path("uploads")
 MODELS_DIR = Path("trained_models")
+JOB_DB_PATH = Path(os.environ.get("JOB_DB_PATH", "jobs.db"))
+JOB_LOG_DIR = Path(os.environ.get("JOB_LOG_DIR", "job_logs"))
+MODEL_DB_PATH = Path(os.environ.get("MODEL_DB_PATH", "models.db"))
+MAX_MODEL_PAGE = 500
+# Recent log lines kept in memory per job; older ones are read back from the job's log file
+LOG_RING_SIZE = int(os.environ.get("LOG_RING_SIZE", "1000"))
+MAX_LOG_PAGE = 10000
+# /status includes only the latest few lines; /logs pages through the rest
+STATUS_LOG_LINES = 20
+# Log lines an /events subscriber may fall behind before it is switched to catching up from the log file
+EVENT_QUEUE_LINES = 1000
+EVENT_KEEPALIVE_SECONDS = 15
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+# How long a cancelled job's trainer gets to exit after SIGTERM before its process group is killed
+CANCEL_TIMEOUT = float(os.environ.get("CANCEL_TIMEOUT", "30"))
+# How often running jobs' memory and host CPU are sampled (backs off if sampling gets expensive)
+TELEMETRY_INTERVAL = float(os.environ.get("TELEMETRY_INTERVAL", "5"))
+DATASET_CACHE_DIR = Path(os.environ.get("DATASET_CACHE_DIR", "dataset_cache"))
+DATASET_CACHE_MAX_BYTES = int(os.environ.get("DATASET_CACHE_MAX_BYTES", str(10 * 1024**3)))
+# Text extracted from PDF/Markdown uploads, cached apart from the preprocessed datasets with its own budget
+TEXT_CACHE_DIR = Path(os.environ.get("TEXT_CACHE_DIR", "text_cache"))
+TEXT_CACHE_MAX_BYTES = int(os.environ.get("TEXT_CACHE_MAX_BYTES", str(2 * 1024**3)))
 UPLOAD_DIR.mkdir(exist_ok=True)
 MODELS_DIR.mkdir(exist_ok=True)
 
+# Uploads: largest accepted file, and the piece size used when streaming request bodies to disk
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(10 * 1024**3)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# A client-supplied content hash must look like one before it is used as a blob name
+SHA256_HEX = re.compile(r"[0-9a-f]{64}")
+upload_manager = UploadManager(UPLOAD_DIR / ".sessions", MAX_UPLOAD_BYTES)
+# Upload contents are stored once per SHA-256; names are references into the store
+blob_store = BlobStore(UPLOAD_DIR / ".store")
+
+# Scheduling: comma-separated CUDA ordinals (or "cpu"), concurrent jobs per device,
+# and how many jobs may wait in the queue before /train starts rejecting them.
+TRAINING_DEVICES = [d.strip() for d in os.environ.get("TRAINING_DEVICES", "0").split(",") if d.strip()]
+JOBS_PER_DEVICE = int(os.environ.get("JOBS_PER_DEVICE", "1"))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "32"))
+# Let a queued job preempt a lower-priority running one (which checkpoints and re-queues) when no slot is free
+PREEMPT_LOWER_PRIORITY = os.environ.get("PREEMPT_LOWER_PRIORITY", "0") == "1"
+# Command that runs the trainer; it receives the JSON job spec on stdin.
+# Override (e.g. with a fake trainer) for testing.
+TRAINER_COMMAND = shlex.split(os.environ.get("TRAINER_COMMAND", "")) or [sys.executable, "-u", "-m", "trainer", "-"]
+APP_DIR = Path(__file__).resolve().parent
+# Keep base models loaded in long-lived workers instead of starting a cold process per job
+USE_WORKER_POOL = os.environ.get("USE_WORKER_POOL", "0") == "1"
+
+# Training jobs live in memory and are written back to SQLite in batches
+event_hub = EventHub(EVENT_QUEUE_LINES)
+log_store = LogStore(JOB_LOG_DIR, LOG_RING_SIZE, on_append=event_hub.publish_line)
+job_store = JobStore(JOB_DB_PATH, log_factory=log_store.open)
+training_jobs: Dict[str, Dict[str, Any]] = job_store.jobs
+telemetry = Telemetry(TELEMETRY_INTERVAL)
+# Metadata of every job output and saved model, so listing never scans MODELS_DIR
+model_registry = ModelRegistry(MODEL_DB_PATH)
+
 # Pydantic models (remains the same)
 class TrainingStatus(BaseModel):
     job_id: str
-    status: str  # "pending", "running", "completed", "failed"
+    status: str  # "pending", "running", "paused", "completed", "failed", "cancelled"
     progress: Optional[float] = None
+    priority: Optional[int] = None
+    queue_position: Optional[int] = None
+    device: Optional[str] = None
     message: Optional[str] = None
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
     model_path: Optional[str] = None
     logs: Optional[List[str]] = None
+    worker_stats: Optional[Dict[str, Any]] = None
+    metrics: Optional[Dict[str, Any]] = None
 
 # Add your target model to the list
 AVAILABLE_MODELS = [
@@ -55,198 +129,257 @@ AVAILABLE_MODELS = [
     "unsloth/mistral-7b-bnb-4bit",
 ]
 
-# Key Change 2: Moved this function definition before `run_training`
-def create_training_script(job_data: Dict[str, Any]) -> str:
-    """Create the training script content based on job data."""
-    model_name = job_data["model_name"]
-    # Ensure the dataset path is correctly referenced from the root
-    dataset_path = UPLOAD_DIR / job_data["dataset_file"]
-    params = job_data["parameters"]
-    job_id = job_data["job_id"]
-    output_model_dir = f"trained_models/{job_id}"
-
-    # Key Change 4: Replaced the data loader with the one from your proven Colab script.
-    # This is much cleaner and directly serves your goal for text files.
-    script = f"""
-import os
-import sys
-import torch
-import json
-import re
-from unsloth import FastLanguageModel
-from datasets import Dataset
-from trl import SFTTrainer
-from transformers import TrainingArguments
-
-# Using the proven data preparation function from your Colab script
-def prepare_document_data(file_path, chunk_size=256):
-    print(f"Reading and preparing data from: {{file_path}}")
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            document_text = f.read()
-    except Exception as e:
-        print(f"Error reading file: {{e}}")
-        sys.exit(1)
-
-    sentences = re.split(r'(?<=[.!?])\\s+', document_text)
-    chunks = []
-    current_chunk = []
-    current_length = 0
-
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if not sentence:
-            continue
-        sentence_length = len(sentence.split())
-        if current_length + sentence_length > chunk_size and current_chunk:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [sentence]
-            current_length = sentence_length
-        else:
-            current_chunk.append(sentence)
-            current_length += sentence_length
-    
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-    
-    data = {{"text": chunks}}
-    dataset = Dataset.from_dict(data)
-    print(f"Created {{len(dataset)}} chunks from the document.")
-    return dataset
-
-def main():
-    try:
-        # Model parameters
-        model_name = "{model_name}"
-        max_seq_length = {params['max_seq_length']}
-        
-        print("Loading model and tokenizer...")
-        model, tokenizer = FastLanguageModel.from_pretrained(
-            model_name=model_name,
-            max_seq_length=max_seq_length,
-            dtype=None,
-            load_in_4bit=True,
-        )
-        
-        print("Preparing LoRA adapters...")
-        model = FastLanguageModel.get_peft_model(
-            model,
-            r=8,
-            target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
-            lora_alpha=16,
-            lora_dropout=0,
-            bias="none",
-            use_gradient_checkpointing=True,
-            random_state=3407,
-        )
-        
-        dataset = prepare_document_data(r"{str(dataset_path)}")
-        
-        if len(dataset) == 0:
-            print("Error: No data was loaded from the dataset file.")
-            sys.exit(1)
-
-        # Training arguments
-        training_args = TrainingArguments(
-            output_dir="{output_model_dir}",
-            num_train_epochs={params['num_train_epochs']},
-            per_device_train_batch_size={params['per_device_train_batch_size']},
-            gradient_accumulation_steps={params['gradient_accumulation_steps']},
-            warmup_steps={params['warmup_steps']},
-            learning_rate={params['learning_rate']},
-            fp16=not torch.cuda.is_bf16_supported(),
-            bf16=torch.cuda.is_bf16_supported(),
-            logging_steps={params['logging_steps']},
-            optim="adamw_8bit",
-            save_strategy="steps",
-            save_steps={params['save_steps']},
-            save_total_limit=1,
-            report_to="none",
-            seed=3407,
-        )
-        
-        trainer = SFTTrainer(
-            model=model,
-            tokenizer=tokenizer,
-            train_dataset=dataset,
-            dataset_text_field="text",
-            max_seq_length=max_seq_length,
-            args=training_args,
-        )
-        
-        print("Starting training...")
-        trainer.train()
-        
-        print("Saving final model...")
-        model.save_pretrained("{output_model_dir}")
-        tokenizer.save_pretrained("{output_model_dir}")
-        
-        print("Training completed successfully!")
-
-    except Exception as e:
-        print(f"An error occurred during training: {{e}}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
+def job_state(job_id: str) -> Dict[str, Any]:
+    """The part of a job that /events pushes whenever it changes"""
+    job_data = training_jobs[job_id]
+    return {
+        "job_id": job_id, "status": job_data["status"], "progress": job_data.get("progress"),
+        "device": job_data.get("device"), "queue_position": scheduler.queue_position(job_id),
+        "message": job_data.get("message"), "model_path": job_data.get("model_path"),
+        "metrics": job_data.get("metrics"),
+    }
 
-if __name__ == "__main__":
-    main()
-"""
-    return script
+def job_changed(job_id: str):
+    """Persist a job's new state and push it to /events subscribers"""
+    job_store.update(job_id)
+    if event_hub.subscriber_count(job_id):
+        event_hub.publish_state(job_id, job_state(job_id))
+
+def handle_training_output(job_id: str, job_data: Dict[str, Any], line_str: str):
+    """Record one line of trainer output"""
+    job_data["logs"].append(line_str)
+    logger.info(f"Job {job_id}: {line_str}")
+
+def handle_training_metrics(job_id: str, job_data: Dict[str, Any], metrics: Dict[str, Any]):
+    """Apply one structured metrics event from the trainer (see training_metrics.py)"""
+    telemetry.record_metrics(job_id, metrics)
+    latest = job_data.setdefault("metrics", {})
+    latest.update((key, value) for key, value in metrics.items() if key != "event")
+    if latest.get("total_steps"):
+        job_data["progress"] = round(latest.get("step", 0) / latest["total_steps"] * 100, 2)
+    job_changed(job_id)
+
+def build_job_spec(job_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The parameters a trainer needs for one job, in a form that can cross a process boundary."""
+    return {
+        "job_id": job_data["job_id"],
+        "model_name": job_data["model_name"],
+        "dataset_path": str(blob_store.blob_path(job_data["dataset_blob"])),
+        "output_dir": f"trained_models/{job_data['job_id']}",
+        "dataset_hash": job_data["dataset_hash"],
+        "parameters": dict(job_data["parameters"]),
+        "dataset_cache": {"dir": str(DATASET_CACHE_DIR), "max_bytes": DATASET_CACHE_MAX_BYTES},
+        "text_cache": {"dir": str(TEXT_CACHE_DIR), "max_bytes": TEXT_CACHE_MAX_BYTES},
+    }
 
+def record_process(job_id: str, job_data: Dict[str, Any], pid: int, pgid: Optional[int] = None):
+    """Remember which process (and process group, if it has its own) runs a job, so it can be stopped"""
+    job_data["process"] = {"pid": pid, "started": process_identity(pid), "pgid": pgid}
+    job_store.update(job_id)
 
-async def run_training(job_id: str, job_data: Dict[str, Any]):
-    """Run the actual training process"""
-    job_data["status"] = "running"
-    job_data["logs"].append(f"Starting training for job {job_id}")
-    
-    script_content = create_training_script(job_data)
-    script_path = Path(f"training_script_{job_id}.py")
+async def run_training_subprocess(job_id: str, job_data: Dict[str, Any], env: Dict[str, str]) -> int:
+    """Run the job in a fresh trainer process and return its exit code"""
+    # Make `-m trainer` importable regardless of the API's working directory
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(APP_DIR), env.get("PYTHONPATH")]))
+    # Metrics come back as JSON lines on their own pipe; stdout is only logged
+    metrics_read, metrics_write = os.pipe()
+    env[METRICS_FD_ENV] = str(metrics_write)
 
     try:
-        with open(script_path, "w") as f:
-            f.write(script_content)
-        
-        # Key Change 1: Added '-u' for unbuffered output
         process = await asyncio.create_subprocess_exec(
-            sys.executable, "-u", str(script_path),  # Use sys.executable to be safe
+            *TRAINER_COMMAND,
+            stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.STDOUT, # Redirect stderr to stdout
+            env=env,
+            pass_fds=(metrics_write,),
+            # Its own process group, so cancelling the job reaches everything the trainer started
+            start_new_session=True,
         )
-        
-        # Regex to parse trainer progress like ` 25%|██▌       | 10/40 [00:05<00:15,  1.95it/s]`
-        # Or the new HF format: `[ 10/40 ... ]`
-        progress_regex = re.compile(r"(\s*\d+\s*)/(\s*\d+\s*)")
+    except BaseException:
+        os.close(metrics_read)
+        raise
+    finally:
+        os.close(metrics_write)
+
+    async def consume_metrics():
+        async for metrics in read_metrics(metrics_read):
+            handle_training_metrics(job_id, job_data, metrics)
+
+    metrics_task = asyncio.create_task(consume_metrics())
+    record_process(job_id, job_data, process.pid, pgid=process.pid)
+    try:
+        process.stdin.write(json.dumps(build_job_spec(job_data)).encode())
+        await process.stdin.drain()
+        process.stdin.close()
 
         async for line in process.stdout:
             line_str = line.decode().strip()
-            if not line_str:
-                continue
+            if line_str:
+                handle_training_output(job_id, job_data, line_str)
+
+        returncode = await process.wait()
+        await metrics_task
+    except BaseException:
+        # Cancelled (or failed) while the trainer runs: don't leave its process tree behind
+        if process.returncode is None:
+            signal_process(job_data["process"], signal.SIGKILL, group=True)
+        metrics_task.cancel()
+        raise
+    finally:
+        job_data.pop("process", None)
+    return returncode
+
+def stop_job(job_id: str, action: str) -> bool:
+    """Ask a running job's trainer to checkpoint and stop; `action` ("pause" or "requeue") is what happens next"""
+    job_data = training_jobs.get(job_id)
+    process = (job_data or {}).get("process")
+    if job_data is None or job_data["status"] != "running" or not process or job_data.get("stop_action") == "cancel":
+        return False
+    try:
+        # Only the trainer itself: the signal would terminate any helper processes it started
+        if not signal_process(process, PREEMPT_SIGNAL):
+            return False
+    except OSError as e:
+        logger.error(f"Could not signal process {process['pid']} of job {job_id}: {str(e)}")
+        return False
+    job_data["stop_action"] = action
+    job_data["logs"].append(f"Stop requested ({action}); saving a checkpoint at the end of the current step")
+    return True
+
+async def cancel_job(job_id: str) -> Dict[str, Any]:
+    """Cancel a pending, paused or running job and return what that freed.
+
+    A running trainer's process group gets SIGTERM, then SIGKILL after
+    CANCEL_TIMEOUT seconds; a resident worker is only asked to stop the job
+    (and is killed if it does not). Returns once the job's scheduler slot is free.
+    """
+    job_data = training_jobs[job_id]
+    freed: Dict[str, Any] = {"device": None, "processes": [], "signal": None}
+    device = scheduler.running_device(job_id)
+    if job_data["status"] == "pending" and scheduler.remove(job_id):
+        freed["queue_slot"] = True
+    elif job_data["status"] in ("pending", "running") and device is not None:
+        started = time.monotonic()
+        job_data["stop_action"] = "cancel"
+        job_data["logs"].append("Cancel requested")
+        if job_data["status"] == "pending":
+            # Dispatched but run_training has not started yet; it returns as soon as it sees this
+            job_data["status"] = "cancelled"
+            job_data["end_time"] = datetime.now()
+            job_data["logs"].append("Training cancelled")
+        freed["device"] = device
+        freed["gpu_memory_mb"] = (job_data.get("metrics") or {}).get("gpu_memory_mb")
+        process = job_data.get("process")
+        if process:
+            # A resident worker outlives the job; only a trainer's own process group goes away
+            group = bool(process.get("pgid"))
+            if group:
+                freed["processes"] = await asyncio.to_thread(process_group, process["pgid"])
+            else:
+                freed["worker_pid"] = process["pid"]
+            try:
+                if signal_process(process, signal.SIGTERM if group else PREEMPT_SIGNAL, group=group):
+                    freed["signal"] = "SIGTERM" if group else PREEMPT_SIGNAL.name
+                    if not await scheduler.wait(job_id, CANCEL_TIMEOUT) and signal_process(process, signal.SIGKILL, group=group):
+                        freed["signal"] = "SIGKILL"
+                        if not group:
+                            freed["processes"] = [process["pid"]]
+            except OSError as e:
+                logger.error(f"Could not signal process {process['pid']} of job {job_id}: {str(e)}")
+        if not await scheduler.wait(job_id, CANCEL_TIMEOUT):
+            # No process to signal yet (still starting) or it will not go away: stop the runner itself
+            scheduler.cancel(job_id)
+            await scheduler.wait(job_id)
+        freed["seconds"] = round(time.monotonic() - started, 2)
+    if job_data["status"] != "cancelled":
+        job_data["status"] = "cancelled"
+        job_data["end_time"] = datetime.now()
+        job_data["logs"].append("Training cancelled")
+    job_data.pop("stop_action", None)
+    job_data["message"] = "Cancelled"
+    job_changed(job_id)
+    # Its runner has finished or never ran, so nothing writes to this log again
+    job_data["logs"].close()
+    return freed
+
+async def run_training(job_id: str, job_data: Dict[str, Any]) -> bool:
+    """Run the actual training process. Returns True if it was preempted and should be queued again"""
+    requeue = False
+    if job_data["status"] == "cancelled":
+        job_data.pop("stop_action", None)
+        return requeue
+    job_data["status"] = "running"
+    job_data.pop("message", None)
+    checkpoint = latest_checkpoint(str(MODELS_DIR / job_id))
+    if checkpoint:
+        job_data["logs"].append(f"Resuming training for job {job_id} from {Path(checkpoint).name}")
+    else:
+        job_data["logs"].append(f"Starting training for job {job_id}")
+    job_changed(job_id)
 
-            job_data["logs"].append(line_str)
-            logger.info(f"Job {job_id}: {line_str}")
-            
-            # Key Change 3: More reliable progress parsing
-            match = progress_regex.search(line_str)
-            if match:
-                current_step = int(match.group(1).strip())
-                total_steps = int(match.group(2).strip())
-                if total_steps > 0:
-                    progress = (current_step / total_steps) * 100
-                    job_data["progress"] = round(progress, 2)
-
-        await process.wait()
+    try:
+        # Pin the process to the device slot the scheduler assigned
+        env = os.environ.copy()
+        device = job_data.get("device")
+        if device and device != "cpu":
+            env["CUDA_VISIBLE_DEVICES"] = device
+        elif device == "cpu":
+            env["CUDA_VISIBLE_DEVICES"] = ""
+        job_data["logs"].append(f"Assigned to device {device}")
+
+        if worker_pool is not None:
+            result = await worker_pool.run_job(
+                build_job_spec(job_data), device or "0",
+                lambda line_str: handle_training_output(job_id, job_data, line_str),
+                on_start=lambda pid: record_process(job_id, job_data, pid),
+                on_metrics=lambda metrics: handle_training_metrics(job_id, job_data, metrics),
+            )
+            job_data.pop("process", None)
+            returncode = result["returncode"]
+            job_data["worker_stats"] = {
+                key: result.get(key) for key in ("warm_start", "startup_seconds_saved", "job_seconds", "jobs_served")
+            }
+            if result.get("error"):
+                job_data["logs"].append(result["error"])
+            job_data["logs"].append(
+                f"Worker saved {result.get('startup_seconds_saved', 0.0)}s of model startup for this job"
+            )
+        else:
+            returncode = await run_training_subprocess(job_id, job_data, env)
         
-        if process.returncode == 0:
+        if job_data.get("stop_action") == "cancel":
+            job_data["status"] = "cancelled"
+            job_data["end_time"] = datetime.now()
+            job_data["logs"].append(f"Training cancelled (trainer exited with return code {returncode})")
+        elif returncode == 0:
             job_data["status"] = "completed"
             job_data["progress"] = 100.0
             job_data["end_time"] = datetime.now()
             job_data["model_path"] = f"trained_models/{job_id}"
             job_data["logs"].append("Training completed successfully!")
+            try:
+                await model_registry.add(
+                    job_id, "job", Path(job_data["model_path"]), job_id=job_id, base_model=job_data["model_name"],
+                    dataset_file=job_data.get("dataset_file"), dataset_hash=job_data.get("dataset_hash"),
+                    metrics=job_data.get("metrics"),
+                )
+            except Exception as e:
+                logger.error(f"Could not register the model of job {job_id}: {str(e)}")
+        elif returncode == PREEMPTED_EXIT_CODE:
+            # Stopped at a checkpoint; the next run resumes from it
+            if job_data.get("stop_action") == "requeue":
+                job_data["status"] = "pending"
+                job_data["message"] = "Preempted; queued to resume from its checkpoint"
+                requeue = True
+            else:
+                job_data["status"] = "paused"
+                job_data["message"] = f"Paused; resume with POST /job/{job_id}/resume"
+            job_data["logs"].append(job_data["message"])
         else:
             job_data["status"] = "failed"
             job_data["end_time"] = datetime.now()
-            job_data["logs"].append(f"Training failed with return code {process.returncode}. Check logs for details.")
+            job_data["logs"].append(f"Training failed with return code {returncode}. Check logs for details.")
             
     except Exception as e:
         job_data["status"] = "failed"
@@ -254,8 +387,21 @@ async def run_training(job_id: str, job_data: Dict[str, Any]):
         job_data["logs"].append(f"API failed to execute training script: {str(e)}")
         logger.error(f"Training job {job_id} failed: {str(e)}")
     finally:
-        if script_path.exists():
-            script_path.unlink()
+        job_data.pop("stop_action", None)
+        job_changed(job_id)
+        job_data["logs"].close()
+    return requeue
+
+# Resident training workers are opt-in (USE_WORKER_POOL=1); otherwise every job gets a fresh process
+worker_pool = WorkerPool(workers_per_device=JOBS_PER_DEVICE) if USE_WORKER_POOL else None
+
+dataset_cache = DatasetCache(DATASET_CACHE_DIR, DATASET_CACHE_MAX_BYTES)
+text_cache = TextCache(TEXT_CACHE_DIR, TEXT_CACHE_MAX_BYTES)
+
+scheduler = JobScheduler(
+    run_training, TRAINING_DEVICES, slots_per_device=JOBS_PER_DEVICE, max_queue=MAX_QUEUED_JOBS,
+    preempt=(lambda job_id: stop_job(job_id, "requeue")) if PREEMPT_LOWER_PRIORITY else None,
+)
 
 # --- The rest of your FastAPI endpoints remain largely the same ---
 # (I've included them for completeness)
@@ -275,27 +421,103 @@ async def upload_dataset(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
     
-    file_path = UPLOAD_DIR / file.filename
+    async def file_chunks():
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        result = await upload_manager.receive(file_chunks(), file.filename)
+        ref = await blob_store.put_file(result["path"], result["filename"], result["sha256"])
         
         return {
             "message": "File uploaded successfully",
-            "filename": file.filename,
-            "path": str(file_path)
+            "filename": result["filename"],
+            "size": result["size"],
+            "sha256": result["sha256"],
+            "deduplicated": ref["deduplicated"]
         }
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
+@app.post("/uploads/sessions", status_code=201)
+async def create_upload_session(
+    filename: str = Form(...), total_size: Optional[int] = Form(None), sha256: Optional[str] = Form(None)
+):
+    """Start a resumable upload; send the file with PUT /uploads/sessions/{upload_id}?offset=N
+
+    If the client sends the file's SHA-256 and that content is already stored, the
+    name is linked to it right away and nothing needs to be uploaded.
+    """
+    try:
+        name = safe_filename(filename)
+        digest = sha256.lower() if sha256 else None
+        if digest and SHA256_HEX.fullmatch(digest) and blob_store.has_blob(digest, name):
+            # The size recorded is the stored blob's, never the one the client claims
+            ref = await blob_store.link(name, digest, name)
+            return JSONResponse(status_code=200, content={
+                "status": "exists", "message": "File already uploaded", "filename": name,
+                "size": ref["size"], "sha256": digest, "deduplicated": True
+            })
+        session = upload_manager.create(filename, total_size)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {**session.to_dict(), "chunk_size": UPLOAD_CHUNK_SIZE, "max_bytes": MAX_UPLOAD_BYTES}
+
+@app.get("/uploads/sessions/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Current offset of a resumable upload, i.e. where the client should continue from"""
+    try:
+        return upload_manager.get(upload_id).to_dict()
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.put("/uploads/sessions/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    """Append the request body to a resumable upload at `offset`"""
+    try:
+        session = await upload_manager.write(upload_id, offset, request.stream())
+    except UploadOffsetError as e:
+        return JSONResponse(status_code=409, content={"detail": str(e), "offset": e.expected})
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return session.to_dict()
+
+@app.post("/uploads/sessions/{upload_id}/complete")
+async def complete_upload_session(upload_id: str):
+    """Finish a resumable upload and make the file available for training"""
+    try:
+        result = await upload_manager.complete(upload_id)
+    except UploadOffsetError as e:
+        return JSONResponse(status_code=409, content={"detail": str(e), "offset": e.expected})
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    ref = await blob_store.put_file(result["path"], result["filename"], result["sha256"])
+    return {
+        "message": "File uploaded successfully", "filename": result["filename"],
+        "size": result["size"], "sha256": result["sha256"], "deduplicated": ref["deduplicated"]
+    }
+
+@app.delete("/uploads/sessions/{upload_id}")
+async def abort_upload_session(upload_id: str):
+    """Abandon a resumable upload and delete its partial data"""
+    try:
+        await upload_manager.abort(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"message": f"Upload {upload_id} aborted"}
+
 @app.get("/uploads")
-async def list_uploaded_files():
-    """List all uploaded dataset files"""
-    return [f.name for f in UPLOAD_DIR.iterdir() if f.is_file()]
+async def list_uploaded_files(after: Optional[str] = None, limit: Optional[int] = None):
+    """List uploaded dataset files with their size and content hash, in name order (page with after/limit)"""
+    return [
+        {"filename": ref["name"], "size": ref["size"], "sha256": ref["sha256"], "uploaded_at": ref["uploaded_at"]}
+        for ref in blob_store.list(after, limit)
+    ]
 
 @app.post("/train", status_code=202)
 async def start_training(
-    background_tasks: BackgroundTasks,
     model_name: str = Form(...),
     dataset_file: str = Form(...),
     max_seq_length: int = Form(1024),
@@ -305,67 +527,232 @@ async def start_training(
     learning_rate: float = Form(2e-4),
     warmup_steps: int = Form(5),
     save_steps: int = Form(50),
-    logging_steps: int = Form(1)
+    logging_steps: int = Form(1),
+    chunk_mode: str = Form("words"),
+    packing: bool = Form(False),
+    priority: int = Form(0)
 ):
     """Start training a model"""
     if model_name not in AVAILABLE_MODELS:
         raise HTTPException(status_code=400, detail=f"Model {model_name} not available")
+    if chunk_mode not in CHUNK_MODES:
+        raise HTTPException(status_code=400, detail=f"chunk_mode must be one of {list(CHUNK_MODES)}")
     
-    dataset_path = UPLOAD_DIR / dataset_file
-    if not dataset_path.exists():
+    # Pin the current version of the dataset; re-uploading the name later doesn't affect this job
+    dataset_ref = blob_store.resolve(dataset_file)
+    if dataset_ref is None:
         raise HTTPException(status_code=404, detail=f"Dataset file '{dataset_file}' not found in uploads directory")
     
     job_id = str(uuid.uuid4())
     
-    training_jobs[job_id] = {
+    job_store.add(job_id, {
         "job_id": job_id, "status": "pending", "model_name": model_name,
-        "dataset_file": dataset_file,
+        "dataset_file": dataset_file, "dataset_blob": dataset_ref["blob"], "dataset_hash": dataset_ref["sha256"],
         "parameters": {
             "max_seq_length": max_seq_length, "learning_rate": learning_rate,
             "num_train_epochs": num_train_epochs,
             "per_device_train_batch_size": per_device_train_batch_size,
             "gradient_accumulation_steps": gradient_accumulation_steps,
-            "warmup_steps": warmup_steps, "save_steps": save_steps, "logging_steps": logging_steps
+            "warmup_steps": warmup_steps, "save_steps": save_steps, "logging_steps": logging_steps,
+            "chunk_mode": chunk_mode, "packing": packing
         },
-        "start_time": datetime.now(), "logs": [], "progress": 0.0
-    }
+        "start_time": datetime.now(), "logs": log_store.open(job_id), "progress": 0.0
+    })
     
-    background_tasks.add_task(run_training, job_id, training_jobs[job_id])
+    try:
+        queue_position = scheduler.submit(job_id, training_jobs[job_id], priority=priority)
+    except QueueFullError as e:
+        job_store.delete(job_id)
+        log_store.delete(job_id)
+        raise HTTPException(status_code=429, detail=str(e))
     
-    return {"job_id": job_id, "status": "Training queued", "message": f"Check status at /status/{job_id}"}
+    return {
+        "job_id": job_id, "status": "Training queued", "queue_position": queue_position,
+        "message": f"Check status at /status/{job_id}"
+    }
 
 @app.get("/status/{job_id}", response_model=TrainingStatus)
 async def get_training_status(job_id: str):
     """Get training status for a specific job"""
     if job_id not in training_jobs:
         raise HTTPException(status_code=404, detail="Job not found")
-    return TrainingStatus(**training_jobs[job_id])
+    job_data = training_jobs[job_id]
+    return TrainingStatus(
+        **{**job_data, "logs": job_data["logs"].tail(STATUS_LOG_LINES)}, queue_position=scheduler.queue_position(job_id)
+    )
+
+@app.post("/job/{job_id}/cancel")
+async def cancel_training_job(job_id: str):
+    """Stop a job for good: kill its trainer's process tree and free its scheduler slot"""
+    if job_id not in training_jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if training_jobs[job_id]["status"] in TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job is already {training_jobs[job_id]['status']}")
+    freed = await cancel_job(job_id)
+    return {"job_id": job_id, "status": training_jobs[job_id]["status"], "freed": freed}
+
+@app.post("/job/{job_id}/pause")
+async def pause_training_job(job_id: str):
+    """Stop a job at a checkpoint (or take it out of the queue) until it is resumed"""
+    if job_id not in training_jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job_data = training_jobs[job_id]
+    if job_data["status"] == "pending" and scheduler.remove(job_id):
+        job_data["status"] = "paused"
+        job_data["message"] = f"Paused; resume with POST /job/{job_id}/resume"
+        job_changed(job_id)
+        return {"job_id": job_id, "status": "paused"}
+    if not stop_job(job_id, "pause"):
+        raise HTTPException(status_code=409, detail=f"Job is {job_data['status']}, not running a trainer that can be paused")
+    return {"job_id": job_id, "status": "pausing", "message": "The job will pause after saving a checkpoint"}
+
+@app.post("/job/{job_id}/preempt")
+async def preempt_training_job(job_id: str):
+    """Stop a running job at a checkpoint and put it back in the queue, freeing its slot for higher-priority jobs"""
+    if job_id not in training_jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not stop_job(job_id, "requeue"):
+        raise HTTPException(status_code=409, detail=f"Job is {training_jobs[job_id]['status']}, not running a trainer that can be preempted")
+    return {"job_id": job_id, "status": "preempting", "message": "The job will re-queue after saving a checkpoint"}
+
+@app.post("/job/{job_id}/resume")
+async def resume_training_job(job_id: str, priority: Optional[int] = Form(None)):
+    """Queue a paused (or failed) job again; it continues from its latest checkpoint"""
+    if job_id not in training_jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job_data = training_jobs[job_id]
+    if job_data["status"] not in ("paused", "failed"):
+        raise HTTPException(status_code=409, detail=f"Job is {job_data['status']}; only paused or failed jobs can be resumed")
+    previous_status = job_data["status"]
+    job_data["status"] = "pending"
+    try:
+        queue_position = scheduler.submit(
+            job_id, job_data, priority=job_data.get("priority", 0) if priority is None else priority
+        )
+    except QueueFullError as e:
+        job_data["status"] = previous_status
+        raise HTTPException(status_code=429, detail=str(e))
+    checkpoint = latest_checkpoint(str(MODELS_DIR / job_id))
+    job_data["end_time"] = None
+    job_data["message"] = f"Queued to resume from {Path(checkpoint).name}" if checkpoint else "Queued to restart"
+    job_changed(job_id)
+    return {
+        "job_id": job_id, "status": "Training queued", "queue_position": queue_position,
+        "checkpoint": Path(checkpoint).name if checkpoint else None,
+    }
+
+@app.get("/events/{job_id}")
+async def stream_job_events(job_id: str, request: Request, since: Optional[int] = None):
+    """Server-Sent Events stream of a job's state changes and new log lines
+
+    Events: `state` (status, progress, ...), `log` ({"line", "text"}, with the line
+    number as the event id) and a final `end` once the job has finished. `since`
+    (or a reconnecting client's Last-Event-ID) replays log lines from that number.
+    """
+    if job_id not in training_jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id) + 1
+    stream = event_hub.stream(
+        job_id, training_jobs[job_id]["logs"], lambda: job_state(job_id) if job_id in training_jobs else None,
+        since, request.is_disconnected, EVENT_KEEPALIVE_SECONDS, TERMINAL_STATUSES,
+    )
+    return StreamingResponse(
+        stream, media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/jobs")
-async def list_training_jobs():
-    """List all training jobs"""
+async def list_training_jobs(status: Optional[str] = None, limit: Optional[int] = None):
+    """List training jobs, newest first, optionally only those with a given status"""
+    await job_store.flush()
+    job_ids = await asyncio.to_thread(job_store.find, status=status, limit=limit)
     return [
         {
             "job_id": job_id, "status": data["status"], "model_name": data["model_name"],
-            "progress": data.get("progress", 0.0), "start_time": data.get("start_time")
+            "progress": data.get("progress", 0.0), "start_time": data.get("start_time"),
+            "priority": data.get("priority", 0), "queue_position": scheduler.queue_position(job_id)
         }
-        for job_id, data in training_jobs.items()
+        for job_id in job_ids
+        if (data := training_jobs.get(job_id)) is not None
     ]
 
+@app.get("/scheduler")
+async def get_scheduler_state():
+    """Show device slot usage and the pending job queue"""
+    return {**scheduler.snapshot(), "workers": worker_pool.snapshot() if worker_pool else []}
+
+def running_job_pids() -> Dict[str, int]:
+    return {
+        job_id: job_data["process"]["pid"] for job_id, job_data in training_jobs.items()
+        if job_data["status"] == "running" and job_data.get("process")
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """Latest per-job throughput and memory, job counts and host CPU in Prometheus format"""
+    return PlainTextResponse(prometheus_text(telemetry, training_jobs), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/{job_id}")
+async def get_job_metrics(job_id: str):
+    """Time series of a job's tokens/sec, step time, memory and host CPU (downsampled for long runs)"""
+    if job_id not in training_jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job_telemetry = telemetry.jobs.get(job_id)
+    return {
+        "job_id": job_id, "status": training_jobs[job_id]["status"],
+        **(job_telemetry.to_dict() if job_telemetry else {"series": {}}),
+        "collection_overhead": telemetry.overhead(),
+    }
+
+@app.get("/cache/datasets")
+async def get_dataset_cache_stats():
+    """Hit/miss counts and disk usage of the preprocessed dataset cache"""
+    # Takes the cache's file lock, which a training process may hold while it evicts
+    return await asyncio.to_thread(dataset_cache.stats)
+
+@app.delete("/cache/datasets")
+async def clear_dataset_cache():
+    """Remove every cached preprocessed dataset"""
+    await asyncio.to_thread(dataset_cache.clear)
+    return {"message": "Dataset cache cleared"}
+
+@app.get("/cache/text")
+async def get_text_cache_stats():
+    """Disk usage of the cache of text extracted from PDF and Markdown uploads"""
+    return await asyncio.to_thread(text_cache.stats)
+
+@app.delete("/cache/text")
+async def clear_text_cache():
+    """Remove all cached extracted text"""
+    await asyncio.to_thread(text_cache.clear)
+    return {"message": "Text cache cleared"}
+
 # ... (the rest of your endpoints like /logs, /save-model, etc. are fine as they were) ...
 # I will include them here for a complete file.
 
 @app.get("/logs/{job_id}")
-async def get_training_logs(job_id: str):
-    """Get training logs for a specific job"""
+async def get_training_logs(job_id: str, since: Optional[int] = None, limit: int = 1000):
+    """Get training logs for a specific job
+
+    Without `since` this returns the last `limit` lines. Pass the returned `next`
+    as `since` on the following request to receive only new lines.
+    """
     if job_id not in training_jobs:
         raise HTTPException(status_code=404, detail="Job not found")
+    limit = max(1, min(limit, MAX_LOG_PAGE))
     
-    return {"job_id": job_id, "logs": training_jobs[job_id]["logs"]}
+    log = training_jobs[job_id]["logs"]
+    total = len(log)
+    start = max(total - limit, 0) if since is None else max(since, 0)
+    # Reads are served from the in-memory ring, or from at most limit + INDEX_STRIDE lines of the file
+    lines = log.read(start, limit)
+    return {"job_id": job_id, "logs": lines, "since": start, "next": start + len(lines), "total": total}
 
 @app.post("/save-model/{job_id}")
-async def save_trained_model(job_id: str, model_name: str = Form(...)):
-    """Save a trained model with a custom name"""
+async def save_trained_model(job_id: str, model_name: str = Form(...), adapter_only: bool = Form(False)):
+    """Save a trained model with a custom name (files are linked, not copied; checkpoints are left out)"""
     if job_id not in training_jobs:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -373,40 +760,131 @@ async def save_trained_model(job_id: str, model_name: str = Form(...)):
     if job_data["status"] != "completed":
         raise HTTPException(status_code=400, detail="Training must be completed first")
     
-    source_path = Path(f"trained_models/{job_id}")
+    try:
+        model_name = safe_filename(model_name)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    source_path = Path(job_data.get("model_path") or f"trained_models/{job_id}")
     dest_path = MODELS_DIR / model_name
     
     if dest_path.exists():
         raise HTTPException(status_code=400, detail="Model name already exists")
     
+    manifest = {"job_id": job_id, "base_model": job_data["model_name"], "dataset_file": job_data.get("dataset_file"),
+                "dataset_hash": job_data.get("dataset_hash"), "metrics": job_data.get("metrics")}
     try:
-        shutil.copytree(source_path, dest_path)
-        return {"message": f"Model saved as {model_name}", "path": str(dest_path)}
+        info = await asyncio.to_thread(export_model, source_path, dest_path, adapter_only, manifest)
+    except FileExistsError:
+        raise HTTPException(status_code=400, detail="Model name already exists")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save model: {str(e)}")
+    await model_registry.add(model_name, "saved", dest_path, **info)
+    return {"message": f"Model saved as {model_name}", "path": str(dest_path), **info}
 
 @app.get("/saved-models")
-async def list_saved_models():
-    """List all saved models"""
-    models = []
-    for model_path in MODELS_DIR.iterdir():
-        if model_path.is_dir():
-            models.append(model_path.name)
-    return models
+async def list_saved_models(
+    kind: Optional[str] = None,
+    base_model: Optional[str] = None,
+    job_id: Optional[str] = None,
+    prefix: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+):
+    """List job outputs (kind=job) and saved models (kind=saved), newest first, with their metadata
+
+    Pass the returned next_cursor as cursor to get the following page.
+    """
+    if limit < 1 or limit > MAX_MODEL_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_MODEL_PAGE}")
+    try:
+        return await model_registry.page(kind, base_model, job_id, prefix, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/saved-models/{model_name}")
+async def get_saved_model(model_name: str):
+    """Metadata of one job output or saved model"""
+    entry = await model_registry.get(model_name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return entry
+
+@app.delete("/saved-models/{model_name}")
+async def delete_saved_model(model_name: str):
+    """Delete a saved model (job outputs are deleted with their job)"""
+    entry = await model_registry.get(model_name)
+    if entry is None or entry["kind"] != "saved":
+        raise HTTPException(status_code=404, detail="Saved model not found")
+    await asyncio.to_thread(shutil.rmtree, entry["path"], True)
+    await model_registry.remove(model_name)
+    return {"message": f"Model {model_name} deleted"}
 
 @app.delete("/job/{job_id}")
 async def delete_training_job(job_id: str):
-    """Delete a training job and its temporary files"""
+    """Delete a training job and its temporary files, cancelling it first if it has not finished"""
     if job_id not in training_jobs:
         raise HTTPException(status_code=404, detail="Job not found")
     
+    freed = None
+    if training_jobs[job_id]["status"] not in TERMINAL_STATUSES:
+        freed = await cancel_job(job_id)
+    
     temp_model_path = Path(f"trained_models/{job_id}")
     if temp_model_path.exists():
         shutil.rmtree(temp_model_path)
     
-    del training_jobs[job_id]
+    job_store.delete(job_id)
+    log_store.delete(job_id)
+    telemetry.remove(job_id)
+    await model_registry.remove(job_id)
     
-    return {"message": f"Job {job_id} deleted successfully"}
+    return {"message": f"Job {job_id} deleted successfully", "freed": freed}
+
+@app.on_event("startup")
+async def adopt_legacy_uploads():
+    # Files dropped straight into the uploads directory (or left by older versions) become references
+    adopted = await blob_store.adopt(UPLOAD_DIR)
+    if adopted:
+        logger.info(f"Added {adopted} existing upload(s) to the blob store")
+
+async def requeue_restored_jobs(job_ids: List[str]):
+    """Queue the jobs from before a restart once their orphaned trainers have checkpointed and exited"""
+    await job_store.stop_orphans()
+    for job_id in job_ids:
+        job_data = training_jobs.get(job_id)
+        if job_data is None or job_data["status"] != "pending":
+            continue  # deleted or cancelled in the meantime
+        try:
+            scheduler.submit(job_id, job_data, priority=job_data.get("priority", 0))
+        except QueueFullError as e:
+            job_data["status"] = "failed"
+            job_data["end_time"] = datetime.now()
+            job_data["logs"].append(f"Could not re-queue job after restart: {str(e)}")
+            job_data["logs"].close()
+            job_store.update(job_id)
+
+@app.on_event("startup")
+async def restore_jobs():
+    # Jobs from before a restart: running ones are stopped at a checkpoint and, like pending ones, queued again;
+    # waiting for the old processes happens in the background so the API is up meanwhile
+    asyncio.create_task(requeue_restored_jobs(job_store.reconcile()))
+    job_store.start()
+    telemetry.start(running_job_pids)
+    # Model directories created by older versions (or removed by hand) since the registry last saw them
+    added, removed = await model_registry.sync(MODELS_DIR, training_jobs)
+    if added or removed:
+        logger.info(f"Model registry: added {added} and dropped {removed} model(s) found out of sync")
+
+@app.on_event("shutdown")
+async def stop_worker_pool():
+    if worker_pool is not None:
+        await worker_pool.shutdown()
+    telemetry.stop()
+    await job_store.close()
+    log_store.close()
+    model_registry.close()
 
 if __name__ == "__main__":
     import uvicorn
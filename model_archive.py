@@ -0,0 +1,207 @@
+# model_archive.py
+"""Zip archives of trained model directories, streamed while they are built.
+
+The first download of a model directory streams the archive to the client as
+it is written and tees it into a cache file; later downloads (and resumed
+ones) are served from that file, which supports byte ranges. Archives are
+cached under a fingerprint of the directory's file list, sizes and mtimes,
+so a changed model gets a new archive and the old one is removed.
+
+Weight files are already dense, so they are STORED rather than deflated,
+which keeps archiving at disk speed. The zip is always written to an
+unseekable sink (sizes in data descriptors), so a streamed archive and the
+cached one are byte-identical and a download interrupted during the first,
+streamed pass can resume against the cached file.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+CHUNK_SIZE = 1 << 20
+# Dense binary formats that deflate would only slow down
+STORED_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth", ".gguf", ".ckpt", ".zip", ".model")
+
+
+def _files(directory: Path) -> List[Tuple[str, Path]]:
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = Path(root) / name
+            files.append((path.relative_to(directory).as_posix(), path))
+    return sorted(files)
+
+
+def directory_fingerprint(directory: Path) -> str:
+    """Hash of the relative paths, sizes and mtimes of every file under `directory`."""
+    digest = hashlib.sha256()
+    for relative, path in _files(directory):
+        st = path.stat()
+        digest.update(f"{relative}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Sink:
+    """Unseekable file object that writes to `out` and hands `on_chunk` CHUNK_SIZE pieces."""
+
+    def __init__(self, out, on_chunk: Optional[Callable[[bytes], None]]):
+        self.out = out
+        self.on_chunk = on_chunk
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.out.write(data)
+        if self.on_chunk is not None:
+            self.buffer += data
+            if len(self.buffer) >= CHUNK_SIZE:
+                self.on_chunk(bytes(self.buffer))
+                self.buffer.clear()
+        return len(data)
+
+    def flush(self):
+        if self.on_chunk is not None and self.buffer:
+            self.on_chunk(bytes(self.buffer))
+            self.buffer.clear()
+        self.out.flush()
+
+
+def write_archive(directory: Path, out, on_chunk: Optional[Callable[[bytes], None]] = None):
+    """Zip `directory` into the binary file `out`, passing the bytes written to `on_chunk` as they go."""
+    sink = _Sink(out, on_chunk)
+    with zipfile.ZipFile(sink, "w") as zf:
+        for relative, path in _files(directory):
+            compression = zipfile.ZIP_STORED if path.suffix in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+            zf.write(path, relative, compress_type=compression)
+    sink.flush()
+
+
+def parse_range(header: str, size: int) -> Tuple[int, int]:
+    """(first, last) byte of a single `bytes=` range; ValueError if it is malformed or unsatisfiable."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError(f"Unsupported range: {header}")
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        start, end = max(size - int(last), 0), size - 1  # suffix range: the last N bytes
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
+
+
+async def iter_file(path: Path, start: int, end: int) -> AsyncIterator[bytes]:
+    """Bytes `start`..`end` (inclusive) of a file, read off the event loop."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class ModelArchives:
+    """Cached archives in `root`, one per (key, directory fingerprint)."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._building: Dict[Path, asyncio.Future] = {}
+
+    def path(self, key: str, fingerprint: str) -> Path:
+        return self.root / f"{key}-{fingerprint[:16]}.zip"
+
+    def _build(self, key: str, directory: Path, fingerprint: str,
+               on_chunk: Optional[Callable[[bytes], None]] = None) -> Path:
+        final = self.path(key, fingerprint)
+        temp = self.root / f".{final.name}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp, "wb") as out:
+                write_archive(directory, out, on_chunk)
+            os.replace(temp, final)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+        for stale in self.root.glob(f"{key}-*.zip"):
+            if stale != final:
+                stale.unlink(missing_ok=True)
+        return final
+
+    def remove(self, key: str):
+        for archive in self.root.glob(f"{key}-*.zip"):
+            archive.unlink(missing_ok=True)
+
+    async def build(self, key: str, directory: Path, fingerprint: str) -> Path:
+        """The cached archive, building it first (once, however many callers wait) if needed."""
+        final = self.path(key, fingerprint)
+        if final.exists():
+            return final
+        future = self._building.get(final)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self._build, key, directory, fingerprint))
+            self._building[final] = future
+            future.add_done_callback(lambda _: self._building.pop(final, None))
+        return await asyncio.shield(future)
+
+    async def stream(self, key: str, directory: Path, fingerprint: str) -> AsyncIterator[bytes]:
+        """Yield the archive while it is built into the cache.
+
+        If the client goes away, the archive is still finished in the background
+        so that a resumed download can be served from the cache. A download that
+        starts while the archive is already being built waits for it and is then
+        served from the cache, rather than building a second copy.
+        """
+        final = self.path(key, fingerprint)
+        if final.exists() or final in self._building:
+            path = await self.build(key, directory, fingerprint)
+            async for chunk in iter_file(path, 0, path.stat().st_size - 1):
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=8)
+        detached = threading.Event()
+
+        def on_chunk(chunk):
+            # Runs on the builder thread; blocks while the client is behind, unless it is gone
+            while not detached.is_set():
+                try:
+                    asyncio.run_coroutine_threadsafe(asyncio.wait_for(chunks.put(chunk), 1.0), loop).result()
+                    return
+                except asyncio.TimeoutError:
+                    continue
+
+        def build() -> Path:
+            try:
+                path = self._build(key, directory, fingerprint, on_chunk)
+            except Exception as e:
+                on_chunk(e)
+                raise
+            on_chunk(None)
+            return path
+
+        def finished(future):
+            self._building.pop(final, None)
+            future.exception()  # retrieved; reported to the client below
+
+        builder = loop.run_in_executor(None, build)
+        self._building[final] = builder
+        builder.add_done_callback(finished)
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            detached.set()
@@ -0,0 +1,182 @@
+# model_registry.py
+"""Index of trained and saved models in SQLite.
+
+Every model directory (a job's output, "job", or a model saved under a name,
+"saved") has one row with its metadata: base model, dataset, size, metrics
+and so on. Listing is a single indexed query per page, with keyset
+pagination on (created_at, name), so browsing costs the same on page 500 as
+on page 1 and never touches the model directories themselves.
+
+The registry is updated as models are created and deleted; `sync()` brings
+it in line with the models directory once at startup, for models made by
+older versions or removed by hand.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from model_export import MANIFEST_NAME
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    job_id TEXT,
+    base_model TEXT,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS models_created ON models (created_at, name);
+CREATE INDEX IF NOT EXISTS models_kind_created ON models (kind, created_at, name);
+CREATE INDEX IF NOT EXISTS models_base_created ON models (base_model, created_at, name);
+CREATE INDEX IF NOT EXISTS models_job ON models (job_id);
+"""
+
+
+def directory_size(path: Path) -> Tuple[int, int]:
+    """Total bytes and number of files under `path`."""
+    size = files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += (Path(root) / name).stat().st_size
+                files += 1
+            except OSError:
+                continue
+    return size, files
+
+
+def encode_cursor(created_at: float, name: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, name]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Raises ValueError for a cursor this registry did not hand out."""
+    try:
+        created_at, name = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(created_at), str(name)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class ModelRegistry:
+    """Model metadata rows, keyed by the model's directory name."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _put(self, entry: Dict[str, Any]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO models (name, kind, job_id, base_model, created_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (entry["name"], entry["kind"], entry.get("job_id"), entry.get("base_model"), entry["created_at"],
+                 json.dumps(entry, default=str)),
+            )
+
+    def _delete(self, name: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM models WHERE name = ?", (name,))
+
+    async def add(self, name: str, kind: str, path: Path, **info) -> Dict[str, Any]:
+        """Register (or replace) the model in directory `path`; sizes it if `info` has no size."""
+        entry = {"name": name, "kind": kind, "path": str(path), "created_at": time.time(), **info}
+        if entry.get("size") is None:
+            entry["size"], entry["files"] = await asyncio.to_thread(directory_size, Path(path))
+        await asyncio.to_thread(self._put, entry)
+        return entry
+
+    async def remove(self, name: str):
+        await asyncio.to_thread(self._delete, name)
+
+    async def get(self, name: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, name)
+
+    def _get(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM models WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def page(self, kind: Optional[str] = None, base_model: Optional[str] = None, job_id: Optional[str] = None,
+                   name_prefix: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Newest models first, `limit` per page; pass the returned `next_cursor` to get the next page."""
+        return await asyncio.to_thread(self._page, kind, base_model, job_id, name_prefix, limit, cursor)
+
+    def _page(self, kind: Optional[str], base_model: Optional[str], job_id: Optional[str],
+              name_prefix: Optional[str], limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+        clauses, args = [], []
+        for column, value in (("kind", kind), ("base_model", base_model), ("job_id", job_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if name_prefix:
+            clauses.append("substr(name, 1, ?) = ?")
+            args += [len(name_prefix), name_prefix]
+        if cursor is not None:
+            clauses.append("(created_at, name) < (?, ?)")
+            args += list(decode_cursor(cursor))
+        query = "SELECT created_at, name, data FROM models"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created_at DESC, name DESC LIMIT ?"
+        args.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "models": [json.loads(data) for _, _, data in rows],
+            "next_cursor": encode_cursor(rows[-1][0], rows[-1][1]) if more else None,
+        }
+
+    def _scan(self, models_dir: Path, jobs: Dict[str, Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        with self._lock:
+            known = dict(self._conn.execute("SELECT name, data FROM models").fetchall())
+        added = []
+        for path in Path(models_dir).iterdir():
+            if not path.is_dir() or path.name.startswith(".") or path.name in known:
+                continue
+            job = jobs.get(path.name)
+            if job is not None:
+                if job.get("status") != "completed":
+                    continue
+                entry = {"kind": "job", "job_id": path.name, "base_model": job.get("model_name"),
+                         "dataset_file": job.get("dataset_file"), "dataset_hash": job.get("dataset_hash"),
+                         "metrics": job.get("metrics")}
+            else:
+                manifest_path = path / MANIFEST_NAME
+                entry = {"kind": "saved"}
+                if manifest_path.exists():
+                    try:
+                        entry.update(json.loads(manifest_path.read_text()))
+                    except ValueError:
+                        pass
+            entry.update(name=path.name, path=str(path), created_at=entry.get("saved_at") or path.stat().st_mtime)
+            if entry.get("size") is None:
+                entry["size"], entry["files"] = directory_size(path)
+            self._put(entry)
+            added.append(entry)
+        removed = [name for name, data in known.items() if not Path(json.loads(data)["path"]).is_dir()]
+        for name in removed:
+            self._delete(name)
+        return added, removed
+
+    async def sync(self, models_dir: Path, jobs: Dict[str, Dict[str, Any]]) -> Tuple[int, int]:
+        """Register model directories missing from the index and drop rows whose directory is gone."""
+        added, removed = await asyncio.to_thread(self._scan, models_dir, jobs)
+        return len(added), len(removed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
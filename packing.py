@@ -0,0 +1,94 @@
+# packing.py
+"""Pack tokenized chunks into fixed-length training blocks.
+
+Chunks are tokenized, terminated with EOS and concatenated into blocks of
+exactly `block_size` tokens, so a step spends its compute on text rather
+than on padding. `position_ids` restart at 0 at every chunk, at every block
+and at the padding of the last block of each map batch, and blocks carry no
+`attention_mask`. Flash-attention then takes its varlen path, which treats
+each run of positions as its own sequence, so chunks never attend to each
+other. Other attention implementations see ordinary causal packing; padding
+only ever follows real tokens and its labels are masked, so it needs no mask.
+"""
+
+from typing import Any, Dict, List
+
+# Per-block bookkeeping columns, dropped before training
+_STAT_COLUMNS = ["chunk_count", "chunk_tokens", "block_tokens"]
+
+
+def _pack_batch(batch: Dict[str, List[Any]], tokenizer, block_size: int) -> Dict[str, List[Any]]:
+    encoded = tokenizer(batch["text"], add_special_tokens=True, return_attention_mask=False)["input_ids"]
+    eos = tokenizer.eos_token_id
+    pad = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else eos
+
+    blocks: Dict[str, List[Any]] = {
+        "input_ids": [], "labels": [], "position_ids": [],
+        "chunk_count": [], "chunk_tokens": [], "block_tokens": [],
+    }
+    input_ids: List[int] = []
+    position_ids: List[int] = []
+    chunk_count = chunk_tokens = 0
+
+    def flush():
+        nonlocal input_ids, position_ids, chunk_count, chunk_tokens
+        real = len(input_ids)
+        padding = block_size - real
+        blocks["input_ids"].append(input_ids + [pad] * padding)
+        blocks["labels"].append(input_ids + [-100] * padding)
+        blocks["position_ids"].append(position_ids + list(range(padding)))
+        blocks["chunk_count"].append(chunk_count)
+        blocks["chunk_tokens"].append(chunk_tokens)
+        blocks["block_tokens"].append(real)
+        input_ids, position_ids = [], []
+        chunk_count = chunk_tokens = 0
+
+    for ids in encoded:
+        if eos is not None and (not ids or ids[-1] != eos):
+            ids = ids + [eos]
+        # Attribute each chunk to the block it starts in; unpacked it would be cut at block_size
+        chunk_count += 1
+        chunk_tokens += min(len(ids), block_size)
+        while ids:
+            room = block_size - len(input_ids)
+            piece, ids = ids[:room], ids[room:]
+            input_ids += piece
+            # A chunk cut at a block boundary restarts too: varlen attention flattens the whole
+            # batch, so only a position of 0 separates it from the end of the previous row
+            position_ids += range(len(piece))
+            if len(input_ids) == block_size:
+                flush()
+    if input_ids:
+        # Only the last block of each map batch carries padding
+        flush()
+    return blocks
+
+
+def pack_dataset(dataset, tokenizer, block_size: int, batch_size: int = 1000):
+    """Pack a one-column ("text") dataset into `block_size` blocks.
+
+    Returns the packed dataset and a dict with the padding ratio of the
+    chunks padded to `block_size` one per row ("padding_before") and of the
+    packed blocks ("padding_after"). The packed Arrow files are written next
+    to `dataset`'s own cache files.
+    """
+    packed = dataset.map(
+        _pack_batch,
+        batched=True,
+        batch_size=batch_size,
+        remove_columns=dataset.column_names,
+        fn_kwargs={"tokenizer": tokenizer, "block_size": block_size},
+    )
+
+    counts = packed.select_columns(_STAT_COLUMNS).with_format("numpy")
+    chunks = int(counts["chunk_count"].sum())
+    tokens = int(counts["chunk_tokens"].sum())
+    real_tokens = int(counts["block_tokens"].sum())
+    stats = {
+        "chunks": chunks,
+        "blocks": len(packed),
+        "block_size": block_size,
+        "padding_before": 1 - tokens / (chunks * block_size) if chunks else 0.0,
+        "padding_after": 1 - real_tokens / (len(packed) * block_size) if len(packed) else 0.0,
+    }
+    return packed.remove_columns(_STAT_COLUMNS), stats
@@ -0,0 +1,96 @@
+# response_cache.py
+"""Cache of /generate results for repeated deterministic requests.
+
+Decoding is greedy, so the same prompt and parameters against the same
+adapter weights give the same completion; evaluation scripts that re-send a
+fixed probe can be answered without touching the GPU. Callers opt in per
+request.
+
+Entries are keyed on a fingerprint of the adapter's weights rather than the
+job id alone, so a model retrained in place (new weights under the same job)
+never serves a stale answer; `invalidate(adapter_id)` also drops a job's
+entries eagerly when it is deleted or its weights change. The cache is
+bounded by the total size of the cached texts and evicts least recently used.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from dataset_cache import hash_file
+
+
+class ResponseCache:
+    """LRU map from (model, adapter fingerprint, prompt, parameters) to a generate() result."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._entries: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any], int]]" = OrderedDict()
+        # adapter id -> ((weights path, size, mtime), sha256 of the weights)
+        self._fingerprints: Dict[str, Tuple[Tuple[str, int, int], str]] = {}
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    async def fingerprint(self, adapter_id: Optional[str], weights: Optional[Path]) -> Optional[str]:
+        """sha256 of the adapter's weights file, re-hashed (off the event loop) only when the file changes."""
+        if adapter_id is None:
+            return "base"
+        try:
+            st = os.stat(weights)
+        except (OSError, TypeError):
+            return None
+        stat_key = (str(weights), st.st_size, st.st_mtime_ns)
+        known = self._fingerprints.get(adapter_id)
+        if known is not None and known[0] == stat_key:
+            return known[1]
+        if known is not None:
+            # New weights for this job (retrained); its old answers are stale now
+            self.invalidate(adapter_id)
+        digest = await asyncio.to_thread(hash_file, str(weights))
+        self._fingerprints[adapter_id] = (stat_key, digest)
+        return digest
+
+    @staticmethod
+    def key(model_name: str, fingerprint: str, prompt: str, params: Dict[str, Any]) -> str:
+        material = json.dumps([model_name, fingerprint, prompt, params], sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return dict(entry[1])
+
+    def put(self, key: str, adapter_id: Optional[str], result: Dict[str, Any]):
+        size = len(json.dumps(result)) + len(key)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.used -= self._entries.pop(key)[2]
+        self._entries[key] = (adapter_id, dict(result), size)
+        self.used += size
+        while self.used > self.max_bytes:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.used -= evicted
+            self.counters["evictions"] += 1
+
+    def invalidate(self, adapter_id: str):
+        """Forget everything generated with `adapter_id`."""
+        self._fingerprints.pop(adapter_id, None)
+        for key in [key for key, entry in self._entries.items() if entry[0] == adapter_id]:
+            self.used -= self._entries.pop(key)[2]
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "entries": len(self._entries), "max_bytes": self.max_bytes, "bytes": self.used,
+            **self.counters, "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,165 @@
+# scheduler.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Returns True to put the job back in the queue (it was preempted and will resume later)
+Runner = Callable[[str, Dict[str, Any]], Awaitable[Optional[bool]]]
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the pending queue is at capacity."""
+
+
+class JobScheduler:
+    """Priority queue of training jobs dispatched onto a fixed set of device slots.
+
+    Each device (a CUDA ordinal such as "0", or "cpu") gets `slots_per_device`
+    concurrent jobs. Jobs that cannot start immediately stay "pending" in the
+    queue, ordered by priority (higher first) and then submission order.
+
+    With a `preempt` callback, a queued job that finds every slot taken asks
+    the lowest-priority running job below its own priority (the most recently
+    started one, on a tie) to stop at a checkpoint; `preempt(job_id)` returns
+    False if the job could not be signalled. The runner of a preempted job
+    returns True and the job goes back in the queue.
+    """
+
+    def __init__(self, runner: Runner, devices: List[str], slots_per_device: int = 1, max_queue: int = 32,
+                 preempt: Optional[Callable[[str], bool]] = None):
+        if not devices:
+            raise ValueError("At least one device is required")
+        if slots_per_device < 1:
+            raise ValueError("slots_per_device must be >= 1")
+        self._runner = runner
+        self.devices = list(devices)
+        self.slots_per_device = slots_per_device
+        self.max_queue = max_queue
+        self._queue: List[Tuple[int, int, str]] = []
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, str] = {}  # job_id -> device
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._counter = itertools.count()
+        self._preempt = preempt
+        self._running_order: Dict[str, Tuple[int, int]] = {}  # job_id -> (priority, start order)
+        self._preempting: Set[str] = set()
+
+    def submit(self, job_id: str, job_data: Dict[str, Any], priority: int = 0) -> Optional[int]:
+        """Queue a job and start it if a slot is free. Returns its queue position, or None if started."""
+        if len(self._queue) >= self.max_queue:
+            raise QueueFullError(f"Training queue is full ({self.max_queue} pending jobs)")
+        job_data["priority"] = priority
+        heapq.heappush(self._queue, (-priority, next(self._counter), job_id))
+        self._pending[job_id] = job_data
+        self._dispatch()
+        return self.queue_position(job_id)
+
+    def remove(self, job_id: str) -> bool:
+        """Drop a pending job from the queue. Returns False if it was not queued."""
+        if job_id not in self._pending:
+            return False
+        del self._pending[job_id]
+        self._queue = [entry for entry in self._queue if entry[2] != job_id]
+        heapq.heapify(self._queue)
+        return True
+
+    def running_device(self, job_id: str) -> Optional[str]:
+        """The device a dispatched job holds a slot on, or None if it is queued or not scheduled."""
+        return self._running.get(job_id)
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """Wait until a running job has finished and freed its slot. False if it is still running after `timeout`."""
+        task = self._tasks.get(job_id)
+        if task is None:
+            return True
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+        return bool(done)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a running job's runner task; its slot is freed once the runner unwinds (see `wait`)."""
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """1-based position of a pending job in dispatch order, or None if not queued."""
+        if job_id not in self._pending:
+            return None
+        for position, entry in enumerate(sorted(self._queue), start=1):
+            if entry[2] == job_id:
+                return position
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current slot usage and queue contents, for the API."""
+        return {
+            "devices": {
+                device: {
+                    "slots": self.slots_per_device,
+                    "running": [job_id for job_id, d in self._running.items() if d == device],
+                }
+                for device in self.devices
+            },
+            "pending": [entry[2] for entry in sorted(self._queue)],
+            "preempting": sorted(self._preempting),
+            "max_queue": self.max_queue,
+        }
+
+    def _free_device(self) -> Optional[str]:
+        load = {device: 0 for device in self.devices}
+        for device in self._running.values():
+            load[device] += 1
+        device = min(self.devices, key=lambda d: load[d])
+        return device if load[device] < self.slots_per_device else None
+
+    def _preempt_for(self, priority: int):
+        # One preemption at a time: the slot it frees goes to the best queued job
+        if self._preempt is None or self._preempting:
+            return
+        candidates = [
+            (job_priority, -order, job_id) for job_id, (job_priority, order) in self._running_order.items()
+            if job_priority < priority
+        ]
+        if not candidates:
+            return
+        _, _, victim = min(candidates)
+        if self._preempt(victim):
+            logger.info(f"Preempting job {victim} for a queued job of priority {priority}")
+            self._preempting.add(victim)
+
+    def _dispatch(self):
+        while self._queue:
+            device = self._free_device()
+            if device is None:
+                self._preempt_for(-self._queue[0][0])
+                return
+            _, _, job_id = heapq.heappop(self._queue)
+            job_data = self._pending.pop(job_id)
+            job_data["device"] = device
+            self._running[job_id] = device
+            self._running_order[job_id] = (job_data.get("priority", 0), next(self._counter))
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id, job_data))
+
+    async def _run(self, job_id: str, job_data: Dict[str, Any]):
+        requeue = False
+        try:
+            requeue = await self._runner(job_id, job_data)
+        except Exception as e:
+            logger.error(f"Scheduled job {job_id} raised: {str(e)}")
+        finally:
+            self._running.pop(job_id, None)
+            self._tasks.pop(job_id, None)
+            self._running_order.pop(job_id, None)
+            self._preempting.discard(job_id)
+            if requeue:
+                # Already admitted once, so it does not count against max_queue
+                heapq.heappush(self._queue, (-job_data.get("priority", 0), next(self._counter), job_id))
+                self._pending[job_id] = job_data
+            self._dispatch()
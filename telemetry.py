@@ -0,0 +1,243 @@
+# telemetry.py
+"""Per-job performance time series: throughput, step time, memory and host CPU.
+
+Each series is a pair of `array('d')` buffers (timestamps and values) with a
+fixed capacity. When a series fills up, neighbouring points are averaged
+pairwise and later samples are averaged in groups twice as large, so a run of
+any length is kept at a bounded size with a resolution that degrades evenly
+instead of dropping its beginning.
+
+Trainer-reported values (tokens/sec, step time) arrive with the metrics
+events. Process memory and host CPU are sampled from /proc by a background
+task; its interval backs off if collection starts to cost more than
+`max_overhead` of wall time.
+"""
+
+import asyncio
+import time
+from array import array
+from typing import Any, Dict, List, Optional
+
+SERIES_CAPACITY = 512
+
+
+class Series:
+    """Time series of floats that downsamples itself to stay within `capacity` points."""
+
+    def __init__(self, capacity: int = SERIES_CAPACITY):
+        self.capacity = capacity - capacity % 2
+        self.times = array("d")
+        self.values = array("d")
+        self.stride = 1  # raw samples averaged into each stored point
+        self.last: Optional[float] = None
+        self._acc_t = 0.0
+        self._acc_v = 0.0
+        self._acc_n = 0
+
+    def add(self, t: float, value: float):
+        self.last = value
+        self._acc_t += t
+        self._acc_v += value
+        self._acc_n += 1
+        if self._acc_n < self.stride:
+            return
+        self.times.append(self._acc_t / self._acc_n)
+        self.values.append(self._acc_v / self._acc_n)
+        self._acc_t = self._acc_v = 0.0
+        self._acc_n = 0
+        if len(self.values) >= self.capacity:
+            self._halve()
+
+    def _halve(self):
+        times, values = self.times, self.values
+        self.times = array("d", ((times[i] + times[i + 1]) / 2 for i in range(0, len(times), 2)))
+        self.values = array("d", ((values[i] + values[i + 1]) / 2 for i in range(0, len(values), 2)))
+        self.stride *= 2
+
+    def to_dict(self) -> Dict[str, Any]:
+        times, values = list(self.times), list(self.values)
+        if self._acc_n:
+            times.append(self._acc_t / self._acc_n)
+            values.append(self._acc_v / self._acc_n)
+        return {"t": [round(t, 3) for t in times], "v": values, "samples_per_point": self.stride, "last": self.last}
+
+
+def read_rss(pid: int) -> Optional[Dict[str, int]]:
+    """Current and peak resident memory of `pid` in bytes, from /proc."""
+    rss = {}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    rss[line[:5]] = int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return {"rss": rss.get("VmRSS", 0), "peak_rss": rss.get("VmHWM", 0)}
+
+
+class HostCpu:
+    """Host-wide CPU utilisation between consecutive calls, from /proc/stat."""
+
+    def __init__(self):
+        self._previous = self._read()
+
+    @staticmethod
+    def _read() -> Optional[List[int]]:
+        try:
+            with open("/proc/stat", "r") as f:
+                return [int(field) for field in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+
+    def percent(self) -> Optional[float]:
+        current = self._read()
+        previous, self._previous = self._previous, current
+        if current is None or previous is None:
+            return None
+        deltas = [c - p for c, p in zip(current, previous)]
+        total = sum(deltas)
+        idle = deltas[3] + (deltas[4] if len(deltas) > 4 else 0)  # idle + iowait
+        return round(100.0 * (total - idle) / total, 2) if total > 0 else None
+
+
+class JobTelemetry:
+    SERIES = ("tokens_per_sec", "samples_per_sec", "step_seconds", "rss_bytes", "peak_rss_bytes", "host_cpu_percent")
+
+    def __init__(self, capacity: int = SERIES_CAPACITY):
+        self.started = time.time()
+        self.series = {name: Series(capacity) for name in self.SERIES}
+        # Time the trainer's metrics callback has cost, as reported by the trainer itself
+        self.trainer_overhead: Dict[str, Any] = {"seconds": None, "ratio": None}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "series": {name: s.to_dict() for name, s in self.series.items()},
+            "trainer_overhead": self.trainer_overhead,
+        }
+
+
+class Telemetry:
+    """Time series for every job, plus the sampler that fills in process and host metrics."""
+
+    def __init__(self, interval: float = 5.0, max_overhead: float = 0.01, capacity: int = SERIES_CAPACITY):
+        self.base_interval = interval
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.capacity = capacity
+        self.jobs: Dict[str, JobTelemetry] = {}
+        self.host_cpu = HostCpu()
+        self.host_cpu_percent: Optional[float] = None
+        self._started = time.perf_counter()
+        self._overhead = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def job(self, job_id: str) -> JobTelemetry:
+        telemetry = self.jobs.get(job_id)
+        if telemetry is None:
+            telemetry = self.jobs[job_id] = JobTelemetry(self.capacity)
+        return telemetry
+
+    def remove(self, job_id: str):
+        self.jobs.pop(job_id, None)
+
+    def record_metrics(self, job_id: str, metrics: Dict[str, Any]):
+        """Add the throughput values of a trainer "step" event."""
+        if metrics.get("event") != "step":
+            return
+        started = time.perf_counter()
+        telemetry = self.job(job_id)
+        now = time.time()
+        for name in ("tokens_per_sec", "samples_per_sec", "step_seconds"):
+            value = metrics.get(name)
+            if value is not None:
+                telemetry.series[name].add(now, float(value))
+        if metrics.get("overhead_seconds") is not None:
+            telemetry.trainer_overhead = {"seconds": metrics["overhead_seconds"], "ratio": metrics.get("overhead_ratio")}
+        self._overhead += time.perf_counter() - started
+
+    def sample(self, pids: Dict[str, int]):
+        """Record memory of each running job's process (`job_id -> pid`) and host CPU."""
+        started = time.perf_counter()
+        now = time.time()
+        self.host_cpu_percent = self.host_cpu.percent()
+        for job_id, pid in pids.items():
+            telemetry = self.job(job_id)
+            rss = read_rss(pid)
+            if rss is not None:
+                telemetry.series["rss_bytes"].add(now, float(rss["rss"]))
+                telemetry.series["peak_rss_bytes"].add(now, float(rss["peak_rss"]))
+            if self.host_cpu_percent is not None:
+                telemetry.series["host_cpu_percent"].add(now, self.host_cpu_percent)
+        self._overhead += time.perf_counter() - started
+
+    def overhead(self) -> Dict[str, Any]:
+        wall = max(time.perf_counter() - self._started, 1e-9)
+        return {
+            "collection_seconds": round(self._overhead, 6),
+            "wall_seconds": round(wall, 3),
+            "ratio": self._overhead / wall,
+            "sample_interval_seconds": self.interval,
+        }
+
+    async def run(self, get_pids):
+        """Sample every `interval` seconds; `get_pids()` returns the running jobs' pids."""
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sample(get_pids())
+            # Back off (and later recover) so collection stays under max_overhead of wall time
+            ratio = self.overhead()["ratio"]
+            if ratio > self.max_overhead / 2:
+                self.interval = min(self.interval * 2, 60.0)
+            elif ratio < self.max_overhead / 8 and self.interval > self.base_interval:
+                self.interval = max(self.interval / 2, self.base_interval)
+
+    def start(self, get_pids):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(get_pids))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text(telemetry: Telemetry, jobs: Dict[str, Dict[str, Any]]) -> str:
+    """All jobs' latest values in the Prometheus text exposition format."""
+    lines = []
+
+    def gauge(name: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    statuses: Dict[str, int] = {}
+    for job_data in jobs.values():
+        statuses[job_data["status"]] = statuses.get(job_data["status"], 0) + 1
+    gauge("unsloth_jobs", "Training jobs by status.", [({"status": s}, n) for s, n in sorted(statuses.items())])
+
+    tracked = [(job_id, jobs[job_id], t) for job_id, t in telemetry.jobs.items() if job_id in jobs]
+    gauge("unsloth_job_progress_ratio", "Fraction of training steps completed.",
+          [({"job_id": job_id}, (job_data.get("progress") or 0) / 100) for job_id, job_data, _ in tracked])
+    for series, name, help_text in (
+        ("tokens_per_sec", "unsloth_job_tokens_per_second", "Latest training throughput in tokens per second."),
+        ("samples_per_sec", "unsloth_job_samples_per_second", "Latest training throughput in samples per second."),
+        ("step_seconds", "unsloth_job_step_seconds", "Duration of the latest optimizer step."),
+        ("rss_bytes", "unsloth_job_rss_bytes", "Resident memory of the job's process."),
+        ("peak_rss_bytes", "unsloth_job_peak_rss_bytes", "Peak resident memory of the job's process."),
+    ):
+        gauge(name, help_text, [({"job_id": job_id}, t.series[series].last) for job_id, _, t in tracked])
+
+    gauge("unsloth_host_cpu_percent", "Host CPU utilisation.", [({}, telemetry.host_cpu_percent)])
+    overhead = telemetry.overhead()
+    gauge("unsloth_telemetry_overhead_ratio", "Share of API wall time spent collecting telemetry.",
+          [({}, overhead["ratio"])])
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,5 @@
 import requests
-import time
+import json
 import os
 import shutil
 from pathlib import Path
@@ -55,6 +55,17 @@ def cleanup_previous_run():
         os.remove(DATASET_FILENAME)
         print(f"   - Removed old dataset: {DATASET_FILENAME}")
 
+def stream_job_events(job_id):
+    """Yield (event, data) pairs from the job's Server-Sent Events stream until it ends."""
+    with requests.get(f"{BASE_URL}/events/{job_id}", stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                yield event, json.loads(line[len("data: "):])
+
 def run_e2e_test():
     """Runs a full end-to-end test of the fine-tuning API."""
     
@@ -84,30 +95,26 @@ def run_e2e_test():
     job_id = response.json()["job_id"]
     print(f"   - Training job started with ID: {job_id}\n")
 
-    # 4. Monitor Job Until Completion
+    # 4. Monitor Job Until Completion (pushed by the server, no polling)
     print("4. Monitoring training progress...")
-    while True:
-        response = requests.get(f"{BASE_URL}/status/{job_id}")
-        response.raise_for_status()
-        status_data = response.json()
-        status = status_data["status"]
-        progress = status_data.get("progress", 0)
-        
-        print(f"   - Status: {status} | Progress: {progress:.2f}%")
-        
-        if status == "completed":
-            print("   - Training completed successfully!\n")
+    status = None
+    for event, data in stream_job_events(job_id):
+        if event == "state":
+            print(f"   - Status: {data['status']} | Progress: {data.get('progress') or 0:.2f}%")
+        elif event == "end":
+            status = data["status"]
             break
-        elif status == "failed":
-            print("   - ERROR: Training failed!")
-            # Fetch and print logs on failure
-            logs_response = requests.get(f"{BASE_URL}/logs/{job_id}")
-            print("   - Last 10 log entries:")
-            for log in logs_response.json().get("logs", [])[-10:]:
-                print(f"     {log}")
-            return # Exit the test
-            
-        time.sleep(15) # Poll every 15 seconds
+        
+    if status == "completed":
+        print("   - Training completed successfully!\n")
+    else:
+        print(f"   - ERROR: Training {status}!")
+        # Fetch and print logs on failure
+        logs_response = requests.get(f"{BASE_URL}/logs/{job_id}", params={"limit": 10})
+        print("   - Last 10 log entries:")
+        for log in logs_response.json().get("logs", []):
+            print(f"     {log}")
+        return # Exit the test
 
     # 5. Save the Completed Model
     print(f"5. Saving the fine-tuned model as '{SAVED_MODEL_NAME}'...")
@@ -118,9 +125,9 @@ def run_e2e_test():
 
     # 6. Verify Model was Saved
     print("6. Verifying model was saved...")
-    response = requests.get(f"{BASE_URL}/saved-models")
+    response = requests.get(f"{BASE_URL}/saved-models", params={"kind": "saved", "prefix": SAVED_MODEL_NAME})
     response.raise_for_status()
-    saved_models = response.json()
+    saved_models = [model["name"] for model in response.json()["models"]]
     
     print(f"   - Found saved models: {saved_models}")
     
@@ -1,5 +1,5 @@
 import requests
-import time
+import json
 
 BASE_URL = "http://localhost:8000"
 
@@ -60,18 +60,22 @@ def test_subtitles_finetuning():
     print(f"curl http://localhost:8000/status/{job_id}")
     print("Or check the logs with:")
     print(f"curl http://localhost:8000/logs/{job_id}")
+    print("Or follow progress and logs live with:")
+    print(f"curl -N http://localhost:8000/events/{job_id}")
     
-    # 3. Monitor training (optional)
+    # 3. Monitor training (optional); the server pushes each change over Server-Sent Events
     print("\n3. Monitoring training progress (Ctrl+C to stop monitoring)...")
     try:
-        while True:
-            response = requests.get(f"{BASE_URL}/status/{job_id}")
-            if response.status_code == 200:
-                status = response.json()
-                print(f"Status: {status['status']}, Progress: {status.get('progress', 0):.1f}%")
-                if status['status'] in ["completed", "failed"]:
-                    break
-            time.sleep(10)  # Check every 10 seconds
+        with requests.get(f"{BASE_URL}/events/{job_id}", stream=True) as response:
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event in ("state", "end"):
+                    status = json.loads(line[len("data: "):])
+                    print(f"Status: {status['status']}, Progress: {status.get('progress') or 0:.1f}%")
+                    if event == "end":
+                        break
     except KeyboardInterrupt:
         print("\nMonitoring stopped. Training continues in the background.")
     
@@ -0,0 +1,6 @@
+# conftest.py
+# The API's modules live at the top of the repository, next to main.py
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,65 @@
+# test_chunking.py
+"""The streaming chunker must give exactly the chunks of splitting the whole text with re.split."""
+
+import random
+import re
+from typing import List
+
+import pytest
+
+from chunking import iter_document_chunks
+
+
+def split_whole_text(text: str, chunk_size: int) -> List[str]:
+    """The chunker as it was before streaming: one re.split over the whole document."""
+    chunks = []
+    current_chunk: List[str] = []
+    current_length = 0
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        sentence_length = len(sentence.split())
+        if current_length + sentence_length > chunk_size and current_chunk:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [sentence]
+            current_length = sentence_length
+        else:
+            current_chunk.append(sentence)
+            current_length += sentence_length
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    return chunks
+
+
+def check(tmp_path, text: str, chunk_size: int, buffer_sizes=(1, 2, 3, 5, 8, 1 << 20)):
+    path = tmp_path / "document.txt"
+    path.write_text(text, encoding="utf-8")
+    expected = split_whole_text(path.read_text(encoding="utf-8"), chunk_size)
+    for buffer_size in buffer_sizes:
+        assert list(iter_document_chunks(str(path), chunk_size, buffer_size)) == expected, (text, buffer_size)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "   \n\t ",
+    "No boundary at all",
+    "One. Two! Three? Four",
+    "Ends with a boundary.   ",
+    "Long gap.      \n\n\t   Next sentence.",
+    "Punctuation run?!.  Then more... and more.",
+    ".Leading dot. x.y.z is one sentence",
+    "a. b. c. d. e. f. g. h. i. j.",
+    "Word.\nWord.\n\nWord.\r\nWord.",
+])
+def test_boundaries_straddling_buffers(tmp_path, text):
+    for chunk_size in (1, 2, 256):
+        check(tmp_path, text, chunk_size)
+
+
+def test_random_text_matches_re_split(tmp_path):
+    rng = random.Random(1234)
+    alphabet = "ab .!?\n\t"
+    for _ in range(300):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        check(tmp_path, text, rng.randint(1, 6), buffer_sizes=(1, 2, 3, rng.randint(4, 16)))
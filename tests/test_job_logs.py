@@ -0,0 +1,70 @@
+# test_job_logs.py
+"""JobLog: the in-memory ring, reads that fall back to the file, and `since`/`limit` cursors."""
+
+import pytest
+
+import job_logs
+from job_logs import JobLog
+
+
+@pytest.fixture(autouse=True)
+def small_index_stride(monkeypatch):
+    # Several index entries even for a short log
+    monkeypatch.setattr(job_logs, "INDEX_STRIDE", 4)
+
+
+def write_lines(log: JobLog, count: int):
+    for number in range(count):
+        log.append(f"line {number}")
+
+
+def expected(start: int, stop: int):
+    return [f"line {number}" for number in range(start, stop)]
+
+
+def test_reads_inside_and_outside_the_ring(tmp_path):
+    log = JobLog(tmp_path / "job.log", ring_size=5)
+    write_lines(log, 23)
+    assert len(log) == 23
+    assert log.read() == expected(0, 23)
+    assert log.read(18) == expected(18, 23)  # all in the ring
+    assert log.read(3, 6) == expected(3, 9)  # fallen out of the ring, mid-stride
+    assert log.read(16, 5) == expected(16, 21)  # straddles the start of the ring
+    assert log.tail(2) == expected(21, 23)
+    log.close()
+
+
+def test_cursors(tmp_path):
+    log = JobLog(tmp_path / "job.log", ring_size=5)
+    write_lines(log, 10)
+    assert log.read(-7, 3) == expected(0, 3)  # a negative cursor starts at the beginning
+    assert log.read(10) == []
+    assert log.read(42) == []
+    assert log.read(4, 0) == []
+    assert log.read(8, 100) == expected(8, 10)
+    log.close()
+
+
+def test_reload_rebuilds_index_and_ring(tmp_path):
+    log = JobLog(tmp_path / "job.log", ring_size=5)
+    write_lines(log, 13)
+    log.close()
+
+    reloaded = JobLog(tmp_path / "job.log", ring_size=5)
+    assert len(reloaded) == 13
+    assert reloaded.read(1, 6) == expected(1, 7)
+    assert reloaded.read(10) == expected(10, 13)
+    reloaded.append("line 13")
+    assert reloaded.read(12) == expected(12, 14)
+    assert reloaded.read(0) == expected(0, 14)
+    reloaded.close()
+
+
+def test_lines_are_numbered_for_listeners(tmp_path):
+    seen = []
+    log = JobLog(tmp_path / "job.log", listener=lambda number, text: seen.append((number, text)))
+    log.append("first")
+    log.append("two\nparts")
+    assert seen == [(0, "first"), (1, "two parts")]
+    assert log.read(1) == ["two parts"]
+    log.close()
@@ -0,0 +1,61 @@
+# test_model_archive.py
+"""Range parsing for cached archive downloads, and building each archive only once."""
+
+import asyncio
+import io
+import zipfile
+
+import pytest
+
+from model_archive import ModelArchives, directory_fingerprint, parse_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-10", (10, 10)),
+    ("bytes=90-500", (90, 99)),  # an end past the file is clamped
+    ("bytes=40-", (40, 99)),  # open-ended
+    ("bytes=-30", (70, 99)),  # suffix: the last 30 bytes
+    ("bytes=-500", (0, 99)),  # a suffix longer than the file is all of it
+    (" bytes = 5-9", (5, 9)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=100-",  # starts at the end
+    "bytes=150-200",
+    "bytes=60-50",  # first after last
+    "bytes=-0",  # empty suffix
+    "bytes=0-1,5-9",  # multiple ranges are not supported
+    "items=0-9",
+    "bytes=a-b",
+])
+def test_unsatisfiable_or_malformed_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_concurrent_first_downloads_build_once(tmp_path, monkeypatch):
+    model = tmp_path / "model"
+    model.mkdir()
+    (model / "adapter_model.safetensors").write_bytes(bytes(range(256)) * 4096)
+    (model / "adapter_config.json").write_text('{"r": 16}')
+    archives = ModelArchives(tmp_path / "archives")
+    builds = []
+    build = archives._build
+    monkeypatch.setattr(archives, "_build", lambda *args: builds.append(args[0]) or build(*args))
+
+    async def download():
+        return b"".join([chunk async for chunk in archives.stream("job", model, fingerprint)])
+
+    async def scenario():
+        return await asyncio.gather(download(), download(), archives.build("job", model, fingerprint))
+
+    fingerprint = directory_fingerprint(model)
+    first, second, path = asyncio.run(scenario())
+    assert builds == ["job"]
+    assert first == second == path.read_bytes()
+    with zipfile.ZipFile(io.BytesIO(first)) as zf:
+        assert sorted(zf.namelist()) == ["adapter_config.json", "adapter_model.safetensors"]
@@ -0,0 +1,196 @@
+# test_scheduler.py
+"""JobScheduler driven by a fake runner: each job runs until the test releases it."""
+
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+
+from scheduler import JobScheduler, QueueFullError
+
+
+class FakeRunner:
+    """Records the order jobs start in; a job finishes when `release(job_id)` is called."""
+
+    def __init__(self):
+        self.started: List[str] = []
+        self._release: Dict[str, asyncio.Future] = {}
+
+    async def __call__(self, job_id: str, job_data: Dict) -> Optional[bool]:
+        self.started.append(job_id)
+        self._release[job_id] = asyncio.get_running_loop().create_future()
+        return await self._release[job_id]
+
+    def release(self, job_id: str, requeue: bool = False):
+        self._release[job_id].set_result(requeue)
+
+
+async def settle():
+    # Let dispatched tasks start and finished ones free their slots
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_higher_priority_dispatches_first():
+    async def scenario():
+        runner = FakeRunner()
+        scheduler = JobScheduler(runner, ["0"])
+        assert scheduler.submit("a", {}) is None
+        assert scheduler.submit("low", {}, priority=0) == 1
+        assert scheduler.submit("high", {}, priority=5) == 1
+        assert scheduler.queue_position("low") == 2
+        await settle()
+        assert runner.started == ["a"]
+
+        runner.release("a")
+        await settle()
+        assert runner.started == ["a", "high"]
+        runner.release("high")
+        await settle()
+        assert runner.started == ["a", "high", "low"]
+        runner.release("low")
+        await settle()
+        assert scheduler.snapshot()["devices"]["0"]["running"] == []
+
+    run(scenario())
+
+
+def test_slots_spread_over_devices():
+    async def scenario():
+        runner = FakeRunner()
+        scheduler = JobScheduler(runner, ["0", "1"], slots_per_device=1)
+        jobs = {job_id: {} for job_id in ("a", "b", "c")}
+        for job_id, job_data in jobs.items():
+            scheduler.submit(job_id, job_data)
+        await settle()
+        assert runner.started == ["a", "b"]
+        assert {jobs["a"]["device"], jobs["b"]["device"]} == {"0", "1"}
+        assert scheduler.snapshot()["pending"] == ["c"]
+        for job_id in ("a", "b"):
+            runner.release(job_id)
+        await settle()
+        runner.release("c")
+        await settle()
+
+    run(scenario())
+
+
+def test_full_queue_rejects_and_remove_frees_room():
+    async def scenario():
+        runner = FakeRunner()
+        scheduler = JobScheduler(runner, ["0"], max_queue=2)
+        scheduler.submit("running", {})
+        scheduler.submit("q1", {})
+        scheduler.submit("q2", {})
+        with pytest.raises(QueueFullError):
+            scheduler.submit("q3", {})
+        assert scheduler.remove("q1")
+        assert not scheduler.remove("q1")
+        assert scheduler.submit("q3", {}) == 2
+        await settle()
+        runner.release("running")
+        await settle()
+        assert runner.started == ["running", "q2"]
+        runner.release("q2")
+        await settle()
+        runner.release("q3")
+        await settle()
+
+    run(scenario())
+
+
+def test_preempted_job_is_requeued_behind_higher_priority():
+    async def scenario():
+        runner = FakeRunner()
+        preempted: List[str] = []
+
+        def preempt(job_id: str) -> bool:
+            # Stands in for signalling the trainer, which checkpoints and asks to be queued again
+            preempted.append(job_id)
+            asyncio.get_running_loop().call_soon(runner.release, job_id, True)
+            return True
+
+        scheduler = JobScheduler(runner, ["0"], preempt=preempt)
+        scheduler.submit("low", {}, priority=0)
+        await settle()
+        scheduler.submit("same", {}, priority=0)
+        assert preempted == []  # equal priority never preempts
+
+        scheduler.submit("high", {}, priority=5)
+        assert preempted == ["low"]
+        assert scheduler.snapshot()["preempting"] == ["low"]
+        await settle()
+        assert runner.started == ["low", "high"]
+        assert scheduler.snapshot()["pending"] == ["same", "low"]
+        assert scheduler.snapshot()["preempting"] == []
+
+        runner.release("high")
+        await settle()
+        runner.release("same")
+        await settle()
+        assert runner.started == ["low", "high", "same", "low"]
+        runner.release("low")
+        await settle()
+
+    run(scenario())
+
+
+def test_without_preempt_callback_jobs_wait():
+    async def scenario():
+        runner = FakeRunner()
+        scheduler = JobScheduler(runner, ["0"])
+        scheduler.submit("low", {}, priority=0)
+        await settle()
+        scheduler.submit("high", {}, priority=5)
+        await settle()
+        assert runner.started == ["low"]
+        runner.release("low")
+        await settle()
+        runner.release("high")
+        await settle()
+
+    run(scenario())
+
+
+def test_cancel_frees_the_slot():
+    async def scenario():
+        runner = FakeRunner()
+        scheduler = JobScheduler(runner, ["0"])
+        scheduler.submit("stuck", {})
+        scheduler.submit("next", {})
+        await settle()
+        assert scheduler.running_device("stuck") == "0"
+        assert scheduler.running_device("next") is None
+        assert not await scheduler.wait("stuck", timeout=0.01)
+
+        assert scheduler.cancel("stuck")
+        assert await scheduler.wait("stuck", timeout=1)
+        await settle()
+        assert runner.started == ["stuck", "next"]
+        assert not scheduler.cancel("stuck")
+        runner.release("next")
+        assert await scheduler.wait("next", timeout=1)
+
+    run(scenario())
+
+
+def test_runner_errors_free_the_slot():
+    async def scenario():
+        started: List[str] = []
+
+        async def runner(job_id: str, job_data: Dict):
+            started.append(job_id)
+            raise RuntimeError("trainer crashed")
+
+        scheduler = JobScheduler(runner, ["0"])
+        scheduler.submit("a", {})
+        scheduler.submit("b", {})
+        await settle()
+        assert started == ["a", "b"]
+        assert scheduler.snapshot()["devices"]["0"]["running"] == []
+
+    run(scenario())
@@ -0,0 +1,378 @@
+# trainer.py
+"""Unsloth LoRA trainer driven by a JSON job spec.
+
+Run as a module so the bytecode is cached after the first launch:
+
+    python -u -m trainer spec.json        # spec from a file
+    python -u -m trainer '{"job_id": ...}' # inline spec
+    python -u -m trainer -                # spec on stdin
+
+A job spec looks like:
+
+    {
+        "job_id": "...",
+        "model_name": "unsloth/Llama-3.2-1B-Instruct",
+        "dataset_path": "uploads/subtitles.txt",
+        "output_dir": "trained_models/<job_id>",
+        "parameters": {"max_seq_length": 1024, "learning_rate": 2e-4, ...}
+    }
+
+Optional top-level keys: "dataset_hash" (content hash of the dataset file, to
+skip re-hashing it), "dataset_cache" ({"dir": ..., "max_bytes": ...}) to
+reuse preprocessed datasets across jobs, and "text_cache" (same shape) to
+reuse the text extracted from PDF and Markdown files.
+
+Progress, loss and throughput are reported as JSON events (see
+training_metrics.py) on the pipe named by TRAINER_METRICS_FD, if set.
+
+Training resumes from the newest `checkpoint-*` in the output directory, so a
+job that was interrupted (crash, API restart, preemption) picks up where its
+last checkpoint left off. SIGTERM or PREEMPT_SIGNAL makes the trainer write a
+checkpoint at the end of the current step and exit with PREEMPTED_EXIT_CODE.
+
+Parameters that are left out fall back to DEFAULT_PARAMETERS. Heavy imports
+(torch, unsloth, trl) happen inside the functions that need them, so the
+module itself is cheap to import from the API or a resident worker.
+"""
+
+import json
+import re
+import signal
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from chunking import build_chunk_dataset
+from dataset_cache import DatasetCache, hash_file
+from document_parsing import TextCache
+from packing import pack_dataset
+from training_metrics import MetricsSink, make_metrics_callback, metrics_writer_from_env
+
+DEFAULT_PARAMETERS: Dict[str, Any] = {
+    "max_seq_length": 1024,
+    "num_train_epochs": 1,
+    "per_device_train_batch_size": 2,
+    "gradient_accumulation_steps": 2,
+    "learning_rate": 2e-4,
+    "warmup_steps": 5,
+    "save_steps": 50,
+    "logging_steps": 1,
+    "lora_r": 8,
+    "lora_alpha": 16,
+    "chunk_size": 256,
+    # "words": chunks of up to chunk_size words; "tokens": chunks filled up to
+    # max_seq_length tokens measured with the model's tokenizer
+    "chunk_mode": "words",
+    # Concatenate tokenized chunks into full max_seq_length blocks instead of padding each one
+    "packing": False,
+    "disable_tqdm": False,
+}
+
+CHUNK_MODES = ("words", "tokens")
+
+LORA_TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
+
+# Exit code of a trainer that stopped at a checkpoint on request (EX_TEMPFAIL: run it again to resume)
+PREEMPTED_EXIT_CODE = 75
+# Asks a trainer (or a resident worker's current job) to checkpoint and stop
+PREEMPT_SIGNAL = signal.SIGUSR1
+
+_stop_requested = threading.Event()
+
+
+class TrainingPreempted(Exception):
+    """Raised by fit() when training stopped at a checkpoint because a stop was requested."""
+
+
+def request_stop(*_):
+    """Stop the running fit() after the current step, with a checkpoint; usable as a signal handler."""
+    _stop_requested.set()
+
+
+def clear_stop_request():
+    _stop_requested.clear()
+
+
+def install_stop_handlers(signals=(signal.SIGTERM, PREEMPT_SIGNAL)):
+    for signum in signals:
+        signal.signal(signum, request_stop)
+
+
+def latest_checkpoint(output_dir: str) -> Optional[str]:
+    """The highest-numbered complete `checkpoint-N` directory in `output_dir`, or None."""
+    checkpoints = []
+    for path in Path(output_dir).glob("checkpoint-*"):
+        match = re.fullmatch(r"checkpoint-(\d+)", path.name)
+        # The trainer state is written last, so a checkpoint cut short by a crash is skipped
+        if match and (path / "trainer_state.json").is_file():
+            checkpoints.append((int(match.group(1)), path))
+    return str(max(checkpoints)[1]) if checkpoints else None
+
+
+def make_stop_callback():
+    """A TrainerCallback that saves a checkpoint and ends training once a stop is requested."""
+    from transformers import TrainerCallback
+
+    class StopCallback(TrainerCallback):
+        def on_step_end(self, args, state, control, **kwargs):
+            if _stop_requested.is_set():
+                control.should_save = True
+                control.should_training_stop = True
+            return control
+
+    return StopCallback()
+
+
+def load_spec(arg: Optional[str]) -> Dict[str, Any]:
+    """Read a job spec from a file path, an inline JSON string, or stdin ("-" or no argument)."""
+    if arg is None or arg == "-":
+        spec = json.load(sys.stdin)
+    elif arg.lstrip().startswith("{"):
+        spec = json.loads(arg)
+    else:
+        with open(arg, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+    return normalize_spec(spec)
+
+
+def normalize_spec(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Check required keys and fill in default parameters."""
+    for key in ("model_name", "dataset_path", "output_dir"):
+        if key not in spec:
+            raise ValueError(f"Job spec is missing '{key}'")
+    spec["parameters"] = {**DEFAULT_PARAMETERS, **spec.get("parameters", {})}
+    if spec["parameters"]["chunk_mode"] not in CHUNK_MODES:
+        raise ValueError(f"Unknown chunk_mode '{spec['parameters']['chunk_mode']}'")
+    return spec
+
+
+def prepare_document_data(file_path: str, chunk_size: int = 256, tokenizer=None,
+                          text_cache: Optional[TextCache] = None, content_hash: Optional[str] = None,
+                          cache_dir: Optional[str] = None):
+    """Build a one-column ("text") dataset of sentence chunks, streaming the document from disk.
+
+    With a tokenizer, `chunk_size` is measured in tokens rather than words.
+    """
+    print(f"Reading and preparing data from: {file_path}")
+    dataset = build_chunk_dataset(
+        file_path, chunk_size, tokenizer=tokenizer, text_cache=text_cache, content_hash=content_hash,
+        cache_dir=cache_dir,
+    )
+    print(f"Created {len(dataset)} chunks from the document.")
+    return dataset
+
+
+def _preprocessing_settings(params: Dict[str, Any], tokenizer) -> Dict[str, Any]:
+    """The parameters that determine the preprocessed dataset, used as part of its cache key."""
+    settings = {"chunk_mode": params["chunk_mode"], "packing": params["packing"]}
+    if params["chunk_mode"] == "words":
+        settings["chunk_size"] = params["chunk_size"]
+    if params["chunk_mode"] == "tokens" or params["packing"]:
+        settings["max_seq_length"] = params["max_seq_length"]
+        settings["tokenizer"] = getattr(tokenizer, "name_or_path", type(tokenizer).__name__)
+    return settings
+
+
+def build_training_dataset(spec: Dict[str, Any], tokenizer, text_cache: Optional[TextCache] = None,
+                           content_hash: Optional[str] = None, cache_dir: Optional[str] = None):
+    """Chunk (and optionally pack) the spec's document. Returns the dataset and packing stats (or None).
+
+    Its Arrow files are written under `cache_dir` (the default datasets cache if None).
+    """
+    params = spec["parameters"]
+    if params["chunk_mode"] == "tokens":
+        dataset = prepare_document_data(
+            spec["dataset_path"], params["max_seq_length"], tokenizer, text_cache, content_hash, cache_dir
+        )
+    else:
+        dataset = prepare_document_data(
+            spec["dataset_path"], params["chunk_size"], None, text_cache, content_hash, cache_dir
+        )
+    if params["packing"] and len(dataset) > 0:
+        return pack_dataset(dataset, tokenizer, params["max_seq_length"])
+    return dataset, None
+
+
+def load_training_dataset(spec: Dict[str, Any], tokenizer):
+    """Like build_training_dataset, but served from the dataset cache when the spec configures one."""
+    # Parsed PDF/Markdown text has a cache (and budget) of its own, so other chunker settings skip extraction
+    text_config = spec.get("text_cache")
+    text_cache = TextCache(Path(text_config["dir"]), int(text_config["max_bytes"])) if text_config else None
+    cache_config = spec.get("dataset_cache")
+    if not cache_config:
+        return build_training_dataset(spec, tokenizer, text_cache, spec.get("dataset_hash"))
+
+    cache = DatasetCache(Path(cache_config["dir"]), int(cache_config["max_bytes"]))
+    content_hash = spec.get("dataset_hash") or hash_file(spec["dataset_path"])
+    key = cache.key(content_hash, _preprocessing_settings(spec["parameters"], tokenizer))
+    cached = cache.get(key)
+    if cached is not None:
+        dataset, meta = cached
+        print(f"Dataset cache hit ({key[:12]}): {len(dataset)} rows")
+        return dataset, meta.get("packing")
+
+    print(f"Dataset cache miss ({key[:12]}), preprocessing document...")
+    # Built in a scratch directory of the cache, so only the stored entry outlives the miss
+    with cache.scratch_dir() as scratch:
+        dataset, stats = build_training_dataset(spec, tokenizer, text_cache, content_hash, str(scratch))
+        if len(dataset) > 0:
+            dataset = cache.put(key, dataset, {"packing": stats})
+    return dataset, stats
+
+
+def load_base_model(model_name: str, max_seq_length: int):
+    """Load a 4-bit base model and its tokenizer."""
+    from unsloth import FastLanguageModel
+
+    print("Loading model and tokenizer...")
+    return FastLanguageModel.from_pretrained(
+        model_name=model_name,
+        max_seq_length=max_seq_length,
+        dtype=None,
+        load_in_4bit=True,
+    )
+
+
+def attach_lora(model, params: Dict[str, Any]):
+    """Wrap a base model with fresh LoRA adapters."""
+    from unsloth import FastLanguageModel
+
+    print("Preparing LoRA adapters...")
+    return FastLanguageModel.get_peft_model(
+        model,
+        r=params["lora_r"],
+        target_modules=LORA_TARGET_MODULES,
+        lora_alpha=params["lora_alpha"],
+        lora_dropout=0,
+        bias="none",
+        use_gradient_checkpointing=True,
+        random_state=3407,
+    )
+
+
+def _tokens_per_sample(dataset, params: Dict[str, Any]) -> Optional[float]:
+    """Average real tokens per training sample, for the tokens/sec metric."""
+    if params["packing"]:
+        return float(params["max_seq_length"])
+    if "input_ids" not in dataset.column_names or len(dataset) == 0:
+        return None
+    sample = dataset.select(range(min(len(dataset), 1000)))["input_ids"]
+    return sum(len(ids) for ids in sample) / len(sample)
+
+
+def fit(model, tokenizer, spec: Dict[str, Any], on_metrics: Optional[MetricsSink] = None):
+    """Train an adapter-wrapped model on the spec's dataset and save it to the output directory.
+
+    `on_metrics` receives progress and throughput events while training.
+    Resumes from the latest checkpoint in the output directory, if any, and
+    raises TrainingPreempted if a stop was requested (see request_stop()).
+    """
+    import torch
+    from trl import SFTTrainer
+    from transformers import TrainingArguments
+
+    params = spec["parameters"]
+    output_dir = spec["output_dir"]
+
+    dataset, stats = load_training_dataset(spec, tokenizer)
+    if len(dataset) == 0:
+        raise ValueError("No data was loaded from the dataset file.")
+
+    training_args = TrainingArguments(
+        output_dir=output_dir,
+        num_train_epochs=params["num_train_epochs"],
+        per_device_train_batch_size=params["per_device_train_batch_size"],
+        gradient_accumulation_steps=params["gradient_accumulation_steps"],
+        warmup_steps=params["warmup_steps"],
+        learning_rate=params["learning_rate"],
+        fp16=not torch.cuda.is_bf16_supported(),
+        bf16=torch.cuda.is_bf16_supported(),
+        logging_steps=params["logging_steps"],
+        optim="adamw_8bit",
+        save_strategy="steps",
+        save_steps=params["save_steps"],
+        save_total_limit=1,
+        report_to="none",
+        seed=3407,
+        disable_tqdm=params["disable_tqdm"],
+    )
+
+    if params["packing"]:
+        from transformers import default_data_collator
+
+        print(f"Packed {stats['chunks']} chunks into {stats['blocks']} blocks of {stats['block_size']} tokens")
+        print(
+            f"Padding ratio: {stats['padding_before']:.1%} unpacked -> {stats['padding_after']:.1%} packed "
+            f"(x{(1 - stats['padding_after']) / max(1 - stats['padding_before'], 1e-9):.2f} real tokens per step)"
+        )
+        # Blocks are already tokenized and all the same length
+        dataset_options = {
+            "dataset_kwargs": {"skip_prepare_dataset": True},
+            "data_collator": default_data_collator,
+        }
+    else:
+        dataset_options = {"dataset_text_field": "text"}
+
+    trainer = SFTTrainer(
+        model=model,
+        tokenizer=tokenizer,
+        train_dataset=dataset,
+        max_seq_length=params["max_seq_length"],
+        args=training_args,
+        **dataset_options,
+    )
+
+    if on_metrics is not None:
+        trainer.add_callback(make_metrics_callback(on_metrics, _tokens_per_sample(trainer.train_dataset, params)))
+
+    trainer.add_callback(make_stop_callback())
+
+    checkpoint = latest_checkpoint(output_dir)
+    if checkpoint:
+        print(f"Resuming training from {checkpoint}")
+    else:
+        print("Starting training...")
+    trainer.train(resume_from_checkpoint=checkpoint)
+    if _stop_requested.is_set() and trainer.state.global_step < trainer.state.max_steps:
+        _stop_requested.clear()
+        raise TrainingPreempted(f"Stopped at step {trainer.state.global_step}; checkpoint saved in {output_dir}")
+
+    print("Saving final model...")
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    print("Training completed successfully!")
+
+
+def train(spec: Dict[str, Any], on_metrics: Optional[MetricsSink] = None):
+    """Load the base model, attach LoRA adapters and train, all in this process."""
+    params = spec["parameters"]
+    model, tokenizer = load_base_model(spec["model_name"], params["max_seq_length"])
+    model = attach_lora(model, params)
+    fit(model, tokenizer, spec, on_metrics)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    try:
+        spec = load_spec(argv[0] if argv else None)
+    except (OSError, ValueError) as e:
+        print(f"Invalid job spec: {e}")
+        return 2
+
+    install_stop_handlers()
+    try:
+        train(spec, metrics_writer_from_env())
+    except TrainingPreempted as e:
+        print(f"Training preempted: {e}")
+        return PREEMPTED_EXIT_CODE
+    except Exception as e:
+        print(f"An error occurred during training: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# training_metrics.py
+"""Structured training metrics, sent from the trainer to the API.
+
+The trainer emits one JSON object per event instead of the API scraping its
+stdout for progress. A standalone trainer process writes them as
+newline-delimited JSON to the file descriptor named in TRAINER_METRICS_FD (a
+pipe the API passes in); a resident worker sends them over its connection.
+
+Every event has an "event" key:
+
+    {"event": "train_begin", "total_steps": 120, "num_train_epochs": 1}
+    {"event": "step", "step": 7, "total_steps": 120, "epoch": 0.06, "step_seconds": 1.29,
+     "samples_per_sec": 3.1, "tokens_per_sec": 2890.4, "gpu_memory_mb": 5120.0,
+     "overhead_seconds": 0.0021, "overhead_ratio": 0.0002}
+    {"event": "log", "step": 7, "total_steps": 120, "loss": 1.92, "learning_rate": 0.00019}
+    {"event": "train_end", "step": 120, "total_steps": 120}
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+METRICS_FD_ENV = "TRAINER_METRICS_FD"
+
+MetricsSink = Callable[[Dict[str, Any]], None]
+
+
+def metrics_writer_from_env() -> Optional[MetricsSink]:
+    """A sink writing NDJSON to the pipe in TRAINER_METRICS_FD, or None if there is none."""
+    fd = os.environ.get(METRICS_FD_ENV)
+    if not fd:
+        return None
+    os.set_inheritable(int(fd), False)
+    stream = os.fdopen(int(fd), "w", buffering=1)
+
+    def emit(metrics: Dict[str, Any]):
+        if stream.closed:
+            return
+        try:
+            stream.write(json.dumps(metrics) + "\n")
+        except BrokenPipeError:
+            # Nobody is listening any more; keep training without metrics
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    return emit
+
+
+def make_metrics_callback(emit: MetricsSink, tokens_per_sample: Optional[float] = None):
+    """A transformers TrainerCallback that reports progress and throughput to `emit`."""
+    import torch
+    from transformers import TrainerCallback
+
+    class MetricsCallback(TrainerCallback):
+        def __init__(self):
+            self._train_start = None
+            self._last_step_end = None
+            # Time spent in this callback, reported so its cost on training can be checked
+            self._overhead = 0.0
+
+        def on_train_begin(self, args, state, control, **kwargs):
+            self._train_start = self._last_step_end = time.perf_counter()
+            emit({"event": "train_begin", "total_steps": state.max_steps, "num_train_epochs": args.num_train_epochs})
+
+        def on_step_end(self, args, state, control, **kwargs):
+            now = time.perf_counter()
+            elapsed = max(now - self._last_step_end, 1e-9)
+            self._last_step_end = now
+            samples = args.per_device_train_batch_size * args.gradient_accumulation_steps * args.world_size
+            metrics = {
+                "event": "step", "step": state.global_step, "total_steps": state.max_steps,
+                "epoch": round(state.epoch or 0.0, 4), "step_seconds": round(elapsed, 4),
+                "samples_per_sec": round(samples / elapsed, 3),
+            }
+            if tokens_per_sample:
+                metrics["tokens_per_sec"] = round(samples * tokens_per_sample / elapsed, 1)
+            if torch.cuda.is_available():
+                metrics["gpu_memory_mb"] = round(torch.cuda.max_memory_reserved() / 2**20, 1)
+            metrics["overhead_seconds"] = round(self._overhead, 6)
+            metrics["overhead_ratio"] = round(self._overhead / max(now - self._train_start, 1e-9), 6)
+            emit(metrics)
+            self._overhead += time.perf_counter() - now
+
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            started = time.perf_counter()
+            logs = logs or {}
+            metrics = {"event": "log", "step": state.global_step, "total_steps": state.max_steps}
+            metrics.update({key: value for key, value in logs.items() if isinstance(value, (int, float))})
+            emit(metrics)
+            self._overhead += time.perf_counter() - started
+
+        def on_train_end(self, args, state, control, **kwargs):
+            emit({"event": "train_end", "step": state.global_step, "total_steps": state.max_steps})
+
+    return MetricsCallback()
+
+
+async def read_metrics(fd: int) -> AsyncIterator[Dict[str, Any]]:
+    """Yield the metrics a trainer writes to the read end `fd` of its metrics pipe, until it closes."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", buffering=0)
+    )
+    try:
+        async for line in reader:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+    finally:
+        transport.close()
@@ -36,37 +36,59 @@ Original file is located at
 # nest_asyncio.apply()
 
 # !pip install fastapi uvicorn pyngrok nest_asyncio python-multipart pypdf markdown-it-py
+# !git clone https://github.com/PriyankaAnantha/caasassist-platform /content/caasassist-platform
 
 # Cell 2: The Final, Corrected FastAPI Application (v2.2)
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-import os, sys, re, json, uuid, asyncio, subprocess, shutil, zipfile, logging
+import os, sys, re, json, uuid, asyncio, subprocess, shutil, logging, signal
 from datetime import datetime
 from pathlib import Path
 
-# Document parsing libraries
-import pypdf
-from markdown_it import MarkdownIt
-
 # --- Setup ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 app = FastAPI(title="Unsloth Fine-tuning API Pro", version="2.2.0")
 
 training_jobs: Dict[str, Dict[str, Any]] = {}
-loaded_models: Dict[str, Any] = {}
+# Trainer process of each running job (in its own process group); POST /job/{id}/cancel stops it
+training_procs: Dict[str, asyncio.subprocess.Process] = {}
+# Seconds a cancelled trainer gets after SIGTERM before its process group is killed
+CANCEL_TIMEOUT = float(os.environ.get("CANCEL_TIMEOUT", "30"))
 
 UPLOAD_DIR, MODELS_DIR, ZIPPED_MODELS_DIR = Path("/content/uploads"), Path("/content/trained_models"), Path("/content/zipped_models")
 for d in [UPLOAD_DIR, MODELS_DIR, ZIPPED_MODELS_DIR]: d.mkdir(exist_ok=True)
+# Checkout of this repo; the training subprocess runs `python -m trainer` from it
+REPO_DIR = Path(os.environ.get("CAASASSIST_DIR", "/content/caasassist-platform"))
+sys.path.insert(0, str(REPO_DIR))
+from job_logs import LogStore
+from job_events import EventHub, format_sse
+from job_store import process_group
+from training_metrics import METRICS_FD_ENV, read_metrics
+from inference import InferenceServer
+from model_archive import ModelArchives, directory_fingerprint, iter_file, parse_range
+# Last 1000 lines per job in memory, the full log in /content/job_logs/<job_id>.log; GET /events pushes new ones
+event_hub = EventHub()
+log_store = LogStore(Path("/content/job_logs"), on_append=event_hub.publish_line)
+# Model zips, cached per job and model-directory fingerprint; GET /download streams the first build
+model_archives = ModelArchives(ZIPPED_MODELS_DIR)
+# One resident copy per base model, each job's LoRA adapter swapped in per request; least recently used models/adapters are evicted over budget
+# Concurrent requests for the same job are decoded together, up to INFERENCE_MAX_BATCH_SIZE at a time;
+# requests with a session_id reuse the previous turn's KV cache (INFERENCE_PREFIX_CACHE_GB across sessions);
+# requests with cache=true may be answered from INFERENCE_RESPONSE_CACHE_MB of earlier identical results
+inference_server = InferenceServer(int(float(os.environ.get("INFERENCE_MEMORY_BUDGET_GB", "12")) * 2**30),
+    max_batch_size=int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", "8")),
+    prefix_cache_budget=int(float(os.environ.get("INFERENCE_PREFIX_CACHE_GB", "1")) * 2**30),
+    response_cache_bytes=int(float(os.environ.get("INFERENCE_RESPONSE_CACHE_MB", "64")) * 2**20))
 
 # --- Pydantic Models ---
 class TrainingStatus(BaseModel):
-    job_id: str; status: str; progress: Optional[float] = None; model_path: Optional[str] = None; logs: Optional[List[str]] = None
+    job_id: str; status: str; progress: Optional[float] = None; model_path: Optional[str] = None; logs: Optional[List[str]] = None; metrics: Optional[Dict[str, Any]] = None
 
 class ChatRequest(BaseModel):
-    job_id: str; prompt: str; max_new_tokens: int = 150
+    job_id: str; prompt: str; max_new_tokens: int = 150; session_id: Optional[str] = None; cache: bool = False
 
 AVAILABLE_MODELS = [
     "unsloth/Llama-3.2-1B-Instruct", "unsloth/tinyllama-bnb-4bit",
@@ -74,81 +96,60 @@ AVAILABLE_MODELS = [
 ]
 
 # --- Core Logic ---
-def create_training_script(job_data: Dict[str, Any]) -> str:
-    """Generates the Python script for the background training process."""
-    model_name = job_data["model_name"]
-    dataset_path = UPLOAD_DIR / job_data["dataset_file"]
-    output_model_dir = f"/content/trained_models/{job_data['job_id']}"
-
-    # The f-string now correctly includes all necessary imports for the training script.
-    return f"""
-import os, sys, torch, json, re
-from unsloth import FastLanguageModel
-from datasets import Dataset
-from transformers import TrainingArguments
-import pypdf
-from markdown_it import MarkdownIt
-
-# --- FIX IS HERE: SFTTrainer is now correctly imported ---
-from trl import SFTTrainer
-
-def parse_document(fp_str):
-    fp=__import__('pathlib').Path(fp_str);ext=fp.suffix.lower();c=""
-    if ext==".pdf": r=pypdf.PdfReader(fp); [c:=c+p.extract_text()+"\\n" for p in r.pages]
-    elif ext==".md": md=MarkdownIt();c=re.sub('<[^<]+?>', '', md.render(open(fp, 'r', encoding='utf-8').read()))
-    else: c=open(fp, 'r', encoding='utf-8').read()
-    return c
-
-def prep_ds(fp,cs=384):
-    dt=parse_document(fp);s=re.split(r'(?<=[.!?])\\s+',dt);ch,cc,cl=[],[],0
-    for i in s:
-        i=i.strip()
-        if not i: continue
-        sl=len(i.split())
-        if cl+sl>cs and cc: ch.append(" ".join(cc));cc=[i];cl=sl
-        else: cc.append(i);cl+=sl
-    if cc: ch.append(" ".join(cc))
-    return Dataset.from_dict({{"text": ch}})
-
-def main():
-    try:
-        m,t=FastLanguageModel.from_pretrained(model_name="{model_name}",max_seq_length=2048,load_in_4bit=True)
-        m=FastLanguageModel.get_peft_model(m,r=16,lora_alpha=32,target_modules=["q_proj","k_proj","v_proj","o_proj","gate_proj","up_proj","down_proj"])
-        d=prep_ds(r"{str(dataset_path)}")
-        tr=SFTTrainer(model=m,tokenizer=t,train_dataset=d,dataset_text_field="text",max_seq_length=2048,
-            args=TrainingArguments(output_dir="{output_model_dir}",per_device_train_batch_size=2,gradient_accumulation_steps=4,
-            warmup_steps=10,num_train_epochs=1,learning_rate=2e-4,fp16=not torch.cuda.is_bf16_supported(),
-            bf16=torch.cuda.is_bf16_supported(),logging_steps=1,optim="adamw_8bit",seed=3407,report_to="none",disable_tqdm=True))
-        print(f"UNSLOTH_TOTAL_STEPS={{tr.state.max_steps}}");sys.stdout.flush();tr.train();m.save_pretrained("{output_model_dir}")
-    except Exception as e:import traceback;traceback.print_exc();sys.exit(1)
-
-if __name__=="__main__":main()
-"""
+def job_state(job_id: str) -> Optional[Dict[str, Any]]:
+    j=training_jobs.get(job_id)
+    return None if j is None else {"job_id":job_id,"status":j["status"],"progress":j.get("progress"),"model_path":j.get("model_path"),"metrics":j.get("metrics")}
+
+def build_job_spec(job_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Job spec for the shared `trainer` module (see trainer.py in the repo root)."""
+    return {"job_id":job_data["job_id"],"model_name":job_data["model_name"],
+        "dataset_path":str(UPLOAD_DIR/job_data["dataset_file"]),"output_dir":str(MODELS_DIR/job_data["job_id"]),
+        "parameters":{"max_seq_length":2048,"lora_r":16,"lora_alpha":32,"per_device_train_batch_size":2,
+            "gradient_accumulation_steps":4,"warmup_steps":10,"num_train_epochs":1,"learning_rate":2e-4,
+            "logging_steps":1,"save_steps":500,"chunk_size":384,"disable_tqdm":True},
+        "dataset_cache":{"dir":"/content/dataset_cache","max_bytes":5*1024**3},
+        "text_cache":{"dir":"/content/text_cache","max_bytes":1024**3}}
 
 async def run_training(job_id: str, job_data: Dict[str, Any]):
-    job_data["status"]="running"
-    script_path=Path(f"/content/training_script_{job_id}.py")
-    with open(script_path,"w") as f: f.write(create_training_script(job_data))
-    proc=await asyncio.create_subprocess_exec(sys.executable,"-u",str(script_path),stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.STDOUT)
-    ts=0
-    # Ensure 'logs' list exists before appending
-    job_data.setdefault("logs", [])
-    async for l in proc.stdout:
-        ls=l.decode().strip()
-        if not ls: continue
-        job_data["logs"].append(ls)
-        if ls.startswith("UNSLOTH_TOTAL_STEPS="):
-            try: ts=int(ls.split('=')[1])
-            except: pass
-        if ls.startswith("{{") and ls.endswith("}}"):
-            try:
-                log=json.loads(ls)
-                if "step" in log and ts>0: job_data["progress"]=round((log["step"]/ts)*100,2)
-            except: pass
-    await proc.wait()
-    job_data["status"]="completed" if proc.returncode==0 else "failed"
-    job_data["model_path"]=f"/content/trained_models/{job_id}" if proc.returncode==0 else None
-    if script_path.exists(): script_path.unlink()
+    if job_data["status"]=="cancelled": job_data["done"].set(); return
+    job_data["status"]="running"; event_hub.publish_state(job_id,job_state(job_id))
+    env={**os.environ,"PYTHONPATH":os.pathsep.join(filter(None,[str(REPO_DIR),os.environ.get("PYTHONPATH")]))}
+    # Progress/loss/throughput arrive as JSON lines on a separate pipe (training_metrics.py); stdout is just logged
+    mr,mw=os.pipe(); env[METRICS_FD_ENV]=str(mw); proc=mt=None
+    async def consume_metrics():
+        async for m in read_metrics(mr):
+            latest=job_data.setdefault("metrics",{}); latest.update((k,v) for k,v in m.items() if k!="event")
+            if latest.get("total_steps"): job_data["progress"]=round(latest.get("step",0)/latest["total_steps"]*100,2)
+            event_hub.publish_state(job_id,job_state(job_id))
+    try:
+        try:
+            proc=await asyncio.create_subprocess_exec(sys.executable,"-u","-m","trainer",json.dumps(build_job_spec(job_data)),
+                stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.STDOUT,env=env,pass_fds=(mw,),start_new_session=True)
+        finally: os.close(mw)
+        training_procs[job_id]=proc
+        if job_data.get("cancel_requested"): os.killpg(proc.pid,signal.SIGTERM)  # cancelled while it was starting
+        mt=asyncio.create_task(consume_metrics())  # owns (and closes) the read end from here on
+        async for l in proc.stdout:
+            ls=l.decode().strip()
+            if ls: job_data["logs"].append(ls)
+        await proc.wait()
+        job_data["status"]="cancelled" if job_data.get("cancel_requested") else "completed" if proc.returncode==0 else "failed"
+    except Exception as e:
+        logger.error(f"Training job {job_id} failed: {str(e)}"); job_data["logs"].append(f"API failed to run the trainer: {str(e)}")
+        if proc is not None and proc.returncode is None:
+            try: os.killpg(proc.pid,signal.SIGKILL)
+            except ProcessLookupError: pass
+            await proc.wait()
+        job_data["status"]="cancelled" if job_data.get("cancel_requested") else "failed"
+    finally:
+        # The metrics reader ends once the trainer (and its copy of the write end) is gone
+        if mt is None: os.close(mr)
+        else: await asyncio.gather(mt,return_exceptions=True)
+        training_procs.pop(job_id,None)
+    if job_data["status"]=="cancelled": job_data["logs"].append("Training cancelled")
+    job_data["logs"].close(); job_data["done"].set()
+    job_data["model_path"]=f"/content/trained_models/{job_id}" if job_data["status"]=="completed" else None
+    event_hub.publish_state(job_id,job_state(job_id))
 
 # --- API Endpoints ---
 @app.get("/")
@@ -169,40 +170,108 @@ async def upload_dataset(file: UploadFile = File(...)):
 async def start_training(bgt: BackgroundTasks, model_name: str=Form(...), dataset_file: str=Form(...)):
     if model_name not in AVAILABLE_MODELS: raise HTTPException(400, "Model not available")
     job_id=str(uuid.uuid4())
-    training_jobs[job_id]={"job_id":job_id,"status":"pending","model_name":model_name,"dataset_file":dataset_file}
+    training_jobs[job_id]={"job_id":job_id,"status":"pending","model_name":model_name,"dataset_file":dataset_file,"logs":log_store.open(job_id),
+        "done":asyncio.Event()}  # set by run_training once the job's final status and log line are written
     bgt.add_task(run_training,job_id,training_jobs[job_id])
     return {"job_id":job_id}
 
 @app.get("/status/{job_id}", response_model=TrainingStatus)
 async def get_training_status(job_id:str):
     if job_id not in training_jobs: raise HTTPException(404,"Job not found")
-    return TrainingStatus(**training_jobs[job_id])
+    return TrainingStatus(**{**training_jobs[job_id],"logs":training_jobs[job_id]["logs"].tail(20)})
 
 @app.get("/logs/{job_id}")
-async def get_training_logs(job_id: str):
-    """Retrieves the full logs for a specific training job."""
+async def get_training_logs(job_id: str, since: Optional[int] = None, limit: int = 1000):
+    """Log lines of a training job: the last `limit`, or those from line `since` on (pass back `next`)."""
     if job_id not in training_jobs: raise HTTPException(4_04, "Job not found")
-    return {"job_id": job_id, "logs": training_jobs[job_id].get("logs", [])}
+    log=training_jobs[job_id]["logs"]; limit=max(1,min(limit,10000)); start=max(len(log)-limit,0) if since is None else max(since,0)
+    lines=log.read(start,limit)
+    return {"job_id": job_id, "logs": lines, "since": start, "next": start+len(lines), "total": len(log)}
+
+@app.get("/events/{job_id}")
+async def stream_job_events(job_id: str, request: Request, since: Optional[int] = None):
+    """Server-Sent Events: `state` on every status/progress change, `log` per new line, `end` when done."""
+    if job_id not in training_jobs: raise HTTPException(404, "Job not found")
+    return StreamingResponse(event_hub.stream(job_id,training_jobs[job_id]["logs"],lambda: job_state(job_id),since,request.is_disconnected),
+        media_type="text/event-stream",headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
 
 @app.post("/generate")
 async def generate_response(req:ChatRequest):
     if req.job_id not in training_jobs or training_jobs[req.job_id].get("status")!="completed": raise HTTPException(404,"Trained model not found.")
-    if req.job_id not in loaded_models:
-        from unsloth import FastLanguageModel
-        mp=training_jobs[req.job_id]["model_path"]
-        loaded_models[req.job_id]=FastLanguageModel.from_pretrained(model_name=mp,load_in_4bit=True)
-    m,t=loaded_models[req.job_id]
-    i=t([req.prompt],return_tensors="pt").to("cuda");o=m.generate(**i,max_new_tokens=req.max_new_tokens,use_cache=True)
-    return JSONResponse({"response":t.batch_decode(o)[0]})
+    j=training_jobs[req.job_id]
+    r=await inference_server.generate(j["model_name"],req.job_id,j["model_path"],req.prompt,req.max_new_tokens,req.session_id,req.cache)
+    return JSONResponse({"response":r.pop("text"),"cached":r.pop("cached"),"usage":r})
+
+@app.post("/generate/stream")
+async def generate_stream(req:ChatRequest):
+    """Server-Sent Events: a `token` event per decoded text delta, then `end` (or `error`). Disconnecting stops generation."""
+    if req.job_id not in training_jobs or training_jobs[req.job_id].get("status")!="completed": raise HTTPException(404,"Trained model not found.")
+    j=training_jobs[req.job_id]
+    async def events():
+        try:
+            async for item in inference_server.stream(j["model_name"],req.job_id,j["model_path"],req.prompt,req.max_new_tokens,req.session_id):
+                if isinstance(item,str): yield format_sse("token",{"text":item})
+                else: item.pop("text"); yield format_sse("end",{"job_id":req.job_id,"usage":item})
+        except Exception as e:
+            logger.error(f"Streaming generation failed for job {req.job_id}: {str(e)}")
+            yield format_sse("error",{"detail":str(e)})
+    return StreamingResponse(events(),media_type="text/event-stream",headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
+
+@app.get("/inference")
+async def inference_stats(): return inference_server.stats()
+
+async def stop_training(job_id: str) -> Dict[str, Any]:
+    """SIGTERM the job's trainer process group, SIGKILL it after CANCEL_TIMEOUT; returns what was freed."""
+    j=training_jobs[job_id]; j["cancel_requested"]=True
+    freed={"processes":[],"signal":None,"gpu_memory_mb":(j.get("metrics") or {}).get("gpu_memory_mb")}
+    proc=training_procs.get(job_id)
+    if proc is not None and proc.returncode is None:
+        freed["processes"]=process_group(proc.pid)
+        try:
+            os.killpg(proc.pid,signal.SIGTERM); freed["signal"]="SIGTERM"
+            try: await asyncio.wait_for(asyncio.shield(proc.wait()),CANCEL_TIMEOUT)
+            except asyncio.TimeoutError: os.killpg(proc.pid,signal.SIGKILL); freed["signal"]="SIGKILL"; await proc.wait()
+        except ProcessLookupError: pass
+    if j["status"]=="running": await j["done"].wait()  # run_training records the cancellation and closes the log
+    elif j["status"]!="cancelled":
+        j["status"]="cancelled"; j["logs"].append("Training cancelled"); j["logs"].close(); event_hub.publish_state(job_id,job_state(job_id))
+    return freed
+
+@app.post("/job/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    if job_id not in training_jobs: raise HTTPException(404, "Job not found")
+    if training_jobs[job_id]["status"] in ("completed","failed","cancelled"): raise HTTPException(409, f"Job is already {training_jobs[job_id]['status']}")
+    return {"job_id":job_id,"status":"cancelled","freed":await stop_training(job_id)}
+
+@app.delete("/job/{job_id}")
+async def delete_job(job_id: str):
+    if job_id not in training_jobs: raise HTTPException(404, "Job not found")
+    freed=await stop_training(job_id) if training_jobs[job_id]["status"] in ("pending","running") else None
+    await inference_server.unload(job_id)  # also drops its cached responses and chat prefixes
+    j=training_jobs.pop(job_id); log_store.delete(job_id); model_archives.remove(job_id)
+    shutil.rmtree(j.get("model_path") or MODELS_DIR/job_id,ignore_errors=True)
+    return {"message":f"Job {job_id} deleted","freed":freed}
 
 @app.get("/download/{job_id}")
-async def download_model(job_id: str, model_name: str):
+async def download_model(job_id: str, model_name: str, request: Request):
+    """Zip of the model directory: streamed while first built, then served from cache with Range/If-Range support."""
     if job_id not in training_jobs or training_jobs[job_id].get("status")!="completed": raise HTTPException(404,"Job not found or not completed.")
-    mp=Path(training_jobs[job_id]["model_path"]);zp=ZIPPED_MODELS_DIR/f"{model_name}.zip"
-    with zipfile.ZipFile(zp,'w',zipfile.ZIP_DEFLATED) as zf:
-        for r,_,fs in os.walk(mp):
-            for f in fs: zf.write(os.path.join(r,f),os.path.relpath(os.path.join(r,f),mp))
-    return FileResponse(path=zp,media_type='application/zip',filename=f"{model_name}.zip")
+    mp=Path(training_jobs[job_id]["model_path"]);fp=await asyncio.to_thread(directory_fingerprint,mp)
+    etag=f'"{fp}"';headers={"ETag":etag,"Accept-Ranges":"bytes"}
+    rng=request.headers.get("range")
+    if rng and request.headers.get("if-range") not in (None,etag): rng=None  # the archive changed; send all of it
+    zp=model_archives.path(job_id,fp)
+    if not zp.exists():
+        if not rng: return StreamingResponse(model_archives.stream(job_id,mp,fp),media_type="application/zip",
+            headers={**headers,"Content-Disposition":f'attachment; filename="{model_name}.zip"'})
+        zp=await model_archives.build(job_id,mp,fp)
+    if not rng: return FileResponse(path=zp,media_type='application/zip',filename=f"{model_name}.zip",headers=headers)
+    size=zp.stat().st_size
+    try: start,end=parse_range(rng,size)
+    except ValueError as e: raise HTTPException(416,str(e),headers={"Content-Range":f"bytes */{size}"})
+    return StreamingResponse(iter_file(zp,start,end),status_code=206,media_type="application/zip",
+        headers={**headers,"Content-Range":f"bytes {start}-{end}/{size}","Content-Length":str(end-start+1),
+                 "Content-Disposition":f'attachment; filename="{model_name}.zip"'})
 
 # --- Start Server ---
 public_url = ngrok.connect(8000)
@@ -1,11 +1,12 @@
 # test_client_interactive.py
 import requests
-import time
+import json
 import os
 import shutil
 from pathlib import Path
 import zipfile
 import sys
+import uuid
 from urllib.parse import urlparse
 
 # Add local-inference imports with a friendly error message if they're missing.
@@ -81,11 +82,30 @@ def download_and_unzip(base_url, job_id, saved_model_name):
     if final_model_path.exists(): shutil.rmtree(final_model_path)
     local_download_dir.mkdir(exist_ok=True)
     
+    local_zip_path = local_download_dir / f"{saved_model_name}.zip"
+    # An interrupted download is kept as .part (plus the archive's ETag) and resumed with a Range request
+    partial_path = local_download_dir / f"{saved_model_name}.zip.part"
+    etag_path = local_download_dir / f"{saved_model_name}.zip.etag"
     try:
-        with requests.get(download_url, stream=True, timeout=300) as r:
-            r.raise_for_status()
-            local_zip_path = local_download_dir / f"{saved_model_name}.zip"
-            with open(local_zip_path, 'wb') as f: shutil.copyfileobj(r.raw, f)
+        for attempt in range(1, 6):
+            offset = partial_path.stat().st_size if partial_path.exists() else 0
+            etag = etag_path.read_text() if etag_path.exists() else None
+            headers = {"Range": f"bytes={offset}-", "If-Range": etag} if offset and etag else {}
+            try:
+                with requests.get(download_url, stream=True, timeout=(20, 300), headers=headers) as r:
+                    if r.status_code == 416: break  # nothing left to fetch
+                    r.raise_for_status()
+                    if r.headers.get("ETag"): etag_path.write_text(r.headers["ETag"])
+                    if r.status_code == 206: print(f"   - Resuming at {offset / 2**20:.1f} MB...")
+                    with open(partial_path, 'ab' if r.status_code == 206 else 'wb') as f:
+                        for chunk in r.iter_content(chunk_size=1 << 20): f.write(chunk)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                if attempt == 5: raise
+                print(f"   - Download interrupted ({e}); retrying ({attempt}/5)...")
+        os.replace(partial_path, local_zip_path)
+        etag_path.unlink(missing_ok=True)
         print(f"   - Download complete.")
         with zipfile.ZipFile(local_zip_path, 'r') as zf: zf.extractall(final_model_path)
         print(f"   - Model extracted to: {final_model_path}")
@@ -118,6 +138,41 @@ def chat_with_local_model(model_path: Path):
         response_only = response_text.split("### Response:\n")[-1].strip()
         print(f"AI: {response_only}")
 
+def chat_with_server(base_url, job_id):
+    """Chat with the fine-tuned model on the server, printing the reply as it streams in."""
+    print(f"\n[6/6] Chatting with job {job_id} on the server (`unsloth`/`torch` not found locally). Type 'quit' to exit.")
+    # Each turn re-sends the conversation; the server reuses its cached prefix for this session
+    session_id, history = uuid.uuid4().hex, ""
+    while True:
+        prompt = input("You: ")
+        if prompt.lower().strip() == 'quit': break
+        formatted_prompt = f"{history}### Instruction:\n{prompt}\n\n### Response:\n"
+        payload = {"job_id": job_id, "prompt": formatted_prompt, "max_new_tokens": 200, "session_id": session_id}
+        reply = ""
+        print("AI: ", end="", flush=True)
+        try:
+            with requests.post(f"{base_url}generate/stream", json=payload, stream=True, timeout=(20, 120)) as response:
+                response.raise_for_status()
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        data = json.loads(line[len("data: "):])
+                        if event == "token":
+                            reply += data["text"]
+                            print(data["text"], end="", flush=True)
+                        elif event == "end":
+                            usage = data["usage"]
+                            print(f"\n   ({usage['cached_tokens']} of {usage['prompt_tokens']} prompt tokens cached, "
+                                  f"~{usage['prefill_seconds_saved']:.3f}s prefill saved)", end="")
+                        elif event == "error":
+                            print(f"\n   - ❌ ERROR: {data['detail']}", end="")
+            print()
+            history = f"{formatted_prompt}{reply}\n\n"
+        except requests.exceptions.RequestException as e:
+            print(f"\n   - ❌ ERROR: Generation request failed. {e}")
+
 def main():
     """Main function to run the end-to-end workflow with enhanced error reporting."""
     print("--- Unsloth Interactive Fine-Tuning Client (v2.1) ---")
@@ -143,21 +198,29 @@ def main():
 
         print("\n[3/6] Monitoring training progress...")
         final_status = "running"
-        while True:
-            response = requests.get(f"{base_url}status/{job_id}", timeout=20)
-            status, progress = response.json()["status"], response.json().get("progress", 0)
-            print(f"   - Status: {status} | Progress: {progress or 0:.2f}%", end="\r")
-            if status in ["completed", "failed"]:
-                final_status = status
-                print("\n" + " "*50) # Clear the line
-                break
-            time.sleep(10)
+        # The server pushes status/progress changes as Server-Sent Events; no polling needed
+        with requests.get(f"{base_url}events/{job_id}", stream=True, timeout=(20, 120)) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event in ("state", "end"):
+                    state = json.loads(line[len("data: "):])
+                    print(f"   - Status: {state['status']} | Progress: {state.get('progress') or 0:.2f}%", end="\r")
+                    if event == "end":
+                        final_status = state["status"]
+                        print("\n" + " "*50) # Clear the line
+                        break
 
         if final_status == "completed":
             print("[4/6] ✅ Training completed!")
             local_model_path = download_and_unzip(base_url, job_id, saved_model_name)
             if local_model_path:
-                chat_with_local_model(local_model_path)
+                if LOCAL_INFERENCE_ENABLED:
+                    chat_with_local_model(local_model_path)
+                else:
+                    chat_with_server(base_url, job_id)
                 print("\n✅ SUCCESS! Full workflow complete.")
             else:
                 print("\n❌ FAILURE: Model training finished, but download failed.")
@@ -0,0 +1,195 @@
+# uploads.py
+"""Resumable, chunked uploads written off the event loop.
+
+A client opens a session, PUTs the file in pieces at increasing offsets and
+then completes the session. Each piece is appended and fed to a SHA-256
+hasher in a worker thread, so large uploads never block the event loop and
+the content hash is known as soon as the last byte lands. Session metadata
+lives next to the partial file, so an interrupted upload can be resumed from
+`offset` even after the API restarts.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class UploadError(Exception):
+    """Base class for upload failures; `status_code` is the HTTP status to report."""
+
+    status_code = 400
+
+
+class UploadNotFoundError(UploadError):
+    status_code = 404
+
+
+class UploadOffsetError(UploadError):
+    """The client sent a piece at the wrong offset; it should resume from `expected`."""
+
+    status_code = 409
+
+    def __init__(self, expected: int):
+        super().__init__(f"Expected offset {expected}")
+        self.expected = expected
+
+
+class UploadTooLargeError(UploadError):
+    status_code = 413
+
+
+def safe_filename(filename: str) -> str:
+    """Strip any directory components from a client-supplied filename."""
+    name = Path(filename or "").name
+    if not name or name in (".", ".."):
+        raise UploadError("Invalid filename")
+    return name
+
+
+class UploadSession:
+    def __init__(self, upload_id: str, filename: str, total_size: Optional[int], part_path: Path,
+                 offset: int = 0, created: Optional[float] = None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.total_size = total_size
+        self.part_path = part_path
+        self.offset = offset
+        self.created = created or time.time()
+        self.hasher: Optional[Any] = hashlib.sha256() if offset == 0 else None
+        self.lock = asyncio.Lock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        # The offset is not persisted: after a restart it is the size of the partial file
+        return {
+            "upload_id": self.upload_id, "filename": self.filename, "total_size": self.total_size,
+            "offset": self.offset, "created": self.created,
+        }
+
+
+class UploadManager:
+    """Tracks upload sessions under `root` and enforces a per-file size limit."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._sessions: Dict[str, UploadSession] = {}
+        self._load_sessions()
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.json"
+
+    def _load_sessions(self):
+        # Sessions left over from a previous run can still be resumed; their
+        # hasher is rebuilt from the partial file on the next write.
+        for meta_path in self.root.glob("*.json"):
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, json.JSONDecodeError):
+                continue
+            part_path = self.root / f"{meta['upload_id']}.part"
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            self._sessions[meta["upload_id"]] = UploadSession(
+                meta["upload_id"], meta["filename"], meta.get("total_size"), part_path, offset, meta.get("created")
+            )
+
+    def _save_meta(self, session: UploadSession):
+        self._meta_path(session.upload_id).write_text(json.dumps(session.to_dict()))
+
+    def create(self, filename: str, total_size: Optional[int] = None) -> UploadSession:
+        filename = safe_filename(filename)
+        if total_size is not None and total_size > self.max_bytes:
+            raise UploadTooLargeError(f"File exceeds the {self.max_bytes} byte upload limit")
+        upload_id = uuid.uuid4().hex
+        session = UploadSession(upload_id, filename, total_size, self.root / f"{upload_id}.part")
+        session.part_path.touch()
+        self._save_meta(session)
+        self._sessions[upload_id] = session
+        return session
+
+    def get(self, upload_id: str) -> UploadSession:
+        session = self._sessions.get(upload_id)
+        if session is None:
+            raise UploadNotFoundError("Upload session not found")
+        return session
+
+    @staticmethod
+    def _rehash(path: Path):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                hasher.update(block)
+        return hasher
+
+    @staticmethod
+    def _append(path: Path, data: bytes, hasher):
+        with open(path, "ab") as f:
+            f.write(data)
+        hasher.update(data)
+
+    async def write(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> UploadSession:
+        """Append a piece that starts at `offset`. Returns the session with its new offset."""
+        session = self.get(upload_id)
+        async with session.lock:
+            if offset != session.offset:
+                raise UploadOffsetError(session.offset)
+            if session.hasher is None:
+                session.hasher = await asyncio.to_thread(self._rehash, session.part_path)
+            try:
+                async for data in chunks:
+                    if not data:
+                        continue
+                    if session.offset + len(data) > self.max_bytes or (
+                        session.total_size is not None and session.offset + len(data) > session.total_size
+                    ):
+                        raise UploadTooLargeError("Upload exceeds its declared size or the upload limit")
+                    await asyncio.to_thread(self._append, session.part_path, data, session.hasher)
+                    session.offset += len(data)
+            except UploadError:
+                raise
+            except BaseException:
+                # A disconnect can land while a piece is being written; trust the file on
+                # disk and rebuild the hash from it on the next write.
+                session.offset = session.part_path.stat().st_size
+                session.hasher = None
+                raise
+            return session
+
+    async def complete(self, upload_id: str) -> Dict[str, Any]:
+        """Finish a session. Returns the partial file's path, its size and SHA-256; the caller takes ownership."""
+        session = self.get(upload_id)
+        async with session.lock:
+            if session.total_size is not None and session.offset != session.total_size:
+                raise UploadOffsetError(session.offset)
+            if session.hasher is None:
+                session.hasher = await asyncio.to_thread(self._rehash, session.part_path)
+            del self._sessions[upload_id]
+            self._meta_path(upload_id).unlink(missing_ok=True)
+            return {
+                "filename": session.filename, "path": session.part_path,
+                "size": session.offset, "sha256": session.hasher.hexdigest(),
+            }
+
+    async def abort(self, upload_id: str):
+        session = self.get(upload_id)
+        async with session.lock:
+            del self._sessions[upload_id]
+            self._meta_path(upload_id).unlink(missing_ok=True)
+            await asyncio.to_thread(session.part_path.unlink, True)
+
+    async def receive(self, chunks: AsyncIterator[bytes], filename: str) -> Dict[str, Any]:
+        """Stream a whole file in one request (used by the plain /upload endpoint)."""
+        session = self.create(filename)
+        try:
+            await self.write(session.upload_id, 0, chunks)
+            return await self.complete(session.upload_id)
+        except Exception:
+            if session.upload_id in self._sessions:
+                await self.abort(session.upload_id)
+            raise
@@ -0,0 +1,323 @@
+# worker_pool.py
+"""Long-lived training workers that keep a base model resident between jobs.
+
+The API process talks to each worker over a `multiprocessing.connection`
+socket. A worker loads its base model once at startup and then, for every job
+spec it receives, attaches fresh LoRA adapters, trains, saves, and strips the
+adapters again so the next job starts from the clean base weights.
+
+Sending the worker trainer.PREEMPT_SIGNAL stops its current job at a
+checkpoint (reported as trainer.PREEMPTED_EXIT_CODE); the worker itself, and
+its resident model, stay up for the next job.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+READY_PREFIX = "WORKER_READY "
+
+
+class AdapterCleanupError(Exception):
+    """Raised when LoRA adapters could not be stripped from the resident model."""
+
+
+# --- Worker process side ---
+
+class _ConnectionWriter:
+    """File-like object that forwards complete output lines to the API as log messages."""
+
+    def __init__(self, conn, lock: threading.Lock):
+        self._conn = conn
+        self._lock = lock
+        self._buffer = ""
+
+    def write(self, text: str) -> int:
+        self._buffer += text
+        *lines, self._buffer = re.split(r"[\r\n]", self._buffer)
+        for line in lines:
+            if line.strip():
+                with self._lock:
+                    self._conn.send({"type": "log", "line": line.strip()})
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _train_job(model, tokenizer, spec: Dict[str, Any], on_metrics: Callable[[Dict[str, Any]], None]):
+    """Attach fresh LoRA adapters to the resident model, train, save, and return the base model."""
+    import torch
+    import trainer
+
+    spec = trainer.normalize_spec(spec)
+    peft_model = trainer.attach_lora(model, spec["parameters"])
+    try:
+        trainer.fit(peft_model, tokenizer, spec, on_metrics)
+    finally:
+        # Drop the LoRA layers so the next job gets the untouched base weights
+        try:
+            model = peft_model.unload()
+        except Exception as e:
+            raise AdapterCleanupError(str(e)) from e
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    return model
+
+
+def worker_main(model_name: str, max_seq_length: int, address: str, authkey: bytes):
+    """Load the base model once, then serve job specs until told to stop."""
+    started = time.perf_counter()
+    import trainer
+    import unsloth  # noqa: F401
+    import_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    model, tokenizer = trainer.load_base_model(model_name, max_seq_length)
+    load_seconds = time.perf_counter() - started
+    startup_seconds = import_seconds + load_seconds
+
+    trainer.install_stop_handlers((trainer.PREEMPT_SIGNAL,))
+    listener = Listener(address, authkey=authkey)
+    print(f"{READY_PREFIX}import={import_seconds:.2f}s load={load_seconds:.2f}s", flush=True)
+
+    jobs_served = 0
+    while True:
+        with listener.accept() as conn:
+            spec = conn.recv()
+            if spec.get("type") == "shutdown":
+                break
+            lock = threading.Lock()
+            writer = _ConnectionWriter(conn, lock)
+
+            def send_metrics(metrics: Dict[str, Any]):
+                with lock:
+                    conn.send({"type": "metrics", "metrics": metrics})
+
+            stdout, stderr = sys.stdout, sys.stderr
+            sys.stdout = sys.stderr = writer
+            started = time.perf_counter()
+            returncode = 0
+            healthy = True
+            # A preemption signal that arrived between jobs is not meant for this one
+            trainer.clear_stop_request()
+            try:
+                model = _train_job(model, tokenizer, spec, send_metrics)
+            except trainer.TrainingPreempted as e:
+                print(f"Training preempted: {e}")
+                returncode = trainer.PREEMPTED_EXIT_CODE
+            except AdapterCleanupError as e:
+                print(f"Could not strip LoRA adapters, worker will exit: {e}")
+                returncode = 1
+                healthy = False
+            except Exception as e:
+                print(f"An error occurred during training: {e}")
+                import traceback
+                traceback.print_exc()
+                returncode = 1
+            finally:
+                sys.stdout, sys.stderr = stdout, stderr
+            jobs_served += 1
+            with lock:
+                conn.send({
+                    "type": "done",
+                    "returncode": returncode,
+                    "job_seconds": round(time.perf_counter() - started, 2),
+                    # A cold process would have re-imported and re-loaded the model for this job
+                    "startup_seconds_saved": round(startup_seconds, 2) if jobs_served > 1 else 0.0,
+                    "jobs_served": jobs_served,
+                })
+            if not healthy:
+                # Let the pool start a clean worker for the next job
+                break
+    listener.close()
+
+
+# --- API side ---
+
+class TrainingWorker:
+    """Handle on one worker process, as seen from the API."""
+
+    def __init__(self, model_name: str, max_seq_length: int, device: str, process: asyncio.subprocess.Process,
+                 address: str, authkey: bytes):
+        self.model_name = model_name
+        self.max_seq_length = max_seq_length
+        self.device = device
+        self.process = process
+        self.address = address
+        self.authkey = authkey
+        self.busy = False
+        self.startup_info = ""
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    def matches(self, model_name: str, max_seq_length: int) -> bool:
+        return self.model_name == model_name and self.max_seq_length == max_seq_length
+
+    async def stop(self):
+        if not self.alive:
+            return
+        try:
+            conn = await asyncio.to_thread(Client, self.address, authkey=self.authkey)
+            with conn:
+                conn.send({"type": "shutdown"})
+            await asyncio.wait_for(self.process.wait(), timeout=30)
+        except Exception:
+            self.process.kill()
+            await self.process.wait()
+
+
+class WorkerPool:
+    """Keeps at most `workers_per_device` resident workers on each device and reuses them across jobs."""
+
+    def __init__(self, workers_per_device: int = 1, startup_timeout: float = 900.0):
+        self.workers_per_device = workers_per_device
+        self.startup_timeout = startup_timeout
+        self._workers: List[TrainingWorker] = []
+        # Slots reserved for workers that are being started, per device
+        self._starting: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._socket_dir = Path(tempfile.mkdtemp(prefix="unsloth-workers-"))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {"model_name": w.model_name, "max_seq_length": w.max_seq_length, "device": w.device,
+             "pid": w.process.pid, "busy": w.busy, "startup": w.startup_info}
+            for w in self._workers if w.alive
+        ]
+
+    async def _spawn(self, model_name: str, max_seq_length: int, device: str) -> TrainingWorker:
+        address = str(self._socket_dir / f"worker-{secrets.token_hex(4)}.sock")
+        authkey = secrets.token_bytes(16)
+        env = os.environ.copy()
+        env["WORKER_AUTHKEY"] = authkey.hex()
+        env["CUDA_VISIBLE_DEVICES"] = "" if device == "cpu" else device
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", str(Path(__file__).resolve()),
+            "--model", model_name, "--max-seq-length", str(max_seq_length), "--address", address,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=env,
+        )
+        worker = TrainingWorker(model_name, max_seq_length, device, process, address, authkey)
+
+        async def wait_ready():
+            async for line in process.stdout:
+                line_str = line.decode().strip()
+                if line_str.startswith(READY_PREFIX):
+                    worker.startup_info = line_str[len(READY_PREFIX):]
+                    return
+                logger.info(f"Worker {process.pid}: {line_str}")
+            raise RuntimeError(f"Worker for {model_name} exited during startup")
+
+        try:
+            await asyncio.wait_for(wait_ready(), timeout=self.startup_timeout)
+        except BaseException:
+            # Including cancellation: nothing else tracks this process, and it holds a model on the GPU
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        asyncio.create_task(self._drain(worker))
+        return worker
+
+    async def _drain(self, worker: TrainingWorker):
+        # Anything printed outside of a job (warnings, crashes) goes to the API log
+        async for line in worker.process.stdout:
+            logger.info(f"Worker {worker.process.pid}: {line.decode().rstrip()}")
+
+    async def _acquire(self, model_name: str, max_seq_length: int, device: str) -> Tuple[TrainingWorker, bool]:
+        # Pick a worker or reserve a slot under the lock; stopping and starting workers (minutes for a
+        # cold model load) happens outside it, so other jobs can still get their workers meanwhile
+        evicted = None
+        async with self._lock:
+            self._workers = [w for w in self._workers if w.alive]
+            for worker in self._workers:
+                if worker.device == device and not worker.busy and worker.matches(model_name, max_seq_length):
+                    worker.busy = True
+                    return worker, True
+            on_device = [w for w in self._workers if w.device == device]
+            if len(on_device) + self._starting.get(device, 0) >= self.workers_per_device:
+                # Evict an idle worker holding a different base model to make room
+                idle = [w for w in on_device if not w.busy]
+                if not idle:
+                    raise RuntimeError(f"No free worker slot on device {device}")
+                evicted = idle[0]
+                self._workers.remove(evicted)
+            self._starting[device] = self._starting.get(device, 0) + 1
+        try:
+            if evicted is not None:
+                await evicted.stop()
+            worker = await self._spawn(model_name, max_seq_length, device)
+            worker.busy = True
+            self._workers.append(worker)
+        finally:
+            self._starting[device] -= 1
+        return worker, False
+
+    async def run_job(self, spec: Dict[str, Any], device: str, on_line: Callable[[str], None],
+                      on_start: Optional[Callable[[int], None]] = None,
+                      on_metrics: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Run a job spec on a resident worker, feeding log lines to `on_line`. Returns the worker's "done" message.
+
+        `on_start` is called with the worker's pid once the job has a worker, and
+        `on_metrics` with each training metrics event (see training_metrics.py).
+        """
+        max_seq_length = spec["parameters"]["max_seq_length"]
+        worker, warm = await self._acquire(spec["model_name"], max_seq_length, device)
+        if on_start is not None:
+            on_start(worker.process.pid)
+        on_line(f"Using {'resident' if warm else 'new'} worker (pid {worker.process.pid}, {worker.startup_info})")
+        try:
+            conn = await asyncio.to_thread(Client, worker.address, authkey=worker.authkey)
+            with conn:
+                conn.send(spec)
+                while True:
+                    message = await asyncio.to_thread(conn.recv)
+                    if message["type"] == "log":
+                        on_line(message["line"])
+                    elif message["type"] == "metrics":
+                        if on_metrics is not None:
+                            on_metrics(message["metrics"])
+                    elif message["type"] == "done":
+                        message["warm_start"] = warm
+                        return message
+        except (EOFError, OSError) as e:
+            return {"type": "done", "returncode": -1, "error": f"Worker connection lost: {e}", "warm_start": warm}
+        except BaseException:
+            # Cancelled mid-job: the worker may still be training, so it must not be handed another job
+            if worker.alive:
+                worker.process.kill()
+            if worker in self._workers:
+                self._workers.remove(worker)
+            raise
+        finally:
+            worker.busy = False
+
+    async def shutdown(self):
+        for worker in self._workers:
+            await worker.stop()
+        self._workers = []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident Unsloth training worker")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--max-seq-length", type=int, required=True)
+    parser.add_argument("--address", required=True)
+    args = parser.parse_args()
+    worker_main(args.model, args.max_seq_length, args.address, bytes.fromhex(os.environ["WORKER_AUTHKEY"]))